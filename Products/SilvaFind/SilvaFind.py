@@ -2,25 +2,32 @@
 # Copyright (c) 2006-2013 Infrae. All rights reserved.
 # See also LICENSE.txt
 
+import hashlib
 import operator
+import os
+import time
+from urllib import urlencode
 
 # Zope
 from AccessControl import ClassSecurityInfo, getSecurityManager
 from App.class_init import InitializeClass
 from OFS.SimpleItem import SimpleItem
 from Products.ZCTextIndex.ParseTree import ParseError
+from DateTime import DateTime
 from ZODB.PersistentMapping import PersistentMapping
 import Missing
 
 # Zope 3
 from five import grok
-from zope.component import getMultiAdapter
+from zope.component import getMultiAdapter, getUtility
 from zope.lifecycleevent import ObjectModifiedEvent
-from zope.traversing.browser import absoluteURL
+from zope.lifecycleevent.interfaces import IObjectModifiedEvent
 from zope.publisher.interfaces.browser import IBrowserRequest
 from zope.publisher.interfaces.browser import IDefaultBrowserLayer
 from zope.event import notify
+from zope.i18n.interfaces import IUserPreferredLanguages
 from zope import component
+from zope.traversing.browser import absoluteURL
 
 # Silva
 from Products.Silva.Content import Content
@@ -28,22 +35,37 @@ from Products.SilvaFind.i18n import translate as _
 from Products.Silva import SilvaPermissions
 
 from silva.core import conf as silvaconf
+from silva.core.layout.default import MainPage
+from silva.core.layout.interfaces import ISilvaLayer
 from silva.core.messages.interfaces import IMessageService
 from silva.core.smi.content import IEditScreen
 from silva.core.views import views as silvaviews
 from silva.core.views.httpheaders import HTTPResponseHeaders
 from silva.fanstatic import need
+from webdav.common import rfc1123_date
 from silva.ui.rest import Screen, FormWithTemplateREST
 from zeam.form import silva as silvaforms
 from zeam.utils.batch import batch
 from zeam.utils.batch.interfaces import IBatching
 
 # SilvaFind
+from Products.SilvaFind.catalog import ALLOWED_INDEX, MODIFICATION_COLUMN
+from Products.SilvaFind.catalog import PUBLIC_STATUS, SORT_ORDERS
+from Products.SilvaFind.catalog import STATUS_INDEX
+from Products.SilvaFind.catalog import allowed_tokens, highest_score, search
+from Products.SilvaFind.catalog import canonical, counter_time, get_counter
+from Products.SilvaFind.catalog import is_sortable, sortable_indexes
+from Products.SilvaFind.cursor import CURSOR_KEY, Cursor, decode_cursor
+from Products.SilvaFind.cursor import resume
+from Products.SilvaFind.lazy import Counted, FilteredResults
 from Products.SilvaFind.query import Query
-from Products.SilvaFind.interfaces import IFind
+from Products.SilvaFind.results.item import ResultItemFactory
+from Products.SilvaFind.snapshot import SNAPSHOT_KEY, new_token, query_key
+from Products.SilvaFind.snapshot import query_snapshot, take_snapshot
+from Products.SilvaFind.timing import get_timer, query_timer, report_timer
+from Products.SilvaFind.interfaces import IFind, IFindService
 from Products.SilvaFind.interfaces import ICriterionView
 from Products.SilvaFind.interfaces import IResultView
-from Products.SilvaFind.interfaces import IQueryPart
 
 
 class FindResponseHeaders(HTTPResponseHeaders):
@@ -52,8 +74,58 @@ class FindResponseHeaders(HTTPResponseHeaders):
     """
     grok.adapts(IBrowserRequest, IFind)
 
+    def __init__(self, request, context):
+        super(FindResponseHeaders, self).__init__(request, context)
+        # Results change with the catalog: caches must always
+        # revalidate them.
+        self.max_age = 0
+
     def cachable(self):
+        return (self.context.isCachable() and
+                super(FindResponseHeaders, self).cachable())
+
+    def other_headers(self, headers):
+        # Keep the Last-Modified header set by the view.
+        last_modified = self.response.getHeader('Last-Modified')
+        if last_modified:
+            headers.setdefault('Last-Modified', last_modified)
+        timer = query_timer(self.request)
+        if timer is not None:
+            report_timer(
+                timer, getUtility(IFindService), self.context, headers)
+        super(FindResponseHeaders, self).other_headers(headers)
+
+
+def not_modified(find, request, name):
+    """Set the cache validators of the response of the view name on
+    find. Return True if the client already has the response: its
+    status is then set to 304.
+    """
+    if request.get('REQUEST_METHOD', 'GET') not in ('GET', 'HEAD'):
         return False
+    validators = find.getCacheValidators(request, name)
+    if validators is None:
+        return False
+    etag, last_modified = validators
+    response = request.response
+    response.setHeader('ETag', etag)
+    response.setHeader('Last-Modified', rfc1123_date(last_modified))
+    fresh = False
+    match = request.get_header('If-None-Match')
+    if match is not None:
+        tags = [tag.strip() for tag in match.split(',')]
+        fresh = etag in tags or '*' in tags
+    else:
+        since = request.get_header('If-Modified-Since')
+        if since:
+            try:
+                since = DateTime(since.split(';')[0]).timeTime()
+            except Exception:
+                since = None
+            fresh = since is not None and int(last_modified) <= since
+    if fresh:
+        response.setStatus(304)
+    return fresh
 
 
 class IFindResources(IDefaultBrowserLayer):
@@ -74,6 +146,20 @@ class SilvaFind(Query, Content, SimpleItem):
     grok.implements(IFind)
     silvaconf.icon('SilvaFind.png')
 
+    # Index to sort the results on, relevance if empty.
+    sortOn = ''
+    sortOrder = 'ascending'
+    # Can the visitors choose the order of the results.
+    sortPublic = False
+    # Can the responses to anonymous visitors be cached.
+    publicCaching = False
+    # Are sorted results paged with a cursor instead of an offset.
+    cursorPaging = False
+    # Number of pages of results that can be displayed, 0 for all.
+    maxPageDepth = 0
+    # Key the cursors of the next page links are signed with.
+    _cursorSecret = None
+
     def __init__(self, id):
         Content.__init__(self, id)
         Query.__init__(self)
@@ -115,9 +201,78 @@ class SilvaFind(Query, Content, SimpleItem):
         # BBB map(bool) is here for previously non-boolean stored values
         return reduce(operator.or_, map(bool, self.shownFields.values()))
 
+    security.declareProtected(SilvaPermissions.View, 'getSortIndexes')
+    def getSortIndexes(self):
+        return sortable_indexes(self.get_root().service_catalog)
+
+    security.declareProtected(SilvaPermissions.View, 'getSortCriterias')
+    def getSortCriterias(self, request={}):
+        sort_on = self.sortOn
+        sort_order = self.sortOrder
+        if self.sortPublic:
+            form = getattr(request, 'form', request)
+            requested = form.get('sort_on')
+            if requested is not None:
+                if not requested or is_sortable(
+                    self.get_root().service_catalog, requested):
+                    sort_on = requested
+            requested = form.get('sort_order')
+            if requested in SORT_ORDERS:
+                sort_order = requested
+        if not sort_on:
+            return {}
+        return {'sort_on': sort_on, 'sort_order': sort_order}
+
+    security.declarePrivate('getCursorSecret')
+    def getCursorSecret(self):
+        """Return the key the cursors of the next page links are
+        signed with, so that their page number can't be changed.
+        """
+        if self._cursorSecret is None:
+            self._cursorSecret = os.urandom(20).encode('hex')
+        return self._cursorSecret
+
+    security.declareProtected(SilvaPermissions.View, 'isCachable')
+    def isCachable(self):
+        return bool(self.publicCaching and
+                    getSecurityManager().getUser().getId() is None)
+
+    security.declareProtected(SilvaPermissions.View, 'getCacheValidators')
+    def getCacheValidators(self, request, name=''):
+        if not self.isCachable():
+            return None
+        catalog = self.get_root().service_catalog
+        counter = get_counter(catalog)
+        if counter is None:
+            return None
+        form = getattr(request, 'form', request)
+        languages = IUserPreferredLanguages(
+            request).getPreferredLanguages()
+        key = canonical((
+                name,
+                self.getPhysicalPath(),
+                self.getSearchCriterias(request),
+                self.getSortCriterias(request),
+                form.get('bstart'),
+                form.get(SNAPSHOT_KEY),
+                form.get(CURSOR_KEY),
+                'search_submit' in form,
+                tuple(languages),
+                counter,
+                self._p_serial))
+        etag = '"%s"' % hashlib.md5(repr(key)).hexdigest()
+        last_modified = counter_time(catalog, counter)
+        modified = self.get_modification_datetime()
+        if modified is not None:
+            last_modified = max(last_modified, modified.timeTime())
+        return etag, last_modified
+
     security.declareProtected(SilvaPermissions.View, 'searchResults')
-    def searchResults(self, request={}, validate=True):
-        options = self.getSearchCriterias(request)
+    def searchResults(self, request={}, validate=True, limit=None,
+                      cursor=None):
+        timer = get_timer(request)
+        with timer.phase('criterias'):
+            options = self.getSearchCriterias(request)
         if validate:
             queryEmpty = True
             for key, value in options.items():
@@ -138,32 +293,82 @@ class SilvaFind(Query, Content, SimpleItem):
             if queryEmpty:
                 raise ValueError(
                     _(u'You need to fill at least one field in the search form.'))
-        options['publication_status'] = ['public']
+        options[STATUS_INDEX] = [PUBLIC_STATUS]
+        options.update(self.getSortCriterias(request))
+        keyset = None
+        if cursor is not None and 'sort_on' in options:
+            # Results are sorted on the index from the cursor on,
+            # instead of by the catalog from the first one.
+            keyset = (options.pop('sort_on'),
+                      options.pop('sort_order') == 'descending')
+        if limit and 'sort_on' in options:
+            # Let the catalog only sort the results we need.
+            options['sort_limit'] = limit
+        service = getUtility(IFindService)
+        if service.useCatalogSecurity():
+            options[ALLOWED_INDEX] = allowed_tokens(
+                getSecurityManager().getUser())
         catalog = self.get_root().service_catalog
+        cache = service.getResultCache()
+        start = time.time()
         try:
-            results = catalog.searchResults(options)
+            results = search(
+                catalog, options, cache, service.getSingleFlight())
         except ParseError:
+            timer.count('parse_errors')
             raise ValueError(
                 _(u'Search query contains only common or reserved words.'))
-
+        duration = time.time() - start
+        count = getattr(results, 'actual_result_count', None) or len(results)
+        timer.add('catalog', duration)
+        timer.count('searches')
+        timer.count('brains', count)
+        path = '/'.join(self.getPhysicalPath())
+        service.getStatistics().search(path, count)
+        if duration * 1000 >= service.slow_query_threshold:
+            log = service.getSlowQueryLog()
+            if log is not None:
+                log.add(options, path, duration, count)
+        if keyset is not None:
+            with timer.phase('keyset'):
+                results = resume(
+                    catalog, results, keyset[0], keyset[1], cursor, limit)
         return results
 
+    security.declareProtected(SilvaPermissions.View, 'filterResults')
+    def filterResults(self, results, more=None, factory=None, known=0):
+        check = None
+        if not getUtility(IFindService).useCatalogSecurity():
+            verify = getSecurityManager().checkPermission
+            check = lambda b: verify('View', b.getObject())
+        return FilteredResults(results, check, more, factory, known)
+
+    security.declareProtected(SilvaPermissions.View, 'countResults')
+    def countResults(self, request={}, validate=True, minimum=None):
+        results = self.filterResults(self.searchResults(request, validate))
+        return results.count(minimum)
+
+    def getQueryFields(self):
+        return filter(
+            lambda field: (self.shownFields.get(field.getName(), False) or
+                           field.getName() == 'path'),
+            self.getSearchFields())
+
     def getSearchCriterias(self, request):
-        options = {}
-        for field in self.getSearchFields():
-            name = field.getName()
-            if (self.shownFields.get(name, False) or name == 'path'):
-                queryPart = getMultiAdapter((field, self, request), IQueryPart)
-                value = queryPart.getIndexValue()
-                if value is None:
-                    value = ''
-                options[queryPart.getIndexId()] = value
-        return options
+        return self.getQueryPlan(request).getSearchCriterias(self, request)
 
 
 InitializeClass(SilvaFind)
 
 
+@grok.subscribe(IFind, IObjectModifiedEvent)
+def invalidate_query_plan(content, event):
+    content.invalidateQueryPlan()
+    # Settings are stored in sub-objects: mark the find as modified
+    # so the other database connections drop their query plan too.
+    content._p_changed = True
+
+
 class FindAddForm(silvaforms.SMIAddForm):
     """Add form for Silva Find.
     """
@@ -218,6 +423,26 @@ class FindEditView(FormWithTemplateREST):
             self.context.shownResultsFields[fieldName] = bool(
                 self.request.form.get('show_result_' + fieldName, False))
 
+        sort_on = self.request.form.get('sort_on', '')
+        if not sort_on or sort_on in self.sort_indexes:
+            self.context.sortOn = sort_on
+        sort_order = self.request.form.get('sort_order')
+        if sort_order in SORT_ORDERS:
+            self.context.sortOrder = sort_order
+        self.context.sortPublic = bool(
+            self.request.form.get('sort_public', False))
+        self.context.publicCaching = bool(
+            self.request.form.get('public_caching', False))
+        self.context.cursorPaging = bool(
+            self.request.form.get('cursor_paging', False))
+        if self.context.cursorPaging:
+            self.context.getCursorSecret()
+        try:
+            depth = int(self.request.form.get('max_page_depth') or 0)
+        except (TypeError, ValueError):
+            depth = self.context.maxPageDepth
+        self.context.maxPageDepth = max(depth, 0)
+
         notify(ObjectModifiedEvent(self.context))
         return self.send_message(_(u'Changes saved.'), type=u'feedback')
 
@@ -230,49 +455,95 @@ class FindEditView(FormWithTemplateREST):
             self.widgets.append(widget)
 
         self.title = self.context.get_title_or_id()
+        self.sort_indexes = self.context.getSortIndexes()
+        self.sort_orders = SORT_ORDERS
 
         if 'silvafind_save' in self.request.form:
             self.save()
 
 
+class FindPage(MainPage):
+    """Public page of a Silva Find. Conditional requests answered
+    with a 304 get an empty body, without rendering the layout.
+    """
+    grok.context(IFind)
+    grok.layer(ISilvaLayer)
+    grok.name('index.html')
+    grok.require('zope2.View')
+
+    def __call__(self):
+        if not_modified(self.context, self.request, 'content.html'):
+            return u''
+        return super(FindPage, self).__call__()
+
+
 class FindView(silvaviews.View):
     """View a Silva Find.
     """
     grok.context(IFind)
     resources = IFindResources
+    batch_size = 20
+    # Without the security index, the total is counted up to this.
+    count_minimum = 500
 
     def update(self):
         need(self.resources)
+        self.widgets = []
+        self.not_modified = not_modified(
+            self.context, self.request, 'content.html')
+        if self.not_modified:
+            return
         self.results = []
+        self.items = []
+        self.factory = ResultItemFactory(self.request)
+        self.total = None
+        self.total_exact = True
         self.result_widgets = []
         self.message = u''
         self.batch = u''
+        self.sort = self.context.getSortCriterias(self.request)
+        self.highest_score = None
+        self.cursor = None
+        self.offset = 0
+        self.first_url = None
+        self.next_url = None
+        self.fragment_context = None
+        self.fragments = getUtility(IFindService).getFragmentCache()
+        self.timer = get_timer(self.request)
+        self.timer.watch(
+            'woken', lambda: self.factory.computed.get('object', 0))
         # Search for results
         if 'search_submit' in self.request.form:
+            getUtility(IFindService).getStatistics().increment(
+                '/'.join(self.context.getPhysicalPath()), 'pages')
             try:
-                results = self.context.searchResults(self.request)
-            except ValueError as error:
-                self.message = error[0]
+                start = max(int(self.request.form.get('bstart', 0)), 0)
+            except (TypeError, ValueError):
+                start = 0
+            if (self.context.cursorPaging and self.sort and
+                'bstart' not in self.request.form):
+                # Pages are only requested with an offset when their
+                # sort key can't be written in a cursor.
+                self.cursor = decode_cursor(
+                    self.request.form.get(CURSOR_KEY),
+                    self.context.getCursorSecret(),
+                    repr(canonical(self.sort))) or Cursor()
+                start = self.cursor.page * self.batch_size
+            depth = self.context.maxPageDepth
+            if depth and start >= depth * self.batch_size:
+                self.message = _(
+                    u'Only the first ${depth} pages of results can be '
+                    u'displayed.', mapping={'depth': depth})
+            elif self.cursor is not None:
+                self.updateCursorPage(start)
             else:
-                # Filter results on View permission
-                # XXX This could be done more in a more lazy fashion
-                verify = getSecurityManager().checkPermission
-                self.results = batch(
-                    filter(lambda b: verify('View', b.getObject()), results),
-                    count=20,
-                    request=self.request)
-
-                if self.results:
-                    for field in self.context.getPublicResultFields():
-                        widget = getMultiAdapter(
-                            (field, self.context, self.request), IResultView)
-                        widget.update(self)
-                        self.result_widgets.append(widget)
-
-                    self.batch = component.getMultiAdapter(
-                        (self.context, self.results, self.request), IBatching)()
+                snapshot = self.getSnapshot(start)
+                if snapshot is not None:
+                    self.updateSnapshotPage(start, snapshot)
                 else:
-                    self.message = _(u'No items matched your search.')
+                    self.updateOffsetPage(start)
+            if not self.items and not self.message:
+                self.message = _(u'No items matched your search.')
 
         # Search Widgets
         self.widgets = []
@@ -281,28 +552,246 @@ class FindView(silvaviews.View):
                     field, self.context, self.request), ICriterionView)
             self.widgets.append(widget)
 
-
-def brain_date(brain, key):
-    """Read a date out of a catalog brain.
-    """
-    if key in brain:
-        value = brain[key]
-        if value not in (Missing.Value, None):
-            return value.HTML4()
-    return ''
-
-
-class FindSitemap(grok.View):
-    grok.context(IFind)
-    grok.require('zope2.View')
-    grok.name('sitemap.xml')
-
-    def update(self):
-        self.results = []
-        for brain in self.context.searchResults(self.request, validate=False):
-            self.results.append(
-                {'url': absoluteURL(brain, self.request),
-                 'lastmod': brain_date(brain, 'silva-extramodificationtime')})
-        self.response.setHeader(
-            'Content-Type',
-            'application/xml;charset=utf-8')
+    def updateCursorPage(self, start):
+        """Display the page of sorted results at the cursor. Results
+        are only sorted from the cursor on: the cost of a page doesn't
+        depend on its depth.
+        """
+        try:
+            results = self.context.searchResults(
+                self.request, limit=self.batch_size + 1, cursor=self.cursor)
+        except ValueError as error:
+            self.message = error[0]
+            return
+        results = self.prepareResults(
+            results,
+            lambda: self.context.searchResults(
+                self.request, cursor=self.cursor))
+        shown = self.context.isResultShown('totalresultcount')
+        with self.timer.phase('filter'):
+            if not results.fetch(1):
+                return
+            # Results start at the cursor, after the full pages before
+            # it. One more result than the page tells if there is a
+            # next page.
+            minimum = self.batch_size + 1
+            if shown:
+                minimum = max(self.count_minimum - start, minimum)
+            count, exact = results.count(minimum)
+            self.results = batch(
+                Counted(results, count), count=self.batch_size)
+            self.items = list(self.results)
+            self.offset = start
+            if shown:
+                self.total = start + count
+                self.total_exact = exact
+        with self.timer.phase('batch'):
+            self.setCursorLinks(count > self.batch_size)
+
+    def updateSnapshotPage(self, start, snapshot):
+        """Display the page of results at the offset start, out of
+        the snapshot of the results taken for the first page.
+        """
+        catalog = self.context.service_catalog
+        self.timer.count('snapshots')
+        self.highest_score = snapshot.highest
+        results = self.prepareResults(
+            snapshot.results(catalog),
+            lambda: snapshot.extend(
+                catalog, self.context.searchResults(self.request)),
+            snapshot.known)
+        self.batchResults(results, start, snapshot)
+
+    def updateOffsetPage(self, start):
+        """Display the page of results at the offset start. Sorted
+        results are only sorted up to this page, and the first result
+        of the next one.
+        """
+        try:
+            results = self.context.searchResults(
+                self.request, limit=start + self.batch_size + 1)
+        except ValueError as error:
+            self.message = error[0]
+            return
+        self.highest_score = highest_score(results)
+        results = self.prepareResults(
+            results, lambda: self.context.searchResults(self.request))
+        self.batchResults(results, start)
+
+    def prepareResults(self, results, more, known=0):
+        """Set up the result fields, and return the results filtered
+        on the View permission, only as far as the page needs it, if
+        the catalog didn't. The results are woken up once for the
+        check and all the result fields.
+        """
+        for field in self.context.getPublicResultFields():
+            widget = getMultiAdapter(
+                (field, self.context, self.request), IResultView)
+            widget.update(self)
+            self.result_widgets.append(widget)
+        # Render the results out of the catalog, if all the result
+        # fields can.
+        self.factory.columns = self.getCatalogColumns()
+        return self.context.filterResults(
+            results, more, self.factory, known)
+
+    def batchResults(self, results, start, snapshot=None):
+        """Batch the filtered results at the offset start, and store
+        a snapshot of them for the next pages.
+        """
+        shown = self.context.isResultShown('totalresultcount')
+        with self.timer.phase('filter'):
+            if not results.fetch(1):
+                return
+            # The batch is given the number of results known to be
+            # accepted, up to the page after the current one, so that
+            # its pages are not computed from the unfiltered results.
+            minimum = start + self.batch_size + 1
+            if shown:
+                minimum = max(self.count_minimum, minimum)
+            count, exact = results.count(minimum)
+            self.results = batch(
+                Counted(results, count), start=start, count=self.batch_size)
+            self.items = list(self.results)
+            self.offset = start
+            if shown:
+                self.total = count
+                self.total_exact = exact
+        if self.items:
+            with self.timer.phase('batch'):
+                if self.results.batch_length() > 1:
+                    self.storeSnapshot(results, snapshot)
+                self.batch = component.getMultiAdapter(
+                    (self.context, self.results, self.request), IBatching)()
+
+    def getCursorURL(self, cursor=None, start=None):
+        """Return the URL of the page of the search at cursor, or at
+        the offset start, or of its first page.
+        """
+        form = dict(
+            (key, value) for key, value in self.request.form.items()
+            if not key.startswith('bstart') and
+            key not in (CURSOR_KEY, SNAPSHOT_KEY))
+        if cursor is not None:
+            form[CURSOR_KEY] = cursor
+        if start is not None:
+            form['bstart'] = start
+        return '%s?%s' % (
+            absoluteURL(self.context, self.request), urlencode(form))
+
+    def setCursorLinks(self, following):
+        """Set the links to the first page and to the next one, if
+        there are more results and the maximum depth is not reached.
+        """
+        if not self.cursor.first:
+            self.first_url = self.getCursorURL()
+        depth = self.context.maxPageDepth
+        if following and not (depth and self.cursor.page + 1 >= depth):
+            cursor = self.cursor.following(
+                self.context.service_catalog, self.sort['sort_on'],
+                self.items[-1].getRID())
+            encoded = cursor.encode(
+                self.context.getCursorSecret(), repr(canonical(self.sort)))
+            if encoded is not None:
+                self.next_url = self.getCursorURL(encoded)
+            else:
+                # The sort key can't be written in a cursor, the next
+                # page is found with its offset instead.
+                self.next_url = self.getCursorURL(
+                    start=cursor.page * self.batch_size)
+
+    def getSnapshot(self, start):
+        """Return the snapshot of the results taken for a previous
+        page of the same search, or None.
+        """
+        service = getUtility(IFindService)
+        self.snapshots = service.getSnapshotCache()
+        self.snapshot_owner = (
+            '/'.join(self.context.getPhysicalPath()),
+            getSecurityManager().getUser().getId())
+        # Snapshots taken before roles changed, in any process, are
+        # not used.
+        self.snapshot_query = (
+            query_key(self.request.form), service.getSecurityGeneration())
+        snapshot = query_snapshot(
+            self.snapshots, self.request.form.get(SNAPSHOT_KEY),
+            self.snapshot_owner, self.snapshot_query)
+        if snapshot is None:
+            return None
+        stop = start + self.batch_size
+        if self.context.isResultShown('totalresultcount'):
+            stop = max(stop, self.count_minimum)
+        if not snapshot.exists(self.context.service_catalog, start, stop):
+            # Results have been removed from the catalog since.
+            return None
+        return snapshot
+
+    def storeSnapshot(self, results, snapshot):
+        """Store a snapshot of the filtered results, and add its token
+        to the request, so it is kept in the batch links.
+        """
+        if self.snapshots is None:
+            return
+        if snapshot is not None:
+            token = self.request.form[SNAPSHOT_KEY]
+            if results.checked == results.known:
+                # Nothing has been checked since the snapshot.
+                return
+        else:
+            token = new_token()
+        self.snapshots.set(token, take_snapshot(
+                results, self.snapshot_owner, self.snapshot_query,
+                getUtility(IFindService).useCatalogSecurity()))
+        self.request.form[SNAPSHOT_KEY] = token
+
+    def getCatalogColumns(self):
+        """Return the catalog columns needed to render all the result
+        fields without waking up the results, or None if they can't.
+        """
+        columns = set()
+        for widget in self.result_widgets:
+            if widget.catalogColumns is None:
+                return None
+            columns.update(widget.catalogColumns)
+        if not columns.issubset(self.context.service_catalog.schema()):
+            return None
+        return frozenset(columns)
+
+    def getFragmentKey(self, widget, item):
+        """Return the key to cache the rendering of widget for item,
+        or None if it cannot be cached.
+        """
+        if self.fragments is None or not widget.cacheable:
+            return None
+        modified = getattr(item.brain, MODIFICATION_COLUMN, None)
+        if modified in (Missing.Value, None):
+            return None
+        settings = widget.getCacheKey(item)
+        if settings is None:
+            return None
+        if self.fragment_context is None:
+            # Rendered URLs and dates depend on the virtual host and
+            # the language of the request.
+            languages = IUserPreferredLanguages(
+                self.request).getPreferredLanguages()
+            self.fragment_context = (
+                self.request.physicalPathToURL(''), tuple(languages))
+        return (item.getRID(), widget.result.getName(), modified,
+                settings, self.fragment_context)
+
+    def render_widget(self, widget, item):
+        """Render a result field for a result item, out of the
+        fragment cache if possible.
+        """
+        key = self.getFragmentKey(widget, item)
+        if key is not None:
+            fragment = self.fragments.get(key)
+            if fragment is not None:
+                self.timer.count('fragments')
+                return fragment[0]
+        with self.timer.phase('render.' + widget.result.getName()):
+            html = widget.render(item)
+        self.timer.count('widgets')
+        if key is not None:
+            self.fragments.set(key, (html,))
+        return html
@@ -7,6 +7,8 @@ from silva.core import conf as silvaconf
 from zope.interface import Interface
 from zope.component import getUtility, queryUtility
 
+from Products.SilvaFind.catalog import install_result_columns
+from Products.SilvaFind.catalog import install_security_index
 from Products.SilvaFind.interfaces import IFindService
 from silva.core.services.interfaces import ICatalogService
 
@@ -35,6 +37,9 @@ class SilvaFindInstaller(DefaultInstaller):
             if field_index not in indexes:
                 raise ValueError(
                     u'Name "%s" not indexed by the catalog' % field_index)
+        # The index is filled when the find service rebuilds it.
+        install_security_index(root, catalog)
+        install_result_columns(root, catalog)
 
 install = SilvaFindInstaller('SilvaFind', IExtension)
 
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+import threading
+import time
+
+from collections import OrderedDict
+
+_marker = object()
+
+
+class LRUCache(object):
+    """Thread-safe bounded mapping. The least recently used entries
+    are evicted first. If ttl is set, entries expire after ttl
+    seconds.
+    """
+
+    def __init__(self, size, ttl=0):
+        self.lock = threading.Lock()
+        self.size = size
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.data.pop(key, _marker)
+            if entry is not _marker:
+                value, expires = entry
+                if not expires or expires > time.time():
+                    self.data[key] = entry
+                    self.hits += 1
+                    return value
+                self.evictions += 1
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        expires = 0
+        if self.ttl:
+            expires = time.time() + self.ttl
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = (value, expires)
+            self._evict()
+
+    def _evict(self):
+        while len(self.data) > self.size:
+            self.data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key=_marker, predicate=None):
+        """Remove the given key, the keys for which predicate is
+        true, or everything if none of them are given.
+        """
+        with self.lock:
+            if key is not _marker:
+                self.data.pop(key, None)
+            elif predicate is not None:
+                for key in [key for key in self.data if predicate(key)]:
+                    del self.data[key]
+            else:
+                self.data.clear()
+
+    def configure(self, size, ttl=0):
+        with self.lock:
+            self.size = size
+            self.ttl = ttl
+            self._evict()
+
+    def statistics(self):
+        return {'size': len(self.data),
+                'capacity': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
+
+
+class _Flight(object):
+    """A computation in progress.
+    """
+    __slots__ = ('done', 'followers', 'value', 'failed')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.followers = 0
+        self.value = None
+        self.failed = False
+
+
+class SingleFlight(object):
+    """Run a computation only once for the threads asking for it at
+    the same time with the same key. Threads waiting for more than
+    timeout seconds run it themselves.
+    """
+
+    def __init__(self, timeout):
+        self.lock = threading.Lock()
+        self.timeout = timeout
+        self.flights = {}
+        self.leaders = 0
+        self.followers = 0
+        self.timeouts = 0
+
+    def do(self, key, compute, share=lambda value: value):
+        """Return a tuple (value, shared). If another thread is
+        computing key, value is what share returned for the value it
+        computed, and shared is True. Otherwise value is the one
+        returned by compute, and share is only called if other
+        threads waited for it.
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = self.flights[key] = _Flight()
+                self.leaders += 1
+                leader = True
+            else:
+                flight.followers += 1
+                self.followers += 1
+                leader = False
+        if not leader:
+            if flight.done.wait(self.timeout) and not flight.failed:
+                return flight.value, True
+            with self.lock:
+                self.timeouts += 1
+            return compute(), False
+        try:
+            value = compute()
+        except:
+            with self.lock:
+                del self.flights[key]
+            flight.failed = True
+            flight.done.set()
+            raise
+        with self.lock:
+            # No thread can wait for it after this.
+            del self.flights[key]
+            followers = flight.followers
+        try:
+            if followers:
+                flight.value = share(value)
+        except:
+            flight.failed = True
+            raise
+        finally:
+            flight.done.set()
+        return value, False
+
+    def statistics(self):
+        return {'leaders': self.leaders,
+                'followers': self.followers,
+                'timeouts': self.timeouts}
+
+
+_caches_lock = threading.Lock()
+_caches = {}
+
+
+def get_cache(name, owner, size, ttl=0):
+    """Return the process wide cache called name for the given owner
+    (usually a physical path), configured with size and ttl.
+    """
+    key = (name, owner)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = LRUCache(size, ttl)
+    if cache.size != size or cache.ttl != ttl:
+        cache.configure(size, ttl)
+    return cache
+
+
+def query_caches(owner):
+    """Return the caches created for the given owner, by name.
+    """
+    with _caches_lock:
+        return dict((key[0], cache) for key, cache in _caches.items()
+                    if key[1] == owner)
+
+
+_flights_lock = threading.Lock()
+_flights = {}
+
+
+def get_single_flight(owner, timeout):
+    """Return the process wide single flight for the given owner
+    (usually a physical path), configured with timeout.
+    """
+    with _flights_lock:
+        flights = _flights.get(owner)
+        if flights is None:
+            flights = _flights[owner] = SingleFlight(timeout)
+    flights.timeout = timeout
+    return flights
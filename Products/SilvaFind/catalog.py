@@ -0,0 +1,400 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+from array import array
+import time
+
+from AccessControl.PermissionRole import rolesForPermissionOn
+from Acquisition import Implicit, aq_base, aq_inner, aq_parent
+from DateTime import DateTime
+from Products.ZCatalog.Lazy import LazyMap
+from silva.core.interfaces import IContainer, IImage, IVersion
+from silva.core.views.interfaces import IDisableBreadcrumbTag
+
+
+# Index used to filter results on the View permission in the catalog.
+ALLOWED_INDEX = 'allowedRolesAndUsers'
+# Index of the publication status, and status of the searched content.
+STATUS_INDEX = 'publication_status'
+PUBLIC_STATUS = 'public'
+# Metadata columns used to render results without waking them up.
+TITLE_COLUMN = 'get_title_or_id'
+MODIFICATION_COLUMN = 'silva-extramodificationtime'
+CONTENT_PATH_COLUMN = 'silvafind_content_path'
+CONTENT_TYPE_COLUMN = 'silvafind_content_type'
+BREADCRUMB_COLUMN = 'silvafind_breadcrumb'
+THUMBNAIL_COLUMN = 'silvafind_thumbnail_path'
+RESULT_COLUMNS = (
+    TITLE_COLUMN, MODIFICATION_COLUMN,
+    CONTENT_PATH_COLUMN, CONTENT_TYPE_COLUMN, BREADCRUMB_COLUMN,
+    THUMBNAIL_COLUMN)
+# Index types that keep a value per document, and can sort.
+SORTABLE_INDEXES = ('FieldIndex', 'DateIndex')
+# Possible sort orders.
+SORT_ORDERS = ('ascending', 'descending')
+
+
+def canonical(value):
+    """Return a hashable canonical version of a catalog query value.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted(
+                (key, canonical(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(canonical(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(canonical(item) for item in value))
+    if isinstance(value, DateTime):
+        return ('DateTime', value.timeTime())
+    try:
+        hash(value)
+    except TypeError:
+        return repr(value)
+    return value
+
+
+def sortable_indexes(catalog):
+    """Return the ids of the indexes the catalog can sort on.
+    """
+    return sorted(
+        name for name in catalog.indexes()
+        if is_sortable(catalog, name))
+
+
+def is_sortable(catalog, name):
+    """Return True if the catalog can sort on the index name.
+    """
+    try:
+        index = catalog.Indexes[name]
+    except KeyError:
+        return False
+    return getattr(index, 'meta_type', None) in SORTABLE_INDEXES
+
+
+def get_counter(catalog):
+    """Return the change counter of the catalog, or None if the
+    catalog doesn't have one.
+    """
+    getCounter = getattr(catalog, 'getCounter', None)
+    if getCounter is None:
+        return None
+    return getCounter()
+
+
+def content_rids(catalog, content, versions=True):
+    """Return the record ids of content in the catalog, and the ones
+    of the objects cataloged inside it (its versions) if versions is
+    True.
+    """
+    path = '/'.join(content.getPhysicalPath())
+    rids = set()
+    rid = catalog.getrid(path)
+    if rid is not None:
+        rids.add(rid)
+    if versions:
+        uids = catalog._catalog.uids
+        # '0' is the character following '/'.
+        for key in uids.keys(path + '/', path + '0', excludemax=True):
+            rids.add(uids[key])
+    return rids
+
+
+# Time at which this process first saw the change counter of a catalog.
+_counter_times = {}
+
+
+def counter_time(catalog, counter):
+    """Return the time at which the change counter of the catalog was
+    seen for the first time by this process. It follows the last
+    change of the catalog.
+    """
+    key = catalog.getPhysicalPath()
+    seen = _counter_times.get(key)
+    if seen is None or seen[0] != counter:
+        seen = _counter_times[key] = (counter, time.time())
+    return seen[1]
+
+
+def result_rids(results):
+    """Return the record ids and the scores (or None) of a catalog
+    result.
+    """
+    rids = array('i')
+    scores = None
+    sequence = getattr(results, '_seq', None)
+    if type(results) is LazyMap and sequence is not None:
+        # Read the record ids from the lazy result without creating
+        # the brains. Scored results contain (score, rid) tuples.
+        for item in sequence:
+            if isinstance(item, tuple):
+                if scores is None:
+                    scores = array('d')
+                scores.append(item[0])
+                rids.append(item[1])
+            else:
+                rids.append(item)
+        if scores is None or len(scores) == len(rids):
+            return rids, scores
+        rids = array('i')
+        scores = None
+    for brain in results:
+        rids.append(brain.getRID())
+        score = getattr(brain, 'data_record_score_', None)
+        if score is not None:
+            if scores is None:
+                scores = array('d')
+            scores.append(score)
+    if scores is not None and len(scores) != len(rids):
+        scores = None
+    return rids, scores
+
+
+def iter_brains(results):
+    """Iterate over the brains of a catalog result without keeping
+    them in the result, like a LazyMap does.
+    """
+    sequence = getattr(results, '_seq', None)
+    func = getattr(results, '_func', None)
+    if type(results) is LazyMap and sequence is not None and func is not None:
+        for item in sequence:
+            yield func(item)
+    else:
+        for brain in results:
+            yield brain
+
+
+def highest_score(results):
+    """Return the highest fulltext score of a catalog result, or None
+    if the result is not scored.
+    """
+    sequence = getattr(results, '_seq', None)
+    if type(results) is LazyMap and sequence:
+        # Scored results are sorted on relevance by the catalog,
+        # the highest score is first.
+        item = sequence[0]
+        if isinstance(item, tuple):
+            return item[0]
+    return None
+
+
+class ResultSet(object):
+    """Compact version of a catalog result, that can be turned back
+    into brains.
+    """
+    __slots__ = ('counter', 'rids', 'scores', 'count')
+
+    def __init__(self, results, counter):
+        self.counter = counter
+        self.rids, self.scores = result_rids(results)
+        self.count = getattr(results, 'actual_result_count', len(self.rids))
+
+    def __len__(self):
+        return len(self.rids)
+
+    def results(self, catalog):
+        records = catalog._catalog
+        if self.scores is None:
+            return LazyMap(
+                records.__getitem__, self.rids, len(self.rids),
+                actual_result_count=self.count)
+
+        highest = max(self.scores) if self.scores else 1.0
+
+        def getScoredResult(item):
+            score, rid = item
+            brain = records[rid]
+            brain.data_record_score_ = score
+            brain.data_record_normalized_score_ = int(
+                100.0 * score / (highest or 1.0))
+            return brain
+
+        return LazyMap(
+            getScoredResult, zip(self.scores, self.rids), len(self.rids),
+            actual_result_count=self.count)
+
+
+def search(catalog, options, cache=None, flights=None):
+    """Query the catalog with options. If a cache is given, the
+    record ids of the result are cached for the current state of
+    the catalog. If flights is given, identical queries running at
+    the same time on the same state of the catalog share the record
+    ids of the first one.
+    """
+    if cache is None and flights is None:
+        return catalog.searchResults(options)
+    counter = get_counter(catalog)
+    if counter is None:
+        # There is no way to know if the catalog changed.
+        return catalog.searchResults(options)
+    key = canonical(options)
+    if cache is not None:
+        entry = cache.get(key)
+        if entry is not None and entry.counter == counter:
+            return entry.results(catalog)
+    if flights is None:
+        results = catalog.searchResults(options)
+        cache.set(key, ResultSet(results, counter))
+        return results
+    # Brains belong to the database connection of their thread: only
+    # the record ids are shared with the other threads.
+    entries = []
+
+    def share(results):
+        entries.append(ResultSet(results, counter))
+        return entries[0]
+
+    results, shared = flights.do(
+        (catalog.getPhysicalPath(), key, counter),
+        lambda: catalog.searchResults(options), share)
+    if shared:
+        entry = results
+        results = entry.results(catalog)
+    elif cache is not None:
+        entry = entries[0] if entries else ResultSet(results, counter)
+    if cache is not None:
+        cache.set(key, entry)
+    return results
+
+
+def merged_local_roles(content):
+    """Return the local roles defined on content and its parents.
+    """
+    merged = {}
+    obj = aq_inner(content)
+    while obj is not None:
+        local_roles = getattr(aq_base(obj), '__ac_local_roles__', None)
+        if callable(local_roles):
+            local_roles = local_roles()
+        for userid, roles in (local_roles or {}).items():
+            merged.setdefault(userid, set()).update(roles)
+        if getattr(aq_base(obj), '__ac_local_roles_block__', None):
+            break
+        obj = aq_parent(obj)
+    return merged
+
+
+def allowed_roles_and_users(content):
+    """Return the roles and users (prefixed with user:) allowed to
+    view content.
+    """
+    allowed = set(rolesForPermissionOn('View', content))
+    for userid, roles in merged_local_roles(content).items():
+        if allowed.intersection(roles):
+            allowed.add('user:%s' % userid)
+    allowed.discard('Owner')
+    return sorted(allowed)
+
+
+def allowed_tokens(user):
+    """Return the values to query the security index with, for the
+    given user.
+    """
+    tokens = set(user.getRoles())
+    tokens.add('Anonymous')
+    tokens.add('user:%s' % user.getId())
+    getGroups = getattr(user, 'getGroups', None)
+    if getGroups is not None:
+        tokens.update('user:%s' % group for group in getGroups())
+    return sorted(tokens)
+
+
+class CatalogAttribute(Implicit):
+    # Installed on the Silva root, it is acquired by all the content
+    # when the catalog reads the attribute to index or to store as
+    # metadata. It is then called, and computes the value out of
+    # the content it has been acquired from. There is purposely no
+    # docstring, so it cannot be published.
+
+    def __call__(self):
+        return self.compute(aq_parent(self))
+
+    def compute(self, content):
+        raise NotImplementedError
+
+
+class AllowedRolesAndUsers(CatalogAttribute):
+
+    def compute(self, content):
+        return allowed_roles_and_users(content)
+
+
+def silva_object(content):
+    if IVersion.providedBy(content):
+        return content.get_silva_object()
+    return content
+
+
+class ContentPath(CatalogAttribute):
+
+    def compute(self, content):
+        return '/'.join(silva_object(content).getPhysicalPath())
+
+
+class ContentType(CatalogAttribute):
+
+    def compute(self, content):
+        return silva_object(content).meta_type
+
+
+class BreadcrumbTitle(CatalogAttribute):
+    # Only containers appear in the breadcrumbs of the results. The
+    # ones that are left out of their breadcrumbs have no title, so
+    # that their breadcrumbs are computed by their adapter.
+
+    def compute(self, content):
+        if (not IContainer.providedBy(content) or
+            IDisableBreadcrumbTag.providedBy(content)):
+            return None
+        return content.get_short_title()
+
+
+class ThumbnailPath(CatalogAttribute):
+    # Physical path of the thumbnail of images, None for the other
+    # content and images without thumbnail.
+
+    def compute(self, content):
+        if not IImage.providedBy(content):
+            return None
+        thumbnail = content.thumbnail_image
+        if thumbnail is None:
+            return None
+        return '/'.join(thumbnail.getPhysicalPath())
+
+
+def install_attribute(root, name, factory):
+    if getattr(aq_base(root), name, None) is None:
+        setattr(root, name, factory())
+
+
+def install_security_index(root, catalog):
+    """Install the security index in the catalog.
+    """
+    install_attribute(root, ALLOWED_INDEX, AllowedRolesAndUsers)
+    if ALLOWED_INDEX not in catalog.indexes():
+        catalog.addIndex(ALLOWED_INDEX, 'KeywordIndex')
+
+
+def install_result_columns(root, catalog):
+    """Install the metadata columns used to render results without
+    waking them up.
+    """
+    install_attribute(root, CONTENT_PATH_COLUMN, ContentPath)
+    install_attribute(root, CONTENT_TYPE_COLUMN, ContentType)
+    install_attribute(root, BREADCRUMB_COLUMN, BreadcrumbTitle)
+    install_attribute(root, THUMBNAIL_COLUMN, ThumbnailPath)
+    columns = catalog.schema()
+    for name in RESULT_COLUMNS:
+        if name not in columns:
+            catalog.addColumn(name)
+
+
+def reindex_security(catalog, content):
+    """Update the security index for content and everything below
+    it.
+    """
+    path = '/'.join(content.getPhysicalPath())
+    for brain in catalog(path=path):
+        catalog.catalog_object(
+            brain._unrestrictedGetObject(), brain.getPath(),
+            idxs=[ALLOWED_INDEX], update_metadata=0)
@@ -31,11 +31,12 @@ class MetadataCriterionField:
         return self.elementName
 
     def getMetadataElement(self):
-        if not hasattr(self, '_v_element'):
-            service = getUtility(IMetadataService)
-            metadata_set = service.getMetadataSet(self.setName)
-            self._v_element = metadata_set.getElement(self.elementName)
-        return self._v_element
+        # Fields are shared between threads by the find service
+        # schema cache: the element is looked up by name, through
+        # the database connection of the current request.
+        service = getUtility(IMetadataService)
+        metadata_set = service.getMetadataSet(self.setName)
+        return metadata_set.getElement(self.elementName)
 
     def getName(self):
         return "%s-%s" % (self.setName, self.elementName)
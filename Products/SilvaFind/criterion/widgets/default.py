@@ -102,6 +102,9 @@ class CriterionView(grok.MultiAdapter):
 
     getIndexValue = getWidgetValue
 
+    def getRequestKeys(self):
+        return (self.name,)
+
     # Proxy criterion information mainly for BBB in edit view
 
     def canBeShown(self):
@@ -47,6 +47,9 @@ class MetadataCriterionView(CriterionView):
         value = set_values.get(element_name, None)
         return convertValue(value)
 
+    def getRequestKeys(self):
+        return (self.criterion.getSetName(),)
+
 
 class RangeMetadataCriterionTemplateView(CriterionTemplateView):
     grok.baseclass()
@@ -86,6 +89,9 @@ class RangeMetadataCriterionTemplateView(CriterionTemplateView):
         # XXX It will be better to store directly converted objects
         return (value_begin, value_end)
 
+    def getRequestKeys(self):
+        return (self.name + '-begin', self.name + '-end')
+
     def getIndexValue(self):
          return self.constructQuery(self.getWidgetValue())
 
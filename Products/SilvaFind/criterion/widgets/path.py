@@ -33,6 +33,7 @@ class PathCriterionData(CriterionData):
         return None
 
     def setValue(self, value):
+        self.query.invalidateQueryPlan()
         if value is None:
             self.service.delete_reference(self.query, name=self.name)
             return
@@ -79,6 +80,12 @@ class PathCriterionView(CriterionTemplateView):
         except (ValueError, TypeError):
             return 0
 
+    def getRequestKeys(self):
+        # The index value is the current path of the stored target,
+        # that changes if it is moved or renamed: it cannot be kept
+        # in the query plan.
+        return None
+
     def getIndexValue(self):
         content = self.data.getValue()
         if content is None:
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+from array import array
+from ast import literal_eval
+import base64
+import binascii
+import hashlib
+import heapq
+import hmac
+import time
+
+from Acquisition import aq_base
+from BTrees.IIBTree import IISet, difference, intersection, multiunion
+from DateTime import DateTime
+from Products.ZCatalog.Lazy import LazyMap
+
+from Products.SilvaFind.catalog import result_rids
+from Products.SilvaFind.snapshot import Records
+
+# Form parameter carrying the cursor in the next page links.
+CURSOR_KEY = 'cursor'
+# Longest encoded cursor that is decoded.
+CURSOR_LENGTH = 1024
+
+_marker = object()
+
+
+def encode_key(key):
+    """Return the sort key as a value that can be written, and the
+    type to decode it with (or None).
+    """
+    if isinstance(key, DateTime):
+        return key.micros(), 'DateTime'
+    return key, None
+
+
+def sign(secret, data, scope):
+    """Return the signature of the encoded cursor data, for the
+    sort scope.
+    """
+    return hmac.new(
+        secret, '%s\n%s' % (scope, data), hashlib.sha1).hexdigest()
+
+
+def decode_key(value, kind):
+    """Return the sort key written with encode_key.
+    """
+    if kind is None:
+        return value
+    if kind != 'DateTime' or not isinstance(value, (int, long)):
+        raise ValueError(kind)
+    # The date is parsed back to the same microsecond.
+    seconds, micros = divmod(value, 1000000)
+    return DateTime('%s.%06d UTC' % (
+            time.strftime('%Y/%m/%d %H:%M:%S', time.gmtime(seconds)),
+            micros))
+
+
+class Cursor(object):
+    """Position in results sorted on an index: the number of pages
+    before it, and the sort key and record id of the last result of
+    the previous page. The cursor of the first page has none.
+    """
+    __slots__ = ('page', 'key', 'rid')
+
+    def __init__(self, page=0, key=None, rid=None):
+        self.page = page
+        self.key = key
+        self.rid = rid
+
+    @property
+    def first(self):
+        return self.rid is None
+
+    def following(self, catalog, sort_on, rid):
+        """Return the cursor of the page following the result rid.
+        """
+        keys = catalog._catalog.getIndex(sort_on).documentToKeyMap()
+        return Cursor(self.page + 1, keys[rid], rid)
+
+    def encode(self, secret, scope=''):
+        """Return the cursor as a string to put in a URL, signed with
+        secret for the sort scope, or None if its sort key cannot be
+        written.
+        """
+        key, kind = encode_key(self.key)
+        value = (self.page, key, self.rid, kind)
+        data = repr(value)
+        try:
+            if literal_eval(data) != value:
+                return None
+        except (ValueError, SyntaxError):
+            return None
+        data = base64.urlsafe_b64encode(data)
+        return '%s.%s' % (data, sign(secret, data, scope))
+
+
+def decode_cursor(value, secret, scope=''):
+    """Return the cursor encoded in value, or None if it is not a
+    valid one, or was not signed with secret for the sort scope: the
+    page number of a cursor can't be changed.
+    """
+    if not isinstance(value, basestring) or len(value) > CURSOR_LENGTH:
+        return None
+    try:
+        data, signature = str(value).rsplit('.', 1)
+    except (ValueError, UnicodeError):
+        return None
+    if not hmac.compare_digest(signature, sign(secret, data, scope)):
+        return None
+    try:
+        page, key, rid, kind = literal_eval(base64.urlsafe_b64decode(data))
+        key = decode_key(key, kind)
+    except (TypeError, ValueError, SyntaxError, binascii.Error):
+        return None
+    if not (isinstance(page, int) and isinstance(rid, int)) or page < 1:
+        return None
+    return Cursor(page, key, rid)
+
+
+def result_set(results):
+    """Return the record ids of a catalog result as a set, and their
+    scores by record id (or None).
+    """
+    sequence = getattr(results, '_seq', None)
+    if (type(results) is LazyMap and sequence is not None and
+        not (len(sequence) and isinstance(sequence[0], tuple))):
+        # Unscored record ids are copied without a loop in Python.
+        return IISet(sequence), None
+    rids, scores = result_rids(results)
+    if scores is not None:
+        scores = dict(zip(rids, scores))
+    return IISet(rids), scores
+
+
+def as_set(value):
+    """Return the record ids of an index entry as a set.
+    """
+    if isinstance(value, int):
+        return IISet((value,))
+    return value
+
+
+def after_cursor(tree, rs, reverse, cursor):
+    """Return the record ids of rs that are in the index tree, after
+    the cursor.
+    """
+    if reverse:
+        values = tree.values(max=cursor.key)
+    else:
+        values = tree.values(min=cursor.key)
+    rs = intersection(rs, multiunion(values))
+    if not cursor.first:
+        # Ties are sorted on ascending record ids in both orders.
+        bucket = tree.get(cursor.key)
+        if bucket is not None:
+            rs = difference(
+                rs, IISet(as_set(bucket).keys(max=cursor.rid)))
+    return rs
+
+
+def walk(tree, rs, reverse, cursor, limit):
+    """Return the first limit record ids of rs in the order of the
+    index tree, from the cursor on. Return None if more index keys
+    than results would be visited.
+    """
+    if reverse:
+        ascending = tree.items(max=cursor.key)
+        items = (ascending[position]
+                 for position in xrange(len(ascending) - 1, -1, -1))
+    else:
+        items = tree.items(min=cursor.key)
+    rids = array('i')
+    budget = len(rs)
+    for key, value in items:
+        if limit is not None and len(rids) >= limit:
+            break
+        budget -= 1
+        if budget < 0:
+            return None
+        if isinstance(value, int):
+            if value in rs:
+                rids.append(value)
+        else:
+            rids.extend(intersection(rs, value))
+    return rids[:limit]
+
+
+def sort(keys, rs, reverse, cursor, limit):
+    """Return the first limit record ids of rs in the order of their
+    keys, from the cursor on, and how many there are in total.
+    """
+    first = cursor.first
+    last_key = cursor.key
+    last_rid = cursor.rid
+    entries = []
+    append = entries.append
+    for rid in rs:
+        key = keys.get(rid, _marker)
+        if key is _marker:
+            continue
+        if not first:
+            if key == last_key:
+                if rid <= last_rid:
+                    continue
+            elif (key > last_key) if reverse else (key < last_key):
+                continue
+        append(((key, -rid if reverse else rid), rid))
+    count = len(entries)
+    if limit is not None and limit < count:
+        select = heapq.nlargest if reverse else heapq.nsmallest
+        entries = select(limit, entries)
+    else:
+        entries.sort(reverse=reverse)
+    return array('i', [rid for entry, rid in entries]), count
+
+
+def resume(catalog, results, sort_on, reverse, cursor, limit=None):
+    """Return the results that come after the cursor, sorted on the
+    sort index sort_on, then on record id. Results missing from the
+    sort index are left out, as the catalog does. If limit is given,
+    only the first limit results are sorted and returned.
+
+    The results are intersected with the index from the cursor on,
+    whose keys are then visited in order until the page is complete:
+    the cost of a page doesn't depend on its depth, nor on the number
+    of results.
+    """
+    rs, scores = result_set(results)
+    index = catalog._catalog.getIndex(sort_on)
+    tree = getattr(aq_base(index), '_index', None)
+    rids = None
+    if tree is not None:
+        rs = after_cursor(tree, rs, reverse, cursor)
+        count = len(rs)
+        rids = walk(tree, rs, reverse, cursor, limit)
+    if rids is None:
+        # Few results spread on many keys are sorted instead.
+        rids, count = sort(
+            index.documentToKeyMap(), rs, reverse, cursor, limit)
+    page_scores = None
+    if scores is not None:
+        page_scores = array('d', [scores[rid] for rid in rids])
+    return Records(catalog, rids, page_scores, count)
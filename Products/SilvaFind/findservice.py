@@ -2,15 +2,35 @@
 # Copyright (c) 2002-2013 Infrae. All rights reserved.
 # See also LICENSE.txt
 
+import json
+import threading
+
 # Zope
 from AccessControl import ClassSecurityInfo
+from Acquisition import aq_base, aq_chain, aq_inner
 from App.class_init import InitializeClass
+from BTrees.Length import Length
+from ZPublisher.interfaces import IPubBeforeCommit
 
-from zope.component import getUtility
+from zope.component import getUtility, queryUtility
+from zope.container.interfaces import IContainerModifiedEvent
+from zope.lifecycleevent.interfaces import IObjectModifiedEvent
+from zope.lifecycleevent.interfaces import IObjectMovedEvent
 from five import grok
 
 # Silva Find
+from Products.SilvaFind.cache import get_cache, get_single_flight
+from Products.SilvaFind.cache import query_caches
+from Products.SilvaFind.catalog import ALLOWED_INDEX
+from Products.SilvaFind.catalog import content_rids
+from Products.SilvaFind.catalog import install_security_index, reindex_security
+from Products.SilvaFind.i18n import translate as _
+from Products.SilvaFind.results.store import install_snippet_store
+from Products.SilvaFind.slowlog import get_slow_log
+from Products.SilvaFind.stats import get_statistics
+from Products.SilvaMetadata.interfaces import IMetadataModifiedEvent
 from Products.SilvaMetadata.interfaces import IMetadataService
+from Products.SilvaMetadata.interfaces import IMetadataSet, IMetadataElement
 from Products.SilvaFind.interfaces import IFindService
 from Products.SilvaFind.globalschema import (
     globalSearchFields, globalResultsFields)
@@ -23,8 +43,25 @@ from Products.SilvaFind.criterion import MetadataCriterionField
 from Products.SilvaFind.schema import ResultsSchema
 from Products.SilvaFind.schema import SearchSchema
 
+from silva.core.interfaces import IContainer, ISilvaObject, IVersion
+from silva.core.interfaces.events import ISecurityRoleChangedEvent
+from silva.core.interfaces.events import ISecurityRestrictionModifiedEvent
 from silva.core.services.base import SilvaService
+from silva.core.services.interfaces import ICatalogService
 from silva.core import conf as silvaconf
+from silva.core.views import views as silvaviews
+from zeam.form import silva as silvaforms
+
+
+# Computed schemas are shared by all the threads of the process. They
+# are keyed by service path and schema generation: the generation is
+# persistent, so other ZEO clients rebuild them as well after a
+# change.
+_schemas_lock = threading.Lock()
+_schemas = {}
+
+# Metadata elements used in breadcrumbs.
+TITLE_ELEMENTS = frozenset(['maintitle', 'shorttitle'])
 
 
 class FindService(SilvaService):
@@ -36,14 +73,183 @@ class FindService(SilvaService):
     grok.name('service_find')
     silvaconf.icon('findservice.png')
 
+    manage_options = (
+        {'label': 'Settings', 'action': 'manage_settings'},
+        {'label': 'Slow searches', 'action': 'manage_slowsearches'},
+        {'label': 'Statistics', 'action': 'manage_statistics'},
+        ) + SilvaService.manage_options
+
+    result_cache_size = 0
+    result_cache_ttl = 300
+    breadcrumb_cache_size = 1000
+    fragment_cache_size = 5000
+    server_timing = False
+    timing_log = False
+    slow_query_threshold = 1000
+    coalescing_timeout = 5000
+    snapshot_cache_size = 200
+    snapshot_ttl = 1800
+    catalog_security = False
+    _breadcrumb_generation = None
+    _security_generation = None
+
     def __init__(self, id, title=None):
         super(FindService, self).__init__(id, title)
         self.search_schema = None
         self.result_schema = None
+        self._breadcrumb_generation = Length()
+        self._security_generation = Length()
+
+    _schema_generation = 0
+
+    def getSchemaGeneration(self):
+        """Return a number that changes each time the computed
+        schemas are invalidated.
+        """
+        return self._schema_generation
+
+    def invalidateSchemas(self):
+        """Discard the computed schemas, they will be rebuilt the
+        next time they are needed.
+        """
+        self._schema_generation += 1
+        path = self.getPhysicalPath()
+        with _schemas_lock:
+            for key in [key for key in _schemas if key[0] == path]:
+                del _schemas[key]
+
+    def _getComputedSchemas(self):
+        path = self.getPhysicalPath()
+        generation = self._schema_generation
+        key = (path, generation)
+        with _schemas_lock:
+            schemas = _schemas.get(key)
+        if schemas is None:
+            schemas = (self._computeSearchSchema(),
+                       self._computeResultsSchema())
+            with _schemas_lock:
+                previous = [old for old in _schemas if old[0] == path]
+                if all(old[1] <= generation for old in previous):
+                    for old in previous:
+                        del _schemas[old]
+                    _schemas[key] = schemas
+        return schemas
+
+    def getResultCache(self):
+        if not self.result_cache_size:
+            return None
+        return get_cache(
+            'results', self.getPhysicalPath(),
+            self.result_cache_size, self.result_cache_ttl)
+
+    def getBreadcrumbCache(self):
+        if not self.breadcrumb_cache_size:
+            return None
+        return get_cache(
+            'breadcrumbs', self.getPhysicalPath(),
+            self.breadcrumb_cache_size)
+
+    def getBreadcrumbGeneration(self):
+        generation = self._breadcrumb_generation
+        if generation is None:
+            return 0
+        return generation()
+
+    def invalidateBreadcrumbs(self):
+        # Cached breadcrumbs of an older generation are not used,
+        # by any process. The generation is a Length, so concurrent
+        # changes to containers don't conflict on the service.
+        if self._breadcrumb_generation is None:
+            self._breadcrumb_generation = Length()
+        self._breadcrumb_generation.change(1)
+        cache = self.getBreadcrumbCache()
+        if cache is not None:
+            cache.invalidate()
+
+    def getSecurityGeneration(self):
+        generation = self._security_generation
+        if generation is None:
+            return 0
+        return generation()
+
+    def invalidateSecurity(self):
+        # Snapshots of results filtered with older roles are not
+        # used, by any process.
+        if self._security_generation is None:
+            self._security_generation = Length()
+        self._security_generation.change(1)
+        snapshots = self.getSnapshotCache()
+        if snapshots is not None:
+            snapshots.invalidate()
+
+    def getFragmentCache(self):
+        if not self.fragment_cache_size:
+            return None
+        return get_cache(
+            'fragments', self.getPhysicalPath(),
+            self.fragment_cache_size)
+
+    def invalidateFragments(self, rids):
+        # Fragments are keyed by modification time as well, so other
+        # processes don't use them after the content is edited.
+        cache = self.getFragmentCache()
+        if cache is not None and rids:
+            cache.invalidate(predicate=lambda key: key[0] in rids)
+
+    def getSingleFlight(self):
+        if not self.coalescing_timeout:
+            return None
+        return get_single_flight(
+            self.getPhysicalPath(), self.coalescing_timeout / 1000.0)
+
+    def getSnapshotCache(self):
+        if not self.snapshot_cache_size:
+            return None
+        return get_cache(
+            'snapshots', self.getPhysicalPath(),
+            self.snapshot_cache_size, self.snapshot_ttl)
+
+    def getSlowQueryLog(self):
+        if not self.slow_query_threshold:
+            return None
+        return get_slow_log(self.getPhysicalPath())
+
+    def getStatistics(self):
+        return get_statistics(self.getPhysicalPath())
+
+    def getCacheStatistics(self):
+        return dict((name, cache.statistics()) for name, cache in
+                    query_caches(self.getPhysicalPath()).items())
+
+    def useCatalogSecurity(self):
+        # The flag is only set by rebuildSecurityIndex, but the index
+        # might have been removed since: the catalog would then
+        # ignore the query on it.
+        if not self.catalog_security:
+            return False
+        catalog = queryUtility(ICatalogService)
+        return catalog is not None and ALLOWED_INDEX in catalog.indexes()
+
+    def rebuildSecurityIndex(self):
+        catalog = getUtility(ICatalogService)
+        install_security_index(self.get_root(), catalog)
+        catalog.reindexIndex(ALLOWED_INDEX, None)
+        self.catalog_security = True
+
+    def rebuildSnippetStore(self):
+        install_snippet_store(getUtility(ICatalogService))
 
     def getSearchSchema(self):
         if not self.search_schema is None:
             return self.search_schema
+        return self._getComputedSchemas()[0]
+
+    def getResultsSchema(self):
+        if not self.result_schema is None:
+            return self.result_schema
+        return self._getComputedSchemas()[1]
+
+    def _computeSearchSchema(self):
         amd = [obj for obj in globalSearchFields if isinstance(
                 obj, AutomaticMetaDataCriterionField)]
         if amd:
@@ -58,9 +264,7 @@ class FindService(SilvaService):
             fields = globalSearchFields
         return SearchSchema(fields)
 
-    def getResultsSchema(self):
-        if not self.result_schema is None:
-            return self.result_schema
+    def _computeResultsSchema(self):
         amd = [obj for obj in globalResultsFields if isinstance(
                 obj, AutomaticMetaDataResultField)]
         if amd:
@@ -104,3 +308,196 @@ class FindService(SilvaService):
         return fields
 
 InitializeClass(FindService)
+
+
+class RebuildSecurityIndexAction(silvaforms.Action):
+    description = _(u"Rebuild the security index and use it to filter "
+                    u"the search results.")
+
+    def __call__(self, form):
+        form.context.rebuildSecurityIndex()
+        form.status = _(u"Security index rebuilt.")
+        return silvaforms.SUCCESS
+
+
+class RebuildSnippetStoreAction(silvaforms.Action):
+    description = _(u"Store the text of the contents in the catalog, "
+                    u"to build the snippets of the search results.")
+
+    def __call__(self, form):
+        form.context.rebuildSnippetStore()
+        form.status = _(u"Snippet store rebuilt.")
+        return silvaforms.SUCCESS
+
+
+class FindServiceSettings(silvaforms.ZMIForm):
+    grok.context(FindService)
+    grok.name('manage_settings')
+
+    label = _(u"Configure Silva Find")
+    description = _(u"Configure the caches used by the searches.")
+    # The security index is only used once it has been rebuilt.
+    fields = silvaforms.Fields(IFindService).omit('catalog_security')
+    ignoreContent = False
+    actions = silvaforms.Actions(
+        silvaforms.EditAction(),
+        RebuildSecurityIndexAction(_(u"Rebuild security index")),
+        RebuildSnippetStoreAction(_(u"Rebuild snippet store")))
+
+
+class FindServiceSlowSearches(silvaviews.ZMIView):
+    """Slow searches of this Zope process, grouped by query.
+    """
+    grok.context(FindService)
+    grok.name('manage_slowsearches')
+
+    def update(self):
+        self.threshold = self.context.slow_query_threshold
+        self.statistics = []
+        log = self.context.getSlowQueryLog()
+        if log is not None:
+            if 'clear' in self.request.form:
+                log.clear()
+            self.statistics = log.aggregate()
+
+    def milliseconds(self, duration):
+        return '%.1f' % (duration * 1000)
+
+
+def find_statistics(service):
+    """Return the statistics of the Silva Finds and the caches of the
+    service, in this Zope process.
+    """
+    statistics = service.getStatistics().snapshot()
+    caches = {}
+    for name, values in service.getCacheStatistics().items():
+        requests = values['hits'] + values['misses']
+        values['hit_rate'] = (
+            float(values['hits']) / requests if requests else 0.0)
+        caches[name] = values
+    statistics['caches'] = caches
+    flights = service.getSingleFlight()
+    if flights is not None:
+        statistics['coalescing'] = flights.statistics()
+    return statistics
+
+
+class FindServiceStatistics(silvaviews.ZMIView):
+    """Activity of the Silva Finds in this Zope process.
+    """
+    grok.context(FindService)
+    grok.name('manage_statistics')
+
+    def update(self):
+        statistics = find_statistics(self.context)
+        self.total = statistics['total']
+        self.finds = sorted(statistics['finds'].items())
+        self.caches = sorted(statistics['caches'].items())
+
+
+class FindServiceStatisticsJSON(grok.View):
+    """Activity of the Silva Finds in this Zope process, for
+    monitoring.
+    """
+    grok.context(FindService)
+    grok.name('statistics.json')
+    grok.require('zope2.ViewManagementScreens')
+
+    def render(self):
+        self.response.setHeader('Content-Type', 'application/json')
+        self.response.setHeader('Cache-Control', 'no-cache')
+        return json.dumps(find_statistics(self.context))
+
+
+@grok.subscribe(IMetadataSet, IObjectMovedEvent)
+@grok.subscribe(IMetadataSet, IObjectModifiedEvent)
+@grok.subscribe(IMetadataElement, IObjectMovedEvent)
+@grok.subscribe(IMetadataElement, IObjectModifiedEvent)
+def invalidate_schemas(content, event):
+    """Metadata sets or elements changed (imported, added, removed or
+    edited): the schemas computed out of them are no longer valid.
+    """
+    service = queryUtility(IFindService)
+    if service is not None:
+        service.invalidateSchemas()
+
+
+@grok.subscribe(IPubBeforeCommit)
+def invalidate_edited_schemas(event):
+    """Metadata sets and elements are edited in the ZMI without any
+    event being sent (editElementPolicy, editSettings): the schemas
+    are invalidated when a request modified the set, or an element
+    or field of the set, it was published on.
+    """
+    published = event.request.get('PUBLISHED', None)
+    published = getattr(published, 'im_self', published)
+    modified = False
+    for content in aq_chain(aq_inner(published)):
+        modified = modified or bool(
+            getattr(aq_base(content), '_p_changed', False))
+        if IMetadataSet.providedBy(content):
+            if modified:
+                invalidate_schemas(content, event)
+            return
+
+
+@grok.subscribe(ISilvaObject, ISecurityRoleChangedEvent)
+@grok.subscribe(ISilvaObject, ISecurityRestrictionModifiedEvent)
+def update_security_index(content, event):
+    """Roles or access restrictions changed on content: the security
+    index must be updated for it and everything below it.
+    """
+    service = queryUtility(IFindService)
+    if service is None:
+        return
+    # Result snapshots have been filtered with the previous roles.
+    service.invalidateSecurity()
+    # The index is kept up to date even if it is not used yet, so it
+    # is correct once it is used.
+    catalog = queryUtility(ICatalogService)
+    if catalog is not None and ALLOWED_INDEX in catalog.indexes():
+        reindex_security(catalog, content)
+
+
+@grok.subscribe(IContainer, IObjectMovedEvent)
+@grok.subscribe(IContainer, IObjectModifiedEvent)
+def invalidate_breadcrumbs(content, event):
+    """A container has been renamed, moved or modified: the cached
+    breadcrumbs might contain its old URL or title.
+    """
+    if IContainerModifiedEvent.providedBy(event):
+        # Content has been added to or removed from the container.
+        return
+    if IObjectMovedEvent.providedBy(event):
+        if event.oldParent is None or event.newParent is None:
+            # Added or removed, there is nothing cached for it.
+            return
+    service = queryUtility(IFindService)
+    if service is not None:
+        service.invalidateBreadcrumbs()
+
+
+@grok.subscribe(IContainer, IMetadataModifiedEvent)
+def invalidate_breadcrumbs_titles(content, event):
+    """The title of a container might have been changed.
+    """
+    if TITLE_ELEMENTS.intersection(event.changes):
+        invalidate_breadcrumbs(content, event)
+
+
+@grok.subscribe(ISilvaObject, IObjectModifiedEvent)
+@grok.subscribe(ISilvaObject, IMetadataModifiedEvent)
+@grok.subscribe(IVersion, IObjectModifiedEvent)
+@grok.subscribe(IVersion, IMetadataModifiedEvent)
+def invalidate_fragments(content, event):
+    """Content is modified, and will be reindexed: the result fields
+    rendered for it are no longer valid.
+    """
+    if IContainerModifiedEvent.providedBy(event):
+        return
+    service = queryUtility(IFindService)
+    catalog = queryUtility(ICatalogService)
+    if service is not None and catalog is not None:
+        service.invalidateFragments(
+            content_rids(
+                catalog, content, not IContainer.providedBy(content)))
@@ -3,8 +3,11 @@
 # See also LICENSE.txt
 
 from zope.interface import Interface, Attribute
+from zope import schema
 from silva.core import interfaces
 
+from Products.SilvaFind.i18n import translate as _
+
 """
 A query is a set of criterion.
 A criterion is made both of an indexed field of content items
@@ -16,7 +19,12 @@ class ISchema(Interface):
     """
 
     def getFields():
-        """Return all the fields of the schema as a list.
+        """Return all the fields of the schema as a tuple.
+        """
+
+    def getField(name, default=None):
+        """Return the field called name. Raise KeyError if there is
+        no such field and no default is given.
         """
 
     def hasField(name):
@@ -24,7 +32,11 @@ class ISchema(Interface):
         """
 
     def getFieldNames():
-        """Return a list of field names.
+        """Return a tuple of field names.
+        """
+
+    def getFieldsProvidedBy(interface):
+        """Return a tuple of the fields providing the given interface.
         """
 
 
@@ -55,6 +67,15 @@ class IQuery(Interface):
         for this query.
         """
 
+    def getQueryPlan(request):
+        """Return the compiled query plan used to extract the search
+        criterias out of the request.
+        """
+
+    def invalidateQueryPlan():
+        """Discard the compiled query plan.
+        """
+
     def getResultsSchema():
         """Return the schema describing the fields to appear in the
         result listing for this query.
@@ -65,20 +86,153 @@ class IFind(interfaces.IContent, IQuery):
     """A Silva find object.
     """
 
-    def searchResults(request={}, validate=True):
+    def searchResults(request={}, validate=True, limit=None,
+                      cursor=None):
         """Return a list of ZCatalog brains that match the given
         request.
+
+        If the results are sorted, limit is given to the catalog as
+        sort_limit: only the first limit results are then sorted, the
+        others are not returned.
+
+        If a cursor is given and the results are sorted, only the
+        results after the cursor are returned, sorted on the sort
+        index and on record id.
+        """
+
+    def getSortIndexes():
+        """Return the ids of the catalog indexes the results can be
+        sorted on.
+        """
+
+    def getSortCriterias(request={}):
+        """Return the sort options (sort_on, sort_order) to use for
+        the given request. It is empty if the results are sorted on
+        relevance.
         """
 
     def getSearchCriterias(request):
         """Return the search crieterias as defined in the request.
         """
 
+    def isCachable():
+        """Return True if the responses of the Find can be cached for
+        the current user: caching is enabled on the Find, and the user
+        is anonymous.
+        """
+
+    def getCacheValidators(request, name=''):
+        """Return a tuple (etag, last_modified) validating the response
+        of the view name to the request, or None if it cannot be
+        cached. They change with the criterias, the catalog and the
+        Find settings.
+        """
+
+    def filterResults(results, more=None, factory=None, known=0):
+        """Return a lazy sequence of the results the current user can
+        view. If results have been limited, more must return all of
+        them. If a factory is given, it is used to wrap each result.
+        The first known results are already known to be viewable.
+        """
+
+    def countResults(request={}, validate=True, minimum=None):
+        """Return a tuple (count, exact) for the results the current
+        user can view that match the given request.
+
+        If the security index is used, the count is read from the
+        catalog result and always exact. Otherwise the View permission
+        is checked on the results until minimum of them are found: if
+        exact is False, count is a lower bound.
+        """
+
 
 
 class IFindService(interfaces.ISilvaService, interfaces.ISilvaInvisibleService):
     """Silva find service: provides default global search/result schema.
     """
+    result_cache_size = schema.Int(
+        title=_(u"Result cache size"),
+        description=_(u"Number of search results to keep in memory "
+                      u"in each Zope process. 0 disables the cache."),
+        min=0,
+        default=0,
+        required=True)
+    result_cache_ttl = schema.Int(
+        title=_(u"Result cache lifetime"),
+        description=_(u"Number of seconds a search result is kept "
+                      u"in memory. 0 keeps them until the catalog "
+                      u"changes."),
+        min=0,
+        default=300,
+        required=True)
+    breadcrumb_cache_size = schema.Int(
+        title=_(u"Breadcrumb cache size"),
+        description=_(u"Number of result breadcrumbs to keep in memory "
+                      u"in each Zope process. 0 disables the cache."),
+        min=0,
+        default=1000,
+        required=True)
+    fragment_cache_size = schema.Int(
+        title=_(u"Result fragment cache size"),
+        description=_(u"Number of result fields rendered for a search "
+                      u"result to keep in memory in each Zope process. "
+                      u"0 disables the cache."),
+        min=0,
+        default=5000,
+        required=True)
+    server_timing = schema.Bool(
+        title=_(u"Send search timings"),
+        description=_(u"Add a Server-Timing header with the time spent "
+                      u"in each phase of a search to the responses."),
+        default=False,
+        required=False)
+    timing_log = schema.Bool(
+        title=_(u"Log search timings"),
+        description=_(u"Log the time spent in each phase of a search "
+                      u"and the number of results."),
+        default=False,
+        required=False)
+    slow_query_threshold = schema.Int(
+        title=_(u"Slow search threshold"),
+        description=_(u"Searches whose catalog query takes more than "
+                      u"this number of milliseconds are logged. 0 "
+                      u"disables the log."),
+        min=0,
+        default=1000,
+        required=True)
+    coalescing_timeout = schema.Int(
+        title=_(u"Search coalescing timeout"),
+        description=_(u"Identical searches running at the same time in "
+                      u"a Zope process wait for the first one and share "
+                      u"its results, up to this number of milliseconds. "
+                      u"0 runs every search independently."),
+        min=0,
+        default=5000,
+        required=True)
+    snapshot_cache_size = schema.Int(
+        title=_(u"Result snapshot cache size"),
+        description=_(u"Number of searches whose result record ids are "
+                      u"kept in memory in each Zope process, so their "
+                      u"next pages don't search again and stay stable. "
+                      u"0 disables the snapshots."),
+        min=0,
+        default=200,
+        required=True)
+    snapshot_ttl = schema.Int(
+        title=_(u"Result snapshot lifetime"),
+        description=_(u"Number of seconds the result record ids of a "
+                      u"search are kept in memory."),
+        min=1,
+        default=1800,
+        required=True)
+    catalog_security = schema.Bool(
+        title=_(u"Filter results with the security index"),
+        description=_(u"Check the View permission in the catalog query, "
+                      u"instead of checking it on each result. It is "
+                      u"set when the security index is rebuilt."),
+        default=False,
+        readonly=True,
+        required=False)
 
     def getSearchSchema():
         """Return the default search schema for all query.
@@ -88,6 +242,99 @@ class IFindService(interfaces.ISilvaService, interfaces.ISilvaInvisibleService):
         """Return the default result schema for all query.
         """
 
+    def getSchemaGeneration():
+        """Return a number that changes each time the default schemas
+        are invalidated, including when a metadata set or element is
+        edited. It can be used to invalidate caches built out of
+        those schemas.
+        """
+
+    def invalidateSchemas():
+        """Discard the computed default schemas. They will be rebuilt
+        out of the metadata sets the next time they are needed.
+        """
+
+    def getResultCache():
+        """Return the cache used to store search results, or None if
+        results should not be cached.
+        """
+
+    def getBreadcrumbCache():
+        """Return the cache used to store the breadcrumbs of the
+        results, or None if they should not be cached.
+        """
+
+    def getBreadcrumbGeneration():
+        """Return a number that changes each time cached breadcrumbs
+        are invalidated.
+        """
+
+    def invalidateBreadcrumbs():
+        """Invalidate the cached breadcrumbs, in all the Zope
+        processes.
+        """
+
+    def getFragmentCache():
+        """Return the cache of the result fields rendered for search
+        results, or None if it is disabled.
+        """
+
+    def invalidateFragments(rids):
+        """Discard the result fields rendered for the given catalog
+        record ids.
+        """
+
+    def getSingleFlight():
+        """Return the object coalescing identical searches running at
+        the same time in this Zope process, or None if it is disabled.
+        """
+
+    def getSnapshotCache():
+        """Return the cache of the result record ids of searches, used
+        to display their next pages, or None if it is disabled.
+        """
+
+    def getSecurityGeneration():
+        """Return a number that changes each time roles or access
+        restrictions change on content.
+        """
+
+    def invalidateSecurity():
+        """Invalidate the result snapshots filtered with the previous
+        roles, in all the Zope processes.
+        """
+
+    def getSlowQueryLog():
+        """Return the in-memory log of the slow searches of this
+        Zope process, or None if it is disabled.
+        """
+
+    def getStatistics():
+        """Return the counters of the activity of the Silva Finds in
+        this Zope process.
+        """
+
+    def getCacheStatistics():
+        """Return the statistics of the caches of the service in this
+        Zope process, by cache name.
+        """
+
+    def useCatalogSecurity():
+        """Return True if the View permission is checked by the
+        catalog query: the security index has been rebuilt, and is
+        still in the catalog.
+        """
+
+    def rebuildSecurityIndex():
+        """Rebuild the security index and use it to check the View
+        permission.
+        """
+
+    def rebuildSnippetStore():
+        """Install and fill the catalog index storing the text of the
+        contents, used to build the snippets of the search results.
+        """
+
 
 # Search criterions
 
@@ -224,6 +471,13 @@ class ICriterionView(IQueryPart):
         request.
         """
 
+    def getRequestKeys():
+        """Return the keys of the request form used to extract the
+        widget value. If none of them are in the request, the index
+        value is the default stored in the query. Return None if the
+        index value must be computed for each search.
+        """
+
     def renderPublicWidget():
         """Render a widget for the public to input search data to use
         in the query.
@@ -261,14 +515,77 @@ class IResultField(Interface):
         """
 
 
+class IResultItem(Interface):
+    """A search result, given to the result views. The object and
+    the values computed out of it are computed only once.
+    """
+    brain = Attribute(u"Catalog brain of the result")
+    columns = Attribute(
+        u"Catalog metadata columns to read values from, "
+        u"instead of the object")
+    computed = Attribute(
+        u"Dictionary counting the values computed for each name")
+
+    def getObject():
+        """Return the object (or version) of the result.
+        """
+
+    def getSilvaObject():
+        """Return the Silva object of the result (the content of the
+        version).
+        """
+
+    def getContentPath():
+        """Return the physical path of the Silva object of the result.
+        """
+
+    def getContentURL():
+        """Return the URL of the Silva object of the result.
+        """
+
+    def getContentType():
+        """Return the meta type of the Silva object of the result.
+        """
+
+    def getTitle():
+        """Return the title (or the id) of the result.
+        """
+
+    def getModificationDatetime():
+        """Return the modification date of the result.
+        """
+
+    def getThumbnailURL():
+        """Return the URL of the thumbnail of the result, or None if
+        it is not an image with a thumbnail.
+        """
+
+    def getScore():
+        """Return the fulltext score of the result, or None.
+        """
+
+
 class IResultView(Interface):
     """Render a ResultField for the public.
     """
+    catalogColumns = Attribute(
+        u"Catalog metadata columns needed to render the field without "
+        u"waking up the result object, or None if it needs the object")
+    cacheable = Attribute(
+        u"True if the rendering of the field for a result can be cached "
+        u"until the result is modified")
+
+    def getCacheKey(item):
+        """Return a hashable value for the settings of the request the
+        rendering of the IResultItem item depends on, besides the
+        result, for instance the searched terms. Return None if its
+        rendering cannot be cached.
+        """
 
     def __init__(context, result, request):
         """Build the view
         """
 
     def render(item):
-        """renders result field for an item
+        """renders result field for an IResultItem
         """
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+
+class FilteredResults(object):
+    """Sequence of catalog results filtered with check. The results
+    are only checked as far as they are accessed: accessing the
+    items of a page only checks the results up to that page.
+
+    Until all the results have been checked, the length is an upper
+    bound of the number of accepted results.
+
+    If the results have been limited (with sort_limit), more is called
+    to get all of them when the limited results are not enough. If a
+    factory is given, it is called on each result before it is
+    checked.
+
+    The first known results are already known to be accepted: they
+    are not checked again, and only the ones accessed are created.
+    """
+
+    def __init__(self, results, check=None, more=None, factory=None,
+                 known=0):
+        self._results = results
+        self._check = check
+        self._more = more
+        self._factory = factory
+        self._known = known
+        self._accepted = []
+        self._cursor = known
+
+    def _size(self):
+        size = len(self._results)
+        if self._more is not None:
+            # Limited results know how many there are in total.
+            actual = getattr(self._results, 'actual_result_count', None)
+            if actual is not None and actual > size:
+                return actual
+        return size
+
+    @property
+    def checked(self):
+        """Number of results that have been checked.
+        """
+        return self._cursor
+
+    @property
+    def known(self):
+        """Number of results accepted without being checked.
+        """
+        return self._known
+
+    @property
+    def accepted(self):
+        """Results accepted after being checked.
+        """
+        return self._accepted
+
+    @property
+    def results(self):
+        """Results being filtered.
+        """
+        return self._results
+
+    @property
+    def exact(self):
+        """Return True if the length is exact.
+        """
+        return self._cursor >= self._size()
+
+    def fetch(self, count=None):
+        """Check results until count of them are accepted, or all of
+        them are checked if count is None. Return True if count
+        results have been accepted.
+        """
+        results = self._results
+        accepted = self._accepted
+        check = self._check
+        factory = self._factory
+        total = len(results)
+        known = self._known
+        while (count is None or known + len(accepted) < count):
+            if self._cursor >= total:
+                if self._more is None or self._size() <= total:
+                    break
+                results = self._results = self._more()
+                self._more = None
+                total = len(results)
+                continue
+            item = results[self._cursor]
+            self._cursor += 1
+            if factory is not None:
+                item = factory(item)
+            if check is None or check(item):
+                accepted.append(item)
+        return count is None or known + len(accepted) >= count
+
+    def count(self, minimum=None):
+        """Return a tuple (count, exact). If minimum is given, results
+        are checked until minimum of them are accepted: if exact is
+        False, count is then a lower bound of the number of results.
+        """
+        if self._check is None or self.exact:
+            return len(self), True
+        if minimum is None:
+            self.fetch()
+            return len(self), True
+        self.fetch(minimum)
+        if self.exact:
+            return len(self), True
+        return self._known + len(self._accepted), False
+
+    def _item(self, index):
+        if index < self._known:
+            item = self._results[index]
+            if self._factory is not None:
+                item = self._factory(item)
+            return item
+        return self._accepted[index - self._known]
+
+    def __len__(self):
+        return (self._known + len(self._accepted) +
+                self._size() - self._cursor)
+
+    def __nonzero__(self):
+        return self.fetch(1)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step > 0:
+                self.fetch(stop)
+            else:
+                self.fetch()
+            return [self._item(position) for position in range(
+                    *index.indices(self._known + len(self._accepted)))]
+        if index < 0:
+            self.fetch()
+            index += self._known + len(self._accepted)
+            if index < 0:
+                raise IndexError(index)
+        elif not self.fetch(index + 1):
+            raise IndexError(index)
+        return self._item(index)
+
+    def __iter__(self):
+        index = 0
+        while self.fetch(index + 1):
+            yield self._item(index)
+            index += 1
+
+
+class Counted(object):
+    """Filtered results with a known length, to batch them: the
+    length of filtered results is only an upper bound, which would
+    give pages that are empty once filtered.
+    """
+
+    def __init__(self, results, count):
+        self._results = results
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._results[slice(*index.indices(self._count))]
+        if index >= self._count:
+            raise IndexError(index)
+        return self._results[index]
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self._results[index]
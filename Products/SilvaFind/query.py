@@ -3,9 +3,87 @@
 # See also LICENSE.txt
 
 from ZODB.PersistentMapping import PersistentMapping
-from zope.component import getUtility
+from zope.component import getUtility, getSiteManager
+from zope.component.interfaces import ComponentLookupError
+from zope.interface import providedBy
 
-from Products.SilvaFind.interfaces import IFindService
+from Products.SilvaFind.interfaces import IFindService, IQueryPart
+
+
+_marker = object()
+
+
+class QueryPlanPart(object):
+    """A query part resolved for a query plan.
+    """
+    __slots__ = ('field', 'factory', 'index', 'keys', 'value')
+
+    def __init__(self, field, factory, index, keys, value=_marker):
+        self.field = field
+        self.factory = factory
+        self.index = index
+        self.keys = keys
+        self.value = value
+
+
+class QueryPlan(object):
+    """Compiled version of the search criterias of a query: query
+    part factories are resolved once, and the values stored in the
+    query are computed only once.
+    """
+
+    def __init__(self, query, fields, request, schema, serial):
+        self.schema = schema
+        self.serial = serial
+        self.spec = providedBy(request)
+        self.parts = []
+        self.indexes = []
+        self.keys = set()
+        adapters = getSiteManager().adapters
+        query_spec = providedBy(query)
+        for field in fields:
+            factory = adapters.lookup(
+                (providedBy(field), query_spec, self.spec), IQueryPart)
+            if factory is None:
+                raise ComponentLookupError(
+                    (field, query, request), IQueryPart, u'')
+            part = factory(field, query, request)
+            index = part.getIndexId()
+            keys = None
+            if hasattr(part, 'getRequestKeys'):
+                keys = part.getRequestKeys()
+            if keys is not None:
+                keys = tuple(keys)
+                self.keys.update(keys)
+            self.parts.append(QueryPlanPart(field, factory, index, keys))
+            self.indexes.append(index)
+
+    def _getValue(self, part):
+        value = part.getIndexValue()
+        if value is None:
+            value = ''
+        return value
+
+    def isValidFor(self, request, schema, serial):
+        return (self.schema is schema and
+                self.serial == serial and
+                self.spec is providedBy(request))
+
+    def getSearchCriterias(self, query, request):
+        form = getattr(request, 'form', request)
+        options = {}
+        for part in self.parts:
+            if part.keys is None or any(key in form for key in part.keys):
+                value = self._getValue(
+                    part.factory(part.field, query, request))
+            else:
+                # Nothing in the request, this is the stored value.
+                if part.value is _marker:
+                    part.value = self._getValue(
+                        part.factory(part.field, query, request))
+                value = part.value
+            options[part.index] = value
+        return options
 
 
 class Query(object):
@@ -13,6 +91,28 @@ class Query(object):
     def __init__(self):
         self.searchValues = PersistentMapping()
 
+    def getQueryFields(self):
+        """Return the search fields used to build the query.
+        """
+        return self.getSearchFields()
+
+    def getQueryPlan(self, request):
+        # The plan is compiled out of the computed search schema, and
+        # is compiled again when the schema is. The stored values are
+        # kept in it until they are changed, here or by another
+        # database connection.
+        schema = self.getSearchSchema()
+        serial = getattr(self.searchValues, '_p_serial', None)
+        plan = getattr(self, '_v_query_plan', None)
+        if plan is None or not plan.isValidFor(request, schema, serial):
+            plan = QueryPlan(
+                self, self.getQueryFields(), request, schema, serial)
+            self._v_query_plan = plan
+        return plan
+
+    def invalidateQueryPlan(self):
+        self._v_query_plan = None
+
     def getSearchSchema(self):
         return getUtility(IFindService).getSearchSchema()
 
@@ -39,11 +139,13 @@ class Query(object):
         if searchSchema.hasField(name):
             if name in self.searchValues:
                 del self.searchValues[name]
+                self.invalidateQueryPlan()
 
     def setCriterionValue(self, name, value):
         searchSchema = self.getSearchSchema()
         if searchSchema.hasField(name):
             self.searchValues[name] = value
+            self.invalidateQueryPlan()
         else:
             raise ValueError(
                 u'No field named %s defined in search schema' %
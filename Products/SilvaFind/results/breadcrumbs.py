@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+from silva.core.views.absoluteurl import minimize
+
+from Products.SilvaFind.catalog import BREADCRUMB_COLUMN
+
+
+def breadcrumbs_top(root, request):
+    """Return the physical path of the first breadcrumb: the Silva
+    root, or the virtual host root if it is inside the Silva root.
+    """
+    top = root.getPhysicalPath()
+    virtual = request.get('VirtualRootPhysicalPath')
+    if virtual and tuple(virtual[:len(top)]) == top:
+        return tuple(virtual)
+    return top
+
+
+def catalog_breadcrumbs(catalog, request, top, path):
+    """Return a list of (url, title) for the containers from top to
+    path, read from the catalog, with the short titles used by the
+    breadcrumbs adapter. Return None if one of them is not in the
+    catalog, or is left out of its breadcrumbs.
+    """
+    steps = path.split('/')
+    if tuple(steps[:len(top)]) != tuple(top):
+        return None
+    crumbs = []
+    for index in range(len(top), len(steps) + 1):
+        current = '/'.join(steps[:index])
+        rid = catalog.getrid(current)
+        if rid is None:
+            return None
+        title = catalog.getMetadataForRID(rid).get(BREADCRUMB_COLUMN)
+        if not isinstance(title, basestring) or not title:
+            return None
+        crumbs.append((request.physicalPathToURL(current), minimize(title)))
+    return crumbs
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+from Acquisition import aq_base
+from five import grok
+from zope.traversing.browser import absoluteURL
+import Missing
+
+from Products.SilvaFind.catalog import CONTENT_PATH_COLUMN
+from Products.SilvaFind.catalog import CONTENT_TYPE_COLUMN
+from Products.SilvaFind.catalog import MODIFICATION_COLUMN, TITLE_COLUMN
+from Products.SilvaFind.catalog import THUMBNAIL_COLUMN, silva_object
+from Products.SilvaFind.interfaces import IResultItem
+from silva.core.interfaces import IImage
+
+
+class ResultItem(object):
+    """A catalog brain with the object and the values computed out of
+    it memoized, shared by all the result fields of a search.
+
+    Values are read from the catalog metadata columns listed in
+    columns, if they are available, instead of the object.
+    """
+    grok.implements(IResultItem)
+
+    def __init__(self, brain, request, computed=None, columns=None):
+        self.brain = brain
+        self.request = request
+        self.computed = computed if computed is not None else {}
+        self.columns = columns or frozenset()
+        self._values = {}
+
+    def _get(self, name, compute):
+        try:
+            return self._values[name]
+        except KeyError:
+            pass
+        value = self._values[name] = compute()
+        self.computed[name] = self.computed.get(name, 0) + 1
+        return value
+
+    def _column(self, name):
+        # Return None if the value of the column is not available.
+        if name in self.columns:
+            value = getattr(self.brain, name, None)
+            if value is not Missing.Value:
+                return value
+        return None
+
+    def _getContentPath(self):
+        path = self._column(CONTENT_PATH_COLUMN)
+        if path:
+            return path
+        return '/'.join(self.getSilvaObject().getPhysicalPath())
+
+    def _getContentURL(self):
+        path = self._column(CONTENT_PATH_COLUMN)
+        if path:
+            return self.request.physicalPathToURL(path)
+        return absoluteURL(self.getSilvaObject(), self.request)
+
+    def _getContentType(self):
+        meta_type = self._column(CONTENT_TYPE_COLUMN)
+        if meta_type:
+            return meta_type
+        return self.getSilvaObject().meta_type
+
+    def _getTitle(self):
+        title = self._column(TITLE_COLUMN)
+        if title is not None:
+            return title
+        return self.getObject().get_title_or_id()
+
+    def _getModificationDatetime(self):
+        date = self._column(MODIFICATION_COLUMN)
+        if date is not None:
+            return date
+        return self.getObject().get_modification_datetime()
+
+    def _getThumbnailURL(self):
+        if THUMBNAIL_COLUMN in self.columns:
+            # Results without thumbnail have None.
+            path = getattr(self.brain, THUMBNAIL_COLUMN, Missing.Value)
+            if path is not Missing.Value:
+                if path:
+                    return self.request.physicalPathToURL(path)
+                return None
+        content = self.getSilvaObject()
+        if not IImage.providedBy(content) or content.thumbnail_image is None:
+            return None
+        return content.thumbnail_image.get_download_url()
+
+    def getObject(self):
+        return self._get('object', self.brain.getObject)
+
+    def getSilvaObject(self):
+        return self._get(
+            'silva_object', lambda: silva_object(self.getObject()))
+
+    def getContentPath(self):
+        return self._get('path', self._getContentPath)
+
+    def getContentURL(self):
+        return self._get('url', self._getContentURL)
+
+    def getContentType(self):
+        return self._get('meta_type', self._getContentType)
+
+    def getTitle(self):
+        return self._get('title', self._getTitle)
+
+    def getModificationDatetime(self):
+        return self._get(
+            'modification_datetime', self._getModificationDatetime)
+
+    def getThumbnailURL(self):
+        return self._get('thumbnail_url', self._getThumbnailURL)
+
+    def getScore(self):
+        return getattr(aq_base(self.brain), 'data_record_score_', None)
+
+    def getRID(self):
+        return self.brain.getRID()
+
+    def getPath(self):
+        return self.brain.getPath()
+
+    def getURL(self):
+        return self.brain.getURL()
+
+    def __getattr__(self, name):
+        # Catalog metadata columns.
+        if name.startswith('_') or name == 'brain':
+            raise AttributeError(name)
+        return getattr(self.brain, name)
+
+
+class ResultItemFactory(object):
+    """Create the result items for one request, and count the values
+    computed for all of them.
+    """
+
+    def __init__(self, request, columns=None):
+        self.request = request
+        self.columns = columns
+        self.computed = {}
+
+    def __call__(self, brain):
+        return ResultItem(brain, self.request, self.computed, self.columns)
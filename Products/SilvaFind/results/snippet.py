@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+from bisect import bisect_right
+from cgi import escape
+import re
+
+ELLIPSIS = u'&#8230;'
+HIGHLIGHT = u'<strong class="search-result-snippet-hilite">\\1</strong>'
+OPERATORS = frozenset(['and', 'or', 'not'])
+TOKENS = re.compile(r'-?[\w\*\?]+', re.UNICODE)
+
+
+def to_unicode(text):
+    if isinstance(text, str):
+        return text.decode('utf-8', 'replace')
+    return text
+
+
+def parse_terms(query):
+    """Return the terms of a fulltext query to highlight, without
+    the operators and the excluded terms.
+    """
+    terms = []
+    exclude = False
+    for token in TOKENS.findall(to_unicode(query)):
+        lowered = token.lower()
+        if lowered in OPERATORS:
+            exclude = lowered == 'not'
+            continue
+        if exclude or token.startswith('-'):
+            exclude = False
+            continue
+        if lowered not in terms:
+            terms.append(lowered)
+    return terms
+
+
+def term_pattern(term):
+    """Return a regular expression matching a term, that can contain
+    the wildcards * and ?.
+    """
+    pattern = []
+    for char in term:
+        if char == '*':
+            pattern.append(r'\w*')
+        elif char == '?':
+            pattern.append(r'\w')
+        else:
+            pattern.append(re.escape(char))
+    return u''.join(pattern)
+
+
+def is_word(char):
+    return char.isalnum() or char == u'_'
+
+
+class SnippetEngine(object):
+    """Build highlighted snippets of text for a fulltext query. The
+    expressions are compiled once, and can be used for all the
+    results of a search.
+    """
+
+    def __init__(self, query, size=40):
+        self.size = size
+        self.terms = parse_terms(query)
+        self.patterns = []
+        self.highlighter = None
+        if self.terms:
+            patterns = []
+            for term in self.terms:
+                pattern = term_pattern(term)
+                # Terms are looked up with their literal prefix, then
+                # matched with their expression.
+                prefix = re.split(r'[\*\?]', term, 1)[0]
+                if prefix:
+                    matcher = re.compile(pattern + u'(?!\\w)', re.UNICODE)
+                else:
+                    matcher = re.compile(
+                        u'(?<!\\w)%s(?!\\w)' % pattern, re.UNICODE)
+                self.patterns.append((prefix, matcher))
+                patterns.append(pattern)
+            self.highlighter = re.compile(
+                u'(?<!\\w)(%s)(?!\\w)' % u'|'.join(patterns),
+                re.IGNORECASE | re.UNICODE)
+
+    def offsets(self, text):
+        """Return the sorted list of (offset, term) for every term
+        found in text.
+        """
+        lowered = text.lower()
+        found = []
+        for term, (prefix, matcher) in enumerate(self.patterns):
+            if not prefix:
+                found.extend(
+                    (match.start(), term)
+                    for match in matcher.finditer(lowered))
+                continue
+            offset = lowered.find(prefix)
+            while offset >= 0:
+                if ((not offset or not is_word(lowered[offset - 1])) and
+                    matcher.match(lowered, offset) is not None):
+                    found.append((offset, term))
+                offset = lowered.find(prefix, offset + 1)
+        found.sort()
+        return found
+
+    def positions(self, text, offsets=None):
+        """Return a list of (word position, offset, term) for every
+        term found in text, whose words are separated by single
+        spaces, and start at offsets if they are known.
+        """
+        found = []
+        if offsets is not None:
+            for offset, term in self.offsets(text):
+                found.append(
+                    (bisect_right(offsets, offset) - 1, offset, term))
+            return found
+        position = 0
+        previous = 0
+        for offset, term in self.offsets(text):
+            position += text.count(u' ', previous, offset)
+            previous = offset
+            found.append((position, offset, term))
+        return found
+
+    def window(self, found, total):
+        """Return the start and end positions of the window of words
+        that contains the most different terms, then the most terms,
+        and the first term found in it.
+        """
+        size = self.size
+        counts = {}
+        left = 0
+        best = None
+        anchor = found[0]
+        last = anchor[0]
+        for right, (position, offset, term) in enumerate(found):
+            counts[term] = counts.get(term, 0) + 1
+            while position - found[left][0] >= size:
+                dropped = found[left][2]
+                counts[dropped] -= 1
+                if not counts[dropped]:
+                    del counts[dropped]
+                left += 1
+            score = (len(counts), right - left + 1)
+            if score > best:
+                best = score
+                anchor, last = found[left], position
+        # Center the terms in the window.
+        first = anchor[0]
+        start = max(0, first - (size - (last - first + 1)) // 2)
+        end = min(total, start + size)
+        return max(0, end - size), end, anchor
+
+    def extract(self, text, start, end, position, offset):
+        """Return the words from start to end of text, given the
+        offset of a character of the word at position.
+        """
+        before = text.rfind(u' ', 0, offset)
+        for index in xrange(position - start):
+            if before < 0:
+                break
+            before = text.rfind(u' ', 0, before)
+        after = before
+        for index in xrange(end - start):
+            after = text.find(u' ', after + 1)
+            if after < 0:
+                after = len(text)
+                break
+        return text[before + 1:after]
+
+    def snippet(self, words, offsets=None):
+        """Return a highlighted snippet out of a list of words, or a
+        text whose words are separated by single spaces, and start at
+        offsets if they are known.
+        """
+        if isinstance(words, basestring):
+            text = to_unicode(words)
+        else:
+            try:
+                text = to_unicode(' '.join(words))
+            except UnicodeDecodeError:
+                text = u' '.join(map(to_unicode, words))
+        if offsets is not None:
+            total = len(offsets)
+        else:
+            total = text.count(u' ') + 1
+        start, end = 0, min(total, self.size)
+        anchor = (0, 0, None)
+        if self.patterns:
+            found = self.positions(text, offsets)
+            if found:
+                start, end, anchor = self.window(found, total)
+        if offsets is not None:
+            if end < total:
+                extract = text[offsets[start]:offsets[end] - 1]
+            else:
+                extract = text[offsets[start]:]
+        else:
+            extract = self.extract(text, start, end, *anchor[:2])
+        snippet = escape(extract)
+        if self.highlighter is not None:
+            snippet = self.highlighter.sub(HIGHLIGHT, snippet)
+        if start:
+            snippet = u' '.join((ELLIPSIS, snippet))
+        if end < total:
+            snippet = u' '.join((snippet, ELLIPSIS))
+        return snippet
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+from array import array
+import zlib
+
+from AccessControl import ClassSecurityInfo
+from App.class_init import InitializeClass
+from BTrees.IOBTree import IOBTree
+from BTrees.Length import Length
+from OFS.SimpleItem import SimpleItem
+from persistent import Persistent
+from Products.PluginIndexes.interfaces import IPluggableIndex
+from zope.interface import implements
+
+from Products.SilvaFind.results.snippet import to_unicode
+
+# Name of the snippet store in the catalog.
+SNIPPET_INDEX = 'silvafind_snippets'
+
+
+def snippet_text(obj):
+    """Return the text of obj to build snippets from, with its words
+    separated by single spaces, or None if it doesn't have any.
+    """
+    fulltext = getattr(obj, 'fulltext', None)
+    if fulltext is None:
+        return None
+    if callable(fulltext):
+        fulltext = fulltext()
+    if isinstance(fulltext, basestring):
+        parts = [fulltext]
+    else:
+        # The fulltext starts with the id and the title.
+        parts = fulltext[2:]
+    words = []
+    for part in parts:
+        if isinstance(part, basestring):
+            words.extend(to_unicode(part).split())
+    return u' '.join(words)
+
+
+def word_offsets(text):
+    """Return the array of the offsets where the words of text start,
+    its words being separated by single spaces.
+    """
+    offsets = array('i', [0])
+    offset = text.find(u' ')
+    while offset >= 0:
+        offsets.append(offset + 1)
+        offset = text.find(u' ', offset + 1)
+    return offsets
+
+
+class SnippetText(Persistent):
+    """Compressed text of a content, with the compressed offsets of
+    its words. Each text is stored in its own database record, so
+    changing a content doesn't rewrite the texts of other contents.
+    """
+    offsets = None
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+
+class SnippetStore(SimpleItem):
+    """Catalog index that doesn't search anything, but stores the
+    text of the cataloged content to build result snippets.
+    """
+    implements(IPluggableIndex)
+    meta_type = 'Silva Find Snippet Store'
+    security = ClassSecurityInfo()
+    security.declareObjectProtected('Manage ZCatalogIndex Entries')
+
+    def __init__(self, id):
+        self.id = id
+        self.clear()
+
+    def clear(self):
+        self._texts = IOBTree()
+        self._length = Length()
+
+    def getText(self, documentId):
+        """Return the text stored for documentId, or None.
+        """
+        text = self._texts.get(documentId)
+        if text is None:
+            return None
+        return zlib.decompress(text.data).decode('utf-8')
+
+    def getOffsets(self, documentId):
+        """Return the array of the offsets of the words of the text
+        stored for documentId, or None.
+        """
+        text = self._texts.get(documentId)
+        if text is None or text.offsets is None:
+            return None
+        offsets = array('i')
+        offsets.fromstring(zlib.decompress(text.offsets))
+        return offsets
+
+    def getEntryForObject(self, documentId, default=None):
+        text = self.getText(documentId)
+        if text is None:
+            return default
+        return text
+
+    def getIndexSourceNames(self):
+        return ('fulltext',)
+
+    def getIndexQueryNames(self):
+        return ()
+
+    def index_object(self, documentId, obj, threshold=None):
+        # The fulltext index of the catalog computes the fulltext of
+        # the content again: the cataloging attributes given by the
+        # catalog are left untouched.
+        text = snippet_text(obj)
+        if text is None:
+            self.unindex_object(documentId)
+            return 0
+        data = zlib.compress(text.encode('utf-8'))
+        stored = self._texts.get(documentId)
+        if (stored is not None and stored.data == data and
+                stored.offsets is not None):
+            return 0
+        offsets = zlib.compress(word_offsets(text).tostring())
+        if stored is None:
+            self._texts[documentId] = SnippetText(data, offsets)
+            self._length.change(1)
+        else:
+            stored.data = data
+            stored.offsets = offsets
+        return 1
+
+    def unindex_object(self, documentId):
+        if self._texts.get(documentId) is not None:
+            del self._texts[documentId]
+            self._length.change(-1)
+
+    def _apply_index(self, request, resultset=None):
+        # The store cannot be searched.
+        return None
+
+    def numObjects(self):
+        return self._length()
+
+    def indexSize(self):
+        return self._length()
+
+    def uniqueValues(self, name=None, withLengths=0):
+        return ()
+
+    def storageSize(self):
+        """Return the size of the compressed texts and offsets.
+        """
+        return sum(len(text.data) + len(text.offsets or '')
+                   for text in self._texts.values())
+
+
+InitializeClass(SnippetStore)
+
+
+def query_snippet_store(catalog):
+    """Return the snippet store of the catalog, or None.
+    """
+    if SNIPPET_INDEX not in catalog.indexes():
+        return None
+    return catalog._catalog.getIndex(SNIPPET_INDEX)
+
+
+def install_snippet_store(catalog):
+    """Install the snippet store in the catalog, and fill it.
+    """
+    if SNIPPET_INDEX not in catalog.indexes():
+        catalog.addIndex(SNIPPET_INDEX, SnippetStore(SNIPPET_INDEX))
+    catalog.reindexIndex(SNIPPET_INDEX, None)
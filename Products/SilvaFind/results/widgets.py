@@ -2,30 +2,46 @@
 # Copyright (c) 2010-2013 Infrae. All rights reserved.
 # See also LICENSE.txt
 
-import re
+import hashlib
 
 import localdatetime
 
 from Products.SilvaFind import schema
+from Products.SilvaFind.cache import LRUCache
+from Products.SilvaFind.catalog import CONTENT_PATH_COLUMN
+from Products.SilvaFind.catalog import CONTENT_TYPE_COLUMN
+from Products.SilvaFind.catalog import MODIFICATION_COLUMN, TITLE_COLUMN
+from Products.SilvaFind.catalog import THUMBNAIL_COLUMN
+from Products.SilvaFind.interfaces import IFindService
 from Products.SilvaFind.interfaces import IResultField, IQuery, IResultView
+from Products.SilvaFind.results.breadcrumbs import breadcrumbs_top
+from Products.SilvaFind.results.breadcrumbs import catalog_breadcrumbs
+from Products.SilvaFind.results.snippet import SnippetEngine
+from Products.SilvaFind.results.store import query_snippet_store
 from Products.SilvaMetadata.interfaces import IMetadataService
 from Products.SilvaMetadata.interfaces import IMetadataElement
 from Products.SilvaMetadata.Index import createIndexId
-from Products.ZCTextIndex.ParseTree import ParseError
 
 from five import grok
 from silva.core.interfaces import IVersion, IImage
 from silva.core.interfaces.adapters import IIconResolver
 from zope.component import getMultiAdapter, getUtility
 from zope.interface import Interface
-from zope.traversing.browser import absoluteURL
 from zope.traversing.browser.interfaces import IAbsoluteURL
 
+# Content types whose icon depends on the content: the mimetype of
+# files, and the target of ghosts (broken, ghost publication).
+CONTENT_ICONS = frozenset(['Silva File', 'Silva Ghost', 'Silva Ghost Folder'])
+# Icon tags of the other content types, by meta type and site URL.
+ICONS = LRUCache(256)
+
 
 class ResultView(grok.MultiAdapter):
     grok.implements(IResultView)
     grok.adapts(IResultField, IQuery, Interface)
     grok.provides(IResultView)
+    catalogColumns = None
+    cacheable = False
 
     def __init__(self, result, context, request):
         self.context = context
@@ -35,6 +51,9 @@ class ResultView(grok.MultiAdapter):
     def update(self, view):
         pass
 
+    def getCacheKey(self, item):
+        return ()
+
     def render(self, item):
         value = getattr(item.getObject(), self.result.getName())()
         if not value:
@@ -53,60 +72,71 @@ class ResultView(grok.MultiAdapter):
 
 class MetatypeResultView(ResultView):
     grok.adapts(schema.MetatypeResultField, IQuery, Interface)
+    catalogColumns = (CONTENT_TYPE_COLUMN,)
+    cacheable = True
 
     def update(self, view):
-        self.get_icon = IIconResolver(self.request).get_tag
+        resolver = IIconResolver(self.request)
+        self.get_icon = resolver.get_tag
+        self.base = resolver.root_url
+        # Number of icons rendered without loading the object.
+        self.without_object = 0
+
+    def getCacheKey(self, item):
+        if item.getContentType() in CONTENT_ICONS:
+            # The icon depends on the content, that can change
+            # without the result being modified (the target of a
+            # ghost).
+            return None
+        return ()
 
     def render(self, item):
-        content = item.getObject()
-        if IVersion.providedBy(content):
-            content = content.get_silva_object()
-        return self.get_icon(content)
+        loaded = item.computed.get('object', 0)
+        meta_type = item.getContentType()
+        if meta_type in CONTENT_ICONS:
+            # The icon depends on the content itself.
+            tag = self.get_icon(item.getSilvaObject())
+        else:
+            key = (meta_type, self.base)
+            tag = ICONS.get(key)
+            if tag is None:
+                tag = self.get_icon(identifier=meta_type)
+                ICONS.set(key, tag)
+        if item.computed.get('object', 0) == loaded:
+            self.without_object += 1
+        return tag
 
 
 class RankingResultView(ResultView):
     grok.adapts(schema.RankingResultField, IQuery, Interface)
+    catalogColumns = ()
 
     def __init__(self, *args):
         super(RankingResultView, self).__init__(*args)
-        self.rankings = {}
-        self.highest = 1.0
+        self.highest = None
 
     def update(self, view):
-        query = self.request.form.get('fulltext')
-        self.highest = 1.0
-        self.rankings = {}
-        if query:
-            query = unicode(query, 'utf8')
-            # XXX should use getUtility
-            catalog = self.context.service_catalog
-            index = catalog.Indexes['fulltext']
-            try:
-                max_index = view.results.start + len(view.results) + 1
-                rankings = index.query(query, max_index)[0]
-                if rankings:
-                    self.highest = rankings[0][1]/100.0
-                    self.rankings = dict(rankings)
-            except ParseError:
-                pass
-
+        # Scores are computed by the catalog search, and set on each
+        # brain. There are none if the results are sorted on an index.
+        self.highest = getattr(view, 'highest_score', None)
         self.img = '<img alt="Rank" src="%s"/>' % view.static['ranking.gif']()
 
     def render(self, item):
-        rid = item.getRID()
-        if rid in self.rankings:
+        score = item.getScore()
+        if score is not None and self.highest:
             return '<span class="searchresult-ranking">%s %.1f%%</span>' % (
-                self.img, (self.rankings[rid] / self.highest))
+                self.img, 100.0 * score / self.highest)
         return None
 
 
 class TotalResultCountView(ResultView):
     grok.adapts(schema.TotalResultCountField, IQuery, Interface)
+    catalogColumns = ()
 
     def render(self, item):
-        # the actual count is calculated in the pagetemplate
-        # this is only here, so it can be enabled / disabled
-        # in the smi.
+        # the actual count is computed by the view and displayed
+        # by the pagetemplate, with IFind.countResults, this is
+        # only here, so it can be enabled / disabled in the smi.
 
         # Please note that enabling that showing the total
         # number of search results might be a security risk
@@ -117,6 +147,7 @@ class TotalResultCountView(ResultView):
 
 class ResultCountView(ResultView):
     grok.adapts(schema.ResultCountField, IQuery, Interface)
+    catalogColumns = ()
 
     def render(self, item):
         # the actual count is calculated in the pagetemplate
@@ -127,14 +158,12 @@ class ResultCountView(ResultView):
 
 class LinkResultView(ResultView):
     grok.adapts(schema.LinkResultField, IQuery, Interface)
+    catalogColumns = (TITLE_COLUMN, CONTENT_PATH_COLUMN)
+    cacheable = True
 
     def render(self, item):
-        content = item.getObject()
-        title = content.get_title_or_id()
-        if IVersion.providedBy(content):
-            url = absoluteURL(content.get_silva_object(), self.request)
-        else:
-            url = absoluteURL(content, self.request)
+        title = item.getTitle()
+        url = item.getContentURL()
         ellipsis = '&#8230;'
         if len(title) > 50:
             title = title[:50] + ellipsis
@@ -143,15 +172,16 @@ class LinkResultView(ResultView):
 
 class DateResultView(ResultView):
     grok.adapts(schema.DateResultField, IQuery, Interface)
+    catalogColumns = (MODIFICATION_COLUMN,)
+    cacheable = True
 
     def update(self, view):
         self.locale = localdatetime.get_locale_info(self.request)
 
     def render(self, item):
-        content = item.getObject()
         # XXX we should use publication_datetime on publishable, but
         # it is currently broken
-        date = content.get_modification_datetime()
+        date = item.getModificationDatetime()
         datestr = ''
         if date:
             if hasattr(date, 'asdatetime'):
@@ -165,28 +195,48 @@ class DateResultView(ResultView):
 
 class ThumbnailResultView(ResultView):
     grok.adapts(schema.ThumbnailResultField, IQuery, Interface)
+    catalogColumns = (CONTENT_TYPE_COLUMN, THUMBNAIL_COLUMN)
+    cacheable = True
 
     def render(self, item):
-        content = item.getObject()
-
-        if not IImage.providedBy(content):
+        if item.getContentType() != 'Silva Image':
             return
 
-        if content.thumbnail_image is None:
+        url = item.getThumbnailURL()
+        if url is None:
             return
 
         anchor = '<a href="%s"><img src="%s/thumbnail_image" /></a>' % (
-            item.getURL(), content.thumbnail_image.get_download_url())
+            item.getURL(), url)
         return '<div class="searchresult-thumbnail">%s</div>' % anchor
 
 
 class FullTextResultView(ResultView):
     grok.adapts(schema.FullTextResultField, IQuery, Interface)
+    cacheable = True
+    size = 40
+
+    def update(self, view):
+        self.engine = SnippetEngine(
+            self.request.form.get('fulltext', ''), self.size)
+        self.store = query_snippet_store(self.context.service_catalog)
+        if self.store is not None:
+            self.catalogColumns = ()
+
+    def getCacheKey(self, item):
+        # Snippets depend on the searched terms.
+        terms = u' '.join(self.engine.terms).encode('utf-8')
+        return (self.size, hashlib.md5(terms).hexdigest())
 
     def render(self, item):
-        ellipsis = '&#8230;'
-        maxwords = 40
-        searchterm = unicode(self.request.form.get('fulltext', ''), 'utf8')
+        if self.store is not None:
+            rid = item.getRID()
+            text = self.store.getText(rid)
+            if text is not None:
+                if not text:
+                    return ''
+                return '<div class="searchresult-snippet">%s</div>' % (
+                    self.engine.snippet(text, self.store.getOffsets(rid)))
         catalog = self.context.service_catalog
         fulltext = catalog.getIndexDataForRID(item.getRID()).get('fulltext', [])
 
@@ -196,164 +246,66 @@ class FullTextResultView(ResultView):
 
         content = item.getObject()
 
-        # since fulltext always starts with id and title, lets remove that
-        idstring = content.id
-        if IVersion.providedBy(content):
-            idstring = content.get_silva_object().id
-        skipwords = len(('%s %s' % (idstring, content.get_title())).split(' '))
-        fulltext = fulltext[skipwords:]
-        fulltextstr = ' '.join(fulltext)
-
-        searchterms = searchterm.split()
-
-        if not searchterms:
-            # searchterm is not specified,
-            # return the first 20 words
-            text = ' '.join(fulltext[:maxwords])
-            if IVersion.providedBy(content) and hasattr(content, 'fulltext'):
-                realtext = ' '.join(content.fulltext()[2:])
-                # replace multiple whitespace characters with one space
-                realtext = re.compile('[\ \n\t\xa0]+').sub(' ', realtext)
-                text = ' '.join(realtext.split()[:maxwords])
-            if len(fulltext) > maxwords:
-                text += ' ' + ellipsis
+        if IVersion.providedBy(content) and hasattr(content, 'fulltext'):
+            # use the original text (with punctuation) of the
+            # document, without the id and the title
+            words = ' '.join(content.fulltext()[2:]).split()
         else:
-            words = maxwords / len(searchterms)
-            text = []
-            lowestpos = len(fulltext)
-            highestpos = 0
-
-            hilite_terms = []
-            for searchterm in searchterms:
-                term = re.escape(searchterm)
-
-                if '?' in term or '*' in term:
-                    termq = term.replace('\\?', '.')
-                    termq = termq.replace('\\*', '.[^\ ]*')
-                    term_found = re.compile(termq).findall(fulltextstr)
-                    if term_found:
-                        hilite_terms += term_found
-                        searchterms.remove(searchterm)
-                        term = term_found[0]
-                        searchterms.append(term.strip())
-                    else:
-                        hilite_terms.append(term)
-                else:
-                    hilite_terms.append(term)
-
-                if not term in fulltext:
-                    # term matched probably something in the title
-                    # return the first n words:
-                    line = ' '.join(fulltext[:words])
-                    text.append(line)
-                    lowestpos = 0
-                    highestpos = words
-                    continue
-
-                pos = fulltext.index(term)
-                if pos < lowestpos:
-                    lowestpos = pos
-                if pos > highestpos:
-                    highestpos = pos
-                start = pos -(words/2)
-                end = pos + (words/2) + 1
-                if start < 0 :
-                    end += -start
-                    start = 0
-
-                pre = ' '.join(fulltext[start:pos])
-                post = ' '.join(fulltext[pos+1:end])
-
-                if not text and start != 0:
-                    # we're adding the first (splitted) result
-                    # and it's not at the beginning of the fulltext
-                    # lets add an ellipsis
-                    pre = ellipsis + pre
-
-
-                text.append('%s %s %s %s' % (
-                                pre,
-                                fulltext[pos],
-                                post,
-                                ellipsis)
-                            )
-            # if all the terms that are found are close together,
-            # then use this, otherwise, we would end
-            # up with the same sentence for each searchterm
-            # this code will create a new text result list, which
-            # does not have 'split' results.
-            if lowestpos < highestpos:
-                if highestpos - lowestpos < maxwords:
-                    padding = (maxwords-(highestpos - lowestpos ))/2
-                    lowestpos -= padding
-                    highestpos += padding
-                    if lowestpos < 0:
-                        highestpos += -lowestpos
-                        lowestpos = 0
-
-                    text = fulltext[lowestpos:highestpos]
-                    if not lowestpos == 0:
-                        text[0] = '%s %s' % (ellipsis, text[0])
-                    if highestpos < len(fulltext)-1:
-                        text[-1] += ' %s' % ellipsis
-
-            # do some hiliting, use original text
-            # (with punctuation) if this is a silva document
-            text = ' '.join(text)
-            if IVersion.providedBy(content) and hasattr(content, 'fulltext'):
-                realtext = ' '.join(content.fulltext()[2:])
-                # replace multiple whitespace characters with one space
-                realtext = re.compile('[\ \n\t\xa0]+').sub(' ', realtext)
-                textparts = text.split(ellipsis)
-                new = []
-                for textpart in textparts:
-                    if textpart == '':
-                        new.append('')
-                        continue
-                    textpart = textpart.strip()
-                    find = textpart.replace(' ', '[^a-zA-Z0-9]+')
-                    textexpr = re.compile(find, re.IGNORECASE)
-                    text = textexpr.findall(realtext)
-                    if text:
-                        text = text[0]
-                    else:
-                        # somehow we can't find a match in original text
-                        # use the one from the catalog
-                        text = textpart
-                    new.append(text)
-                text = ellipsis.join(new)
-
-            for term in hilite_terms:
-                if term.startswith('"'):
-                    term = term[1:]
-                if term.endswith('"'):
-                    term = term[:-1]
-                term = re.escape(term)
-                text = ' ' + text
-                regexp = re.compile(
-                    '([^a-zA-Z0-9]+)(%s)([^a-zA-Z0-9]+)' % term.lower(),
-                    re.IGNORECASE)
-                sub = ('\g<1><strong class="search-result-snippet-hilite">'
-                       '\g<2></strong>\g<3>')
-                text = regexp.sub(sub, text)
-        return '<div class="searchresult-snippet">%s</div>' % text.strip()
+            # since fulltext always starts with id and title, lets
+            # remove that
+            idstring = item.getSilvaObject().id
+            skipwords = len(
+                ('%s %s' % (idstring, content.get_title())).split(' '))
+            words = fulltext[skipwords:]
+        return '<div class="searchresult-snippet">%s</div>' % (
+            self.engine.snippet(words))
 
 
 class BreadcrumbsResultView(ResultView):
     grok.adapts(schema.BreadcrumbsResultField, IQuery, Interface)
+    catalogColumns = (CONTENT_PATH_COLUMN,)
 
-    def render(self, item):
-        content = item.getObject()
+    def update(self, view):
+        service = getUtility(IFindService)
+        self.cache = service.getBreadcrumbCache()
+        self.generation = service.getBreadcrumbGeneration()
+        self.catalog = self.context.service_catalog
+        self.top = breadcrumbs_top(self.context.get_root(), self.request)
+        # URL of the first breadcrumb, that changes with virtual hosting.
+        self.base = self.request.physicalPathToURL(self.top)
+
+    def getBreadcrumbs(self, path):
+        crumbs = catalog_breadcrumbs(
+            self.catalog, self.request, self.top, path)
+        if crumbs is None:
+            container = self.context.unrestrictedTraverse(path)
+            breadcrumb = getMultiAdapter(
+                (container, self.request), IAbsoluteURL)
+            crumbs = [(crumb['url'], crumb['name'])
+                      for crumb in breadcrumb.breadcrumbs()]
         part = []
-        breadcrumb = getMultiAdapter((content, self.request), IAbsoluteURL)
-        for crumb in breadcrumb.breadcrumbs()[:-1]:
-            part.append('<a href="%s">%s</a>' % (crumb['url'], crumb['name']))
+        for url, name in crumbs:
+            part.append('<a href="%s">%s</a>' % (url, name))
         part = '<span> &#183; </span>'.join(part)
         return '<span class="searchresult-breadcrumb">%s</span>' % part
 
+    def render(self, item):
+        # The breadcrumbs of the result are the ones of its container.
+        path = item.getContentPath().rsplit('/', 1)[0]
+        if self.cache is None:
+            return self.getBreadcrumbs(path)
+        key = (path, self.base)
+        cached = self.cache.get(key)
+        if cached is not None and cached[0] == self.generation:
+            return cached[1]
+        html = self.getBreadcrumbs(path)
+        self.cache.set(key, (self.generation, html))
+        return html
+
 
 class MetadataResultView(ResultView):
     grok.adapts(schema.MetadataResultField, IQuery, Interface)
+    cacheable = True
 
     def update(self, view):
         self.set_name, self.element_name = self.result.getId().split(':')
@@ -367,8 +319,10 @@ class MetadataResultView(ResultView):
         if metadata_element.metadata_in_catalog_p:
             # If the metadata is available on the brain, directly use it
             metadata_key = createIndexId(metadata_element)
+            self.catalogColumns = (metadata_key,)
             self.getValue = lambda item: getattr(item, metadata_key)
         else:
+            self.catalogColumns = None
             self.getValue = lambda item: service.getMetadataValue(
                 item.getObject(), self.set_name, self.element_name)
 
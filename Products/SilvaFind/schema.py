@@ -9,9 +9,15 @@ from Products.SilvaFind import interfaces
 # old style classes because the unpickling is different and it breaks
 # if the inherit from object
 
-# XXX: This is based on a list implementation so it is slow on large
-# schemas. Don't do large schemas.
+# Schemas are immutable: fields are indexed by name when the schema is
+# created or unpickled. Only the list of fields is pickled, so stored
+# schemas stay compatible with the previous list based implementation.
 
+# Partitions of the fields that are computed in advance.
+PARTITIONS = (
+    interfaces.IPathCriterionField,
+    interfaces.IMetadataCriterionField,
+    interfaces.IFullTextCriterionField)
 
 _marker = object()
 
@@ -19,27 +25,64 @@ class Schema:
     implements(interfaces.ISchema)
 
     def __init__(self, fields):
-        self.fields = fields
+        self.__setstate__({'fields': fields})
+
+    def __getstate__(self):
+        return {'fields': list(self.fields)}
+
+    def __setstate__(self, state):
+        fields = tuple(state['fields'])
+        names = tuple(field.getName() for field in fields)
+        index = {}
+        for name, field in zip(names, fields):
+            # Like a scan of the fields, the first one wins.
+            index.setdefault(name, field)
+        partitions = {}
+        for interface in PARTITIONS:
+            partitions[interface] = tuple(
+                field for field in fields if interface.providedBy(field))
+        self.__dict__.update({
+                'fields': fields,
+                '_names': names,
+                '_index': index,
+                '_partitions': partitions})
+
+    def __setattr__(self, name, value):
+        raise AttributeError(u'Schema are immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError(u'Schema are immutable')
 
     def getField(self, name, default=_marker):
-        for field in self.fields:
-            if field.getName() == name:
-                return field
-        if default is _marker:
+        field = self._index.get(name, default)
+        if field is _marker:
             raise KeyError(name)
-        return default
+        return field
 
     def hasField(self, name):
-        return name in self.getFieldNames()
+        return name in self._index
 
     __getitem__ = getField
     __contains__ = hasField
 
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
     def getFields(self):
-        return self.fields
+        return list(self.fields)
 
     def getFieldNames(self):
-        return [field.getName() for field in self.getFields()]
+        return list(self._names)
+
+    def getFieldsProvidedBy(self, interface):
+        fields = self._partitions.get(interface)
+        if fields is None:
+            fields = tuple(
+                field for field in self.fields if interface.providedBy(field))
+        return fields
 
 
 class SearchSchema(Schema):
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+from array import array
+from cStringIO import StringIO
+from cgi import escape
+import gzip
+import hashlib
+
+from five import grok
+from zExceptions import NotFound
+from zope.component import getUtility, queryMultiAdapter
+from zope.traversing.browser import absoluteURL
+from silva.core.views.interfaces import IHTTPResponseHeaders
+import Missing
+
+from Products.SilvaFind.cache import get_cache
+from Products.SilvaFind.catalog import CONTENT_PATH_COLUMN
+from Products.SilvaFind.catalog import MODIFICATION_COLUMN, iter_brains
+from Products.SilvaFind.catalog import get_counter
+from Products.SilvaFind.interfaces import IFind, IFindService
+from Products.SilvaFind.SilvaFind import not_modified
+
+SITEMAP_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+SITEMAP_FOOTER = '</urlset>\n'
+SITEMAP_URL = '<url><loc>%s</loc></url>\n'
+SITEMAP_DATED_URL = '<url><loc>%s</loc><lastmod>%s</lastmod></url>\n'
+INDEX_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+INDEX_FOOTER = '</sitemapindex>\n'
+INDEX_SITEMAP = '<sitemap><loc>%s</loc></sitemap>\n'
+INDEX_DATED_SITEMAP = '<sitemap><loc>%s</loc><lastmod>%s</lastmod></sitemap>\n'
+
+# Results are assigned to a shard by record id, that is not evenly
+# distributed: stay well below the 50,000 URLs allowed per sitemap.
+# When the number of shards changes, results are assigned to other
+# shards, and all of them are generated again.
+SHARD_SIZE = 40000
+# Number of shards and sitemap plans kept in memory per Silva Find.
+SHARD_CACHE_SIZE = 32
+
+
+def brain_date(brain, key):
+    """Read a date out of a catalog brain.
+    """
+    if key in brain:
+        value = brain[key]
+        if value not in (Missing.Value, None):
+            return value.HTML4()
+    return ''
+
+
+def brain_path(brain):
+    """Return the path of the Silva content of a catalog brain.
+    """
+    if CONTENT_PATH_COLUMN in brain:
+        path = brain[CONTENT_PATH_COLUMN]
+        if path not in (Missing.Value, None):
+            return path
+    return brain.getPath()
+
+
+def sitemap_chunks(brains, request, size=65536):
+    """Return the sitemap of the given brains, in chunks of about
+    size bytes.
+    """
+    chunk = [SITEMAP_HEADER]
+    length = len(SITEMAP_HEADER)
+    for brain in brains:
+        url = escape(request.physicalPathToURL(brain_path(brain)))
+        lastmod = brain_date(brain, MODIFICATION_COLUMN)
+        if lastmod:
+            line = SITEMAP_DATED_URL % (url, lastmod)
+        else:
+            line = SITEMAP_URL % url
+        chunk.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(chunk)
+            chunk = []
+            length = 0
+    chunk.append(SITEMAP_FOOTER)
+    yield ''.join(chunk)
+
+
+def shard_count(total):
+    """Return the number of shards needed for total results.
+    """
+    return max(1, (total + SHARD_SIZE - 1) // SHARD_SIZE)
+
+
+def shard_plan(brains, count):
+    """Return a list of (signature, lastmod, rids) for each of the
+    count shards of the given brains, rids being the record ids of
+    its entries. The signature of a shard changes if one of its
+    entries changes.
+    """
+    signatures = [hashlib.md5() for index in range(count)]
+    lastmods = [None] * count
+    rids = [array('i') for index in range(count)]
+    for brain in brains:
+        rid = brain.getRID()
+        shard = rid % count
+        rids[shard].append(rid)
+        modified = None
+        if MODIFICATION_COLUMN in brain:
+            modified = brain[MODIFICATION_COLUMN]
+            if modified is Missing.Value:
+                modified = None
+        signatures[shard].update(
+            '%d:%s:%s\n' % (rid, brain_path(brain), modified))
+        if modified is not None:
+            if lastmods[shard] is None or modified > lastmods[shard]:
+                lastmods[shard] = modified
+    return [(signature.hexdigest(), modified and modified.HTML4() or '',
+             shard_rids)
+            for signature, modified, shard_rids
+            in zip(signatures, lastmods, rids)]
+
+
+def shard_brains(catalog, rids):
+    """Return the brains of the given record ids, skipping the ones
+    removed from the catalog since.
+    """
+    records = catalog._catalog
+    for rid in rids:
+        try:
+            yield records[rid]
+        except KeyError:
+            continue
+
+
+def count_sitemap(find, name):
+    """Count a sitemap generated for find in the statistics.
+    """
+    getUtility(IFindService).getStatistics().increment(
+        '/'.join(find.getPhysicalPath()), name)
+
+
+def compress(chunks):
+    """Return the given chunks gzip-compressed.
+    """
+    data = StringIO()
+    output = gzip.GzipFile(fileobj=data, mode='wb', mtime=0)
+    for chunk in chunks:
+        output.write(chunk)
+    output.close()
+    return data.getvalue()
+
+
+class SitemapShards(object):
+    """Sitemap of the results of a Silva Find, split in shards that
+    are generated when they change, and kept compressed in memory.
+    """
+
+    def __init__(self, context, request):
+        self.context = context
+        self.request = request
+        self.catalog = context.get_root().service_catalog
+        self.cache = get_cache(
+            'sitemaps', context.getPhysicalPath(), SHARD_CACHE_SIZE)
+        # Sitemaps contain URLs, that depend on the virtual host.
+        self.base = request.physicalPathToURL('')
+        self._results = None
+
+    def getResults(self):
+        if self._results is None:
+            self._results = self.context.searchResults(
+                self.request, validate=False)
+        return self._results
+
+    def getPlan(self):
+        """Return the signature, lastmod and record ids of each
+        shard. It is computed again only when the catalog or the
+        Silva Find changed.
+        """
+        counter = get_counter(self.catalog)
+        key = ('plan', self.base, self.context._p_serial)
+        if counter is not None:
+            cached = self.cache.get(key)
+            if cached is not None and cached[0] == counter:
+                return cached[1]
+        results = self.getResults()
+        plan = shard_plan(iter_brains(results), shard_count(len(results)))
+        if counter is not None:
+            self.cache.set(key, (counter, plan))
+        return plan
+
+    def getShard(self, index):
+        """Return the compressed sitemap of the shard index.
+        """
+        plan = self.getPlan()
+        if not 0 <= index < len(plan):
+            raise KeyError(index)
+        count = len(plan)
+        signature, lastmod, rids = plan[index]
+        key = ('shard', self.base, count, index)
+        cached = self.cache.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        # Only the brains of the shard are created.
+        brains = shard_brains(self.catalog, rids)
+        data = compress(sitemap_chunks(brains, self.request))
+        self.cache.set(key, (signature, data))
+        count_sitemap(self.context, 'sitemap_shards')
+        return data
+
+
+class FindSitemapIndex(grok.View):
+    """Index of the sitemap shards of a Silva Find.
+    """
+    grok.context(IFind)
+    grok.require('zope2.View')
+    grok.name('sitemap_index.xml')
+
+    def update(self):
+        self.unchanged = not_modified(
+            self.context, self.request, 'sitemap_index.xml')
+
+    def render(self):
+        if self.unchanged:
+            return u''
+        self.response.setHeader(
+            'Content-Type',
+            'application/xml;charset=utf-8')
+        url = absoluteURL(self.context, self.request)
+        shards = SitemapShards(self.context, self.request)
+        lines = [INDEX_HEADER]
+        for index, (signature, lastmod, rids) in enumerate(
+            shards.getPlan()):
+            loc = escape('%s/sitemap_shard.xml.gz?shard=%d' % (url, index))
+            if lastmod:
+                lines.append(INDEX_DATED_SITEMAP % (loc, lastmod))
+            else:
+                lines.append(INDEX_SITEMAP % loc)
+        lines.append(INDEX_FOOTER)
+        return ''.join(lines)
+
+
+class FindSitemapShard(grok.View):
+    """One gzip-compressed sitemap shard of a Silva Find.
+    """
+    grok.context(IFind)
+    grok.require('zope2.View')
+    grok.name('sitemap_shard.xml.gz')
+
+    def update(self):
+        try:
+            self.shard = int(self.request.form.get('shard', 0))
+        except (TypeError, ValueError):
+            raise NotFound('sitemap_shard.xml.gz')
+        self.unchanged = not_modified(
+            self.context, self.request,
+            'sitemap_shard.xml.gz:%d' % self.shard)
+
+    def render(self):
+        if self.unchanged:
+            return ''
+        shards = SitemapShards(self.context, self.request)
+        try:
+            data = shards.getShard(self.shard)
+        except KeyError:
+            raise NotFound('sitemap_shard.xml.gz')
+        self.response.setHeader('Content-Type', 'application/x-gzip')
+        return data
+
+
+class FindSitemap(grok.View):
+    """Sitemap of the results of a Silva Find. It is written to the
+    response while the results are read from the catalog.
+    """
+    grok.context(IFind)
+    grok.require('zope2.View')
+    grok.name('sitemap.xml')
+    # Objects loaded from the database are released every gc_interval
+    # chunks.
+    gc_interval = 16
+
+    def update(self):
+        self.unchanged = not_modified(
+            self.context, self.request, 'sitemap.xml')
+
+    def render(self):
+        if self.unchanged:
+            return u''
+        self.response.setHeader(
+            'Content-Type',
+            'application/xml;charset=utf-8')
+        results = self.context.searchResults(self.request, validate=False)
+        count_sitemap(self.context, 'sitemaps')
+        # The headers are sent with the first chunk, before the
+        # publisher sets the cache headers after render: they are
+        # set now.
+        headers = queryMultiAdapter(
+            (self.request, self.context), IHTTPResponseHeaders)
+        if headers is not None:
+            headers()
+        jar = self.context._p_jar
+        for index, chunk in enumerate(
+            sitemap_chunks(iter_brains(results), self.request)):
+            self.response.write(chunk)
+            if jar is not None and not (index + 1) % self.gc_interval:
+                jar.cacheGC()
+        return u''
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+from collections import deque
+import math
+import threading
+import time
+
+from Products.SilvaFind.timing import logger
+
+# Options whose values describe the shape of a query, not its data.
+STRUCTURAL_OPTIONS = frozenset(['sort_on', 'sort_order'])
+STRUCTURAL_KEYS = frozenset(['operator', 'range', 'usage'])
+
+
+def normalize(value):
+    """Return value with its literal values replaced by placeholders.
+    """
+    if isinstance(value, dict):
+        return '{%s}' % ', '.join(
+            '%s: %s' % (key, value[key] if key in STRUCTURAL_KEYS
+                        else normalize(value[key]))
+            for key in sorted(value))
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return '[?]'
+    return '?'
+
+
+def fingerprint(options):
+    """Return a fingerprint of catalog query options, that is the
+    same for all the queries on the same indexes.
+    """
+    return ', '.join(
+        '%s=%s' % (key, options[key] if key in STRUCTURAL_OPTIONS
+                   else normalize(options[key]))
+        for key in sorted(options))
+
+
+def percentile(values, fraction):
+    """Return the nearest-rank percentile of sorted values.
+    """
+    index = int(math.ceil(fraction * len(values))) - 1
+    return values[min(max(index, 0), len(values) - 1)]
+
+
+class SlowQueryLog(object):
+    """In-memory log of the last slow searches of a Zope process.
+    """
+
+    def __init__(self, size=1000):
+        self.lock = threading.Lock()
+        self.entries = deque(maxlen=size)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, options, path, duration, count):
+        entry = {'time': time.time(),
+                 'fingerprint': fingerprint(options),
+                 'path': path,
+                 'duration': duration,
+                 'count': count}
+        with self.lock:
+            self.entries.append(entry)
+        logger.warning(
+            'slow search find=%s catalog=%.1fms results=%d query=%s',
+            path, duration * 1000, count, entry['fingerprint'])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def aggregate(self):
+        """Return statistics per fingerprint, the slowest first.
+        """
+        with self.lock:
+            entries = list(self.entries)
+        groups = {}
+        for entry in entries:
+            groups.setdefault(entry['fingerprint'], []).append(entry)
+        statistics = []
+        for key, group in groups.items():
+            durations = sorted(entry['duration'] for entry in group)
+            statistics.append(
+                {'fingerprint': key,
+                 'count': len(group),
+                 'paths': sorted(set(entry['path'] for entry in group)),
+                 'results': max(entry['count'] for entry in group),
+                 'p50': percentile(durations, 0.5),
+                 'p95': percentile(durations, 0.95),
+                 'max': durations[-1],
+                 'total': sum(durations)})
+        statistics.sort(key=lambda item: item['total'], reverse=True)
+        return statistics
+
+
+_logs_lock = threading.Lock()
+_logs = {}
+
+
+def get_slow_log(owner):
+    """Return the slow query log of the given owner (usually the
+    physical path of the find service).
+    """
+    with _logs_lock:
+        log = _logs.get(owner)
+        if log is None:
+            log = _logs[owner] = SlowQueryLog()
+    return log
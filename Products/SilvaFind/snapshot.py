@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+from array import array
+import hashlib
+import os
+
+from Products.SilvaFind.catalog import PUBLIC_STATUS, STATUS_INDEX
+from Products.SilvaFind.catalog import canonical, result_rids
+
+# Form parameter carrying the snapshot token in the batch links.
+SNAPSHOT_KEY = 'snapshot'
+
+
+def new_token():
+    """Return a new random snapshot token.
+    """
+    return os.urandom(8).encode('hex')
+
+
+def query_key(form):
+    """Return a key identifying the search made with a request form,
+    whatever the displayed page is.
+    """
+    values = [(key, value) for key, value in form.items()
+              if not key.startswith('bstart') and key != SNAPSHOT_KEY]
+    return hashlib.md5(repr(canonical(sorted(values)))).hexdigest()
+
+
+class Records(object):
+    """Sequence of the catalog brains of a list of record ids. Brains
+    are created when they are accessed, and not kept.
+    """
+
+    def __init__(self, catalog, rids, scores=None, count=None):
+        self._records = catalog._catalog
+        self.rids = rids
+        self.scores = scores
+        self.actual_result_count = len(rids) if count is None else count
+        self._highest = max(scores) if scores else 1.0
+
+    def __len__(self):
+        return len(self.rids)
+
+    def __getitem__(self, index):
+        brain = self._records[self.rids[index]]
+        if self.scores is not None:
+            score = self.scores[index]
+            brain.data_record_score_ = score
+            brain.data_record_normalized_score_ = int(
+                100.0 * score / (self._highest or 1.0))
+        return brain
+
+
+class Snapshot(object):
+    """Record ids of the results of a search, in the order they were
+    when it was run. The first known of them have already been
+    checked. If the search was limited, count is the number of
+    results it would have had.
+    """
+    __slots__ = ('owner', 'query', 'rids', 'scores', 'known', 'count')
+
+    def __init__(self, owner, query, rids, scores, known, count):
+        self.owner = owner
+        self.query = query
+        self.rids = rids
+        self.scores = scores
+        self.known = known
+        self.count = count
+
+    def __len__(self):
+        return len(self.rids)
+
+    @property
+    def complete(self):
+        return len(self.rids) >= self.count
+
+    @property
+    def highest(self):
+        """Return the highest score of the results, or None.
+        """
+        if self.scores:
+            return self.scores[0]
+        return None
+
+    def exists(self, catalog, start, stop):
+        """Return True if the results from start to stop are still
+        in the catalog, and still published.
+        """
+        records = catalog._catalog
+        paths = records.paths
+        status = None
+        if STATUS_INDEX in records.indexes:
+            status = records.getIndex(STATUS_INDEX).documentToKeyMap()
+        for rid in self.rids[start:stop]:
+            if rid not in paths:
+                return False
+            if status is not None and status.get(rid) != PUBLIC_STATUS:
+                return False
+        return True
+
+    def results(self, catalog):
+        return Records(catalog, self.rids, self.scores, self.count)
+
+    def extend(self, catalog, results):
+        """Return the results of the snapshot followed by the ones of
+        results that are not in it, to complete a limited snapshot.
+        """
+        rids, scores = result_rids(results)
+        seen = set(self.rids)
+        missing = [index for index, rid in enumerate(rids)
+                   if rid not in seen]
+        extended = self.rids + array('i', [rids[index] for index in missing])
+        extended_scores = None
+        if self.scores is not None and scores is not None:
+            extended_scores = self.scores + array(
+                'd', [scores[index] for index in missing])
+        return Records(catalog, extended, extended_scores)
+
+
+def take_snapshot(filtered, owner, query, checked=False):
+    """Return a snapshot of filtered results, containing the results
+    accepted so far followed by the ones not checked yet. If checked
+    is True, the results don't need to be checked.
+    """
+    results = filtered.results
+    if isinstance(results, Records):
+        rids, scores = results.rids, results.scores
+    else:
+        rids, scores = result_rids(results)
+    known = filtered.known
+    cursor = filtered.checked
+    accepted = array('i', [item.getRID() for item in filtered.accepted])
+    snapshot_rids = rids[:known] + accepted + rids[cursor:]
+    snapshot_scores = None
+    if scores is not None:
+        checked_scores = dict(zip(rids[known:cursor], scores[known:cursor]))
+        snapshot_scores = (
+            scores[:known] +
+            array('d', [checked_scores[rid] for rid in accepted]) +
+            scores[cursor:])
+    count = getattr(results, 'actual_result_count', None) or len(rids)
+    count -= cursor - known - len(accepted)
+    if checked:
+        known = len(snapshot_rids)
+    else:
+        known += len(accepted)
+    return Snapshot(
+        owner, query, snapshot_rids, snapshot_scores, known, count)
+
+
+def query_snapshot(cache, token, owner, query):
+    """Return the snapshot of token, if it has been taken by owner
+    for the same query.
+    """
+    if cache is None or not isinstance(token, basestring):
+        return None
+    snapshot = cache.get(token)
+    if snapshot is None:
+        return None
+    if snapshot.owner != owner or snapshot.query != query:
+        return None
+    return snapshot
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+from collections import deque
+import threading
+import time
+
+# Number of minutes the searches per minute are averaged on.
+RATE_MINUTES = 5
+
+
+class Counters(object):
+    """Counters of the activity of a Silva Find, or of all of them, in
+    this Zope process. They are never stored in the database.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.values = {}
+        # Searches per minute, for the last minutes.
+        self.minutes = deque(maxlen=RATE_MINUTES + 1)
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + value
+
+    def search(self, count, now=None):
+        """Count a search that returned count results.
+        """
+        minute = int((now or time.time()) // 60)
+        with self.lock:
+            self.values['searches'] = self.values.get('searches', 0) + 1
+            self.values['results'] = self.values.get('results', 0) + count
+            if self.minutes and self.minutes[-1][0] == minute:
+                self.minutes[-1][1] += 1
+            else:
+                self.minutes.append([minute, 1])
+
+    def getSearchRate(self, now=None):
+        """Return the average number of searches per minute, over the
+        last complete minutes.
+        """
+        now = now or time.time()
+        current = int(now // 60)
+        with self.lock:
+            searches = sum(count for minute, count in self.minutes
+                           if current - RATE_MINUTES <= minute < current)
+        # Don't average on the minutes before the counters started.
+        minutes = min(RATE_MINUTES, current - int(self.started // 60))
+        if minutes < 1:
+            return 0.0
+        return float(searches) / minutes
+
+    def snapshot(self, now=None):
+        with self.lock:
+            values = dict(self.values)
+        searches = values.get('searches', 0)
+        values['searches_per_minute'] = self.getSearchRate(now)
+        values['average_results'] = (
+            float(values.get('results', 0)) / searches if searches else 0.0)
+        return values
+
+
+class Statistics(object):
+    """Counters for all the Silva Finds, and for each of them.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.total = Counters()
+        self.finds = {}
+
+    def get(self, path):
+        with self.lock:
+            counters = self.finds.get(path)
+            if counters is None:
+                counters = self.finds[path] = Counters()
+        return counters
+
+    def increment(self, path, name, value=1):
+        self.total.increment(name, value)
+        self.get(path).increment(name, value)
+
+    def search(self, path, count):
+        now = time.time()
+        self.total.search(count, now)
+        self.get(path).search(count, now)
+
+    def snapshot(self):
+        with self.lock:
+            finds = self.finds.items()
+        return {'total': self.total.snapshot(),
+                'finds': dict((path, counters.snapshot())
+                              for path, counters in finds)}
+
+
+_statistics_lock = threading.Lock()
+_statistics = {}
+
+
+def get_statistics(owner):
+    """Return the statistics of the given owner (usually the physical
+    path of the find service).
+    """
+    with _statistics_lock:
+        statistics = _statistics.get(owner)
+        if statistics is None:
+            statistics = _statistics[owner] = Statistics()
+    return statistics
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+from BTrees.IIBTree import IITreeSet
+from BTrees.OOBTree import OOBTree
+from Products.ZCatalog.Lazy import LazyMap
+
+
+class Brain(object):
+    """Brain stand-in that counts the objects woken up.
+    """
+    woken = 0
+
+    def __init__(self, rid):
+        self.rid = rid
+
+    def getRID(self):
+        return self.rid
+
+    def getObject(self):
+        Brain.woken += 1
+        return self.rid
+
+
+class KeyIndex(object):
+    """Index stand-in that keeps a key per document, and counts the
+    times its documents are mapped to their keys. If tree is True, it
+    has the tree of the documents of each key of an UnIndex.
+    """
+
+    def __init__(self, keys, tree=False):
+        self.keys = keys
+        self.mapped = 0
+        if tree:
+            documents = {}
+            for rid, key in keys.items():
+                documents.setdefault(key, []).append(rid)
+            # Like in UnIndex, a key of one document maps to its rid.
+            self._index = OOBTree()
+            for key, rids in documents.items():
+                if len(rids) == 1:
+                    self._index[key] = rids[0]
+                else:
+                    self._index[key] = IITreeSet(rids)
+
+    def documentToKeyMap(self):
+        self.mapped += 1
+        return self.keys
+
+
+class CatalogRecords(object):
+    """Catalog records stand-in, that counts the brains created.
+    """
+
+    def __init__(self, rids, indexes=None):
+        self.paths = dict((rid, '/root/content%d' % rid) for rid in rids)
+        self.indexes = indexes or {}
+        self.created = 0
+
+    def getIndex(self, name):
+        return self.indexes[name]
+
+    def __getitem__(self, rid):
+        if rid not in self.paths:
+            raise KeyError(rid)
+        self.created += 1
+        return Brain(rid)
+
+
+class Catalog(object):
+    """Catalog stand-in that counts the searches. They all return the
+    cataloged record ids in the given order, with their scores if
+    there are any.
+    """
+
+    def __init__(self, rids, indexes=None, scores=None):
+        self.rids = list(rids)
+        self.scores = scores
+        self.counter = 1
+        self.searches = 0
+        self._catalog = CatalogRecords(self.rids, indexes)
+
+    def getCounter(self):
+        return self.counter
+
+    def searchResults(self, query=None):
+        self.searches += 1
+        records = self._catalog
+        if self.scores is None:
+            return LazyMap(
+                records.__getitem__, self.rids, len(self.rids),
+                actual_result_count=len(self.rids))
+        return LazyMap(
+            lambda item: records[item[1]], zip(self.scores, self.rids),
+            len(self.rids), actual_result_count=len(self.rids))
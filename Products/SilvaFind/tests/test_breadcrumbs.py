@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+import unittest
+
+from zope.component import getUtility
+from zope.event import notify
+from zope.interface import alsoProvides
+from zope.lifecycleevent import ObjectModifiedEvent, ObjectMovedEvent
+
+from Products.SilvaFind.interfaces import IFindService
+from Products.SilvaFind.results.breadcrumbs import breadcrumbs_top
+from Products.SilvaFind.results.breadcrumbs import catalog_breadcrumbs
+from Products.SilvaFind.testing import FunctionalLayer
+from Products.SilvaMetadata.interfaces import IMetadataService
+from silva.core.services.interfaces import ICatalogService
+from silva.core.views.interfaces import IDisableBreadcrumbTag
+
+
+class Request(dict):
+
+    def physicalPathToURL(self, path):
+        if not isinstance(path, basestring):
+            path = '/'.join(path)
+        return 'http://localhost' + path
+
+
+class BreadcrumbsTestCase(unittest.TestCase):
+    layer = FunctionalLayer
+
+    def setUp(self):
+        self.root = self.layer.get_application()
+        self.layer.login('manager')
+        factory = self.root.manage_addProduct['Silva']
+        factory.manage_addFolder('folder', 'Folder')
+        factory = self.root.folder.manage_addProduct['Silva']
+        factory.manage_addFolder('sub', 'Sub folder')
+
+    def test_top(self):
+        self.assertEqual(
+            breadcrumbs_top(self.root, Request()), ('', 'root'))
+        self.assertEqual(
+            breadcrumbs_top(self.root, Request(
+                    VirtualRootPhysicalPath=('', 'root', 'folder'))),
+            ('', 'root', 'folder'))
+        self.assertEqual(
+            breadcrumbs_top(self.root, Request(
+                    VirtualRootPhysicalPath=('', 'other'))),
+            ('', 'root'))
+
+    def test_catalog_breadcrumbs(self):
+        catalog = getUtility(ICatalogService)
+        self.assertEqual(
+            catalog_breadcrumbs(
+                catalog, Request(), ('', 'root', 'folder'),
+                '/root/folder/sub'),
+            [('http://localhost/root/folder', 'Folder'),
+             ('http://localhost/root/folder/sub', 'Sub folder')])
+        self.assertEqual(
+            catalog_breadcrumbs(
+                catalog, Request(), ('', 'root', 'folder'),
+                '/root/folder/missing'),
+            None)
+        self.assertEqual(
+            catalog_breadcrumbs(
+                catalog, Request(), ('', 'root', 'folder'), '/root'),
+            None)
+
+    def test_catalog_breadcrumbs_titles(self):
+        """Breadcrumbs use the short titles, shortened to 50
+        characters like the breadcrumbs adapter does.
+        """
+        catalog = getUtility(ICatalogService)
+        metadata = getUtility(IMetadataService)
+        metadata.getMetadata(self.root.folder).setValues(
+            'silva-content', {'shorttitle': u'Short'}, reindex=1)
+        metadata.getMetadata(self.root.folder.sub).setValues(
+            'silva-content', {'maintitle': u'Sub folder ' * 10}, reindex=1)
+        self.assertEqual(
+            catalog_breadcrumbs(
+                catalog, Request(), ('', 'root', 'folder'),
+                '/root/folder/sub'),
+            [('http://localhost/root/folder', u'Short'),
+             ('http://localhost/root/folder/sub',
+              u'Sub folder Sub folder Sub folder Sub folder Sub...')])
+
+    def test_catalog_breadcrumbs_disabled(self):
+        """Containers that are left out of their breadcrumbs are not
+        rendered out of the catalog.
+        """
+        catalog = getUtility(ICatalogService)
+        alsoProvides(self.root.folder.sub, IDisableBreadcrumbTag)
+        catalog.catalog_object(self.root.folder.sub)
+        self.assertEqual(
+            catalog_breadcrumbs(
+                catalog, Request(), ('', 'root', 'folder'),
+                '/root/folder/sub'),
+            None)
+
+    def test_invalidation(self):
+        service = getUtility(IFindService)
+        cache = service.getBreadcrumbCache()
+        cache.set(('/root/folder', 'http://localhost/root'), (0, 'crumbs'))
+        generation = service.getBreadcrumbGeneration()
+
+        # Adding content doesn't invalidate the breadcrumbs.
+        factory = self.root.folder.manage_addProduct['Silva']
+        factory.manage_addFolder('other', 'Other folder')
+        self.assertEqual(service.getBreadcrumbGeneration(), generation)
+
+        notify(ObjectModifiedEvent(self.root.folder))
+        self.assertEqual(service.getBreadcrumbGeneration(), generation + 1)
+        self.assertEqual(len(cache), 0)
+
+        notify(ObjectMovedEvent(
+                self.root.folder, self.root, 'folder', self.root, 'renamed'))
+        self.assertEqual(service.getBreadcrumbGeneration(), generation + 2)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(BreadcrumbsTestCase))
+    return suite
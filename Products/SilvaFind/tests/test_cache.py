@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+import threading
+import time
+import unittest
+
+from DateTime import DateTime
+from Products.ZCatalog.Lazy import LazyMap
+
+from Products.SilvaFind.cache import LRUCache, SingleFlight, get_cache
+from Products.SilvaFind.catalog import canonical, highest_score, search
+from Products.SilvaFind.tests.fixtures import Catalog
+
+
+class SlowCatalog(Catalog):
+    """Catalog stand-in whose searches take delay seconds.
+    """
+
+    def __init__(self, rids, delay):
+        super(SlowCatalog, self).__init__(rids)
+        self.delay = delay
+        self.error = None
+        self.lock = threading.Lock()
+
+    def getPhysicalPath(self):
+        return ('', 'root', 'service_catalog')
+
+    def searchResults(self, options):
+        with self.lock:
+            self.searches += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return LazyMap(
+            self._catalog.__getitem__, self.rids, len(self.rids),
+            actual_result_count=len(self.rids))
+
+
+def run_threads(count, target):
+    """Call target in count threads at once, and return what they
+    returned and raised.
+    """
+    results = []
+    errors = []
+
+    def run():
+        try:
+            results.append(target())
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=run) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+class LRUCacheTestCase(unittest.TestCase):
+
+    def test_lru(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        # b is the least recently used.
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(
+            cache.statistics(),
+            {'size': 2, 'capacity': 2, 'hits': 3, 'misses': 1,
+             'evictions': 1})
+
+        cache.configure(1)
+        self.assertEqual(len(cache), 1)
+        self.assertTrue('c' in cache)
+
+        cache.invalidate('c')
+        self.assertEqual(len(cache), 0)
+
+    def test_ttl(self):
+        cache = LRUCache(10, ttl=0.05)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        time.sleep(0.1)
+        self.assertEqual(cache.get('a', 42), 42)
+        self.assertEqual(len(cache), 0)
+
+    def test_invalidate(self):
+        cache = LRUCache(10)
+        for key in range(6):
+            cache.set(key, key)
+        cache.invalidate(predicate=lambda key: key % 2)
+        self.assertEqual(sorted(cache.data.keys()), [0, 2, 4])
+        cache.invalidate()
+        self.assertEqual(len(cache), 0)
+
+    def test_registry(self):
+        cache = get_cache('test', ('', 'root'), 10)
+        self.assertIs(get_cache('test', ('', 'root'), 10), cache)
+        self.assertIsNot(get_cache('test', ('', 'other'), 10), cache)
+        self.assertIs(get_cache('test', ('', 'root'), 20, 60), cache)
+        self.assertEqual(cache.size, 20)
+        self.assertEqual(cache.ttl, 60)
+
+
+class ResultCacheTestCase(unittest.TestCase):
+
+    def test_canonical(self):
+        self.assertEqual(
+            canonical({'fulltext': u'silva', 'meta_type': ['Silva Folder'],
+                       'date': {'query': DateTime(0), 'range': 'min'}}),
+            canonical({'meta_type': ['Silva Folder'], 'fulltext': u'silva',
+                       'date': {'range': 'min', 'query': DateTime(0)}}))
+        self.assertNotEqual(
+            canonical({'fulltext': u'silva'}),
+            canonical({'fulltext': u'zope'}))
+
+    def test_search(self):
+        catalog = Catalog([4, 8, 15, 16, 23, 42])
+        cache = LRUCache(10)
+        options = {'fulltext': u'lost', 'publication_status': ['public']}
+
+        results = search(catalog, options, cache)
+        self.assertEqual([b.getRID() for b in results], catalog.rids)
+        self.assertEqual(catalog.searches, 1)
+
+        results = search(catalog, dict(options), cache)
+        self.assertEqual([b.getRID() for b in results], catalog.rids)
+        self.assertEqual(results.actual_result_count, 6)
+        self.assertEqual(catalog.searches, 1)
+        self.assertEqual(cache.hits, 1)
+
+        # The catalog changed, the result is computed again.
+        catalog.counter += 1
+        catalog.rids = [4, 8]
+        results = search(catalog, options, cache)
+        self.assertEqual([b.getRID() for b in results], [4, 8])
+        self.assertEqual(catalog.searches, 2)
+
+        # No cache, no caching.
+        search(catalog, options)
+        self.assertEqual(catalog.searches, 3)
+
+    def test_scores(self):
+        """Scores of the cached results are set on the brains, the
+        highest one is read without creating any brain.
+        """
+        catalog = Catalog([8, 4, 15], scores=[2.5, 1.0, 0.5])
+        cache = LRUCache(10)
+        results = search(catalog, {'fulltext': u'lost'}, cache)
+        self.assertEqual(highest_score(results), 2.5)
+
+        results = search(catalog, {'fulltext': u'lost'}, cache)
+        self.assertEqual(catalog.searches, 1)
+        self.assertEqual(highest_score(results), 2.5)
+        self.assertEqual(
+            [(b.getRID(), b.data_record_score_) for b in results],
+            [(8, 2.5), (4, 1.0), (15, 0.5)])
+        self.assertEqual(results[1].data_record_normalized_score_, 40)
+
+        self.assertEqual(highest_score(Catalog([4, 8]).searchResults({})),
+                         None)
+
+
+class SingleFlightTestCase(unittest.TestCase):
+
+    def search(self, catalog, flights, options={'fulltext': u'lost'}):
+        results = search(catalog, options, None, flights)
+        return [brain.getRID() for brain in results]
+
+    def test_alone(self):
+        """Values are only shared if someone is waiting for them.
+        """
+        flights = SingleFlight(1)
+
+        def share(value):
+            raise AssertionError(u'Nobody waits for the value')
+
+        self.assertEqual(flights.do('key', lambda: 42, share), (42, False))
+        self.assertEqual(flights.flights, {})
+
+    def test_coalescing(self):
+        catalog = SlowCatalog([4, 8, 15], 0.2)
+        flights = SingleFlight(5)
+        cache = LRUCache(10)
+        results, errors = run_threads(
+            8, lambda: [brain.getRID() for brain in search(
+                    catalog, {'fulltext': u'lost'}, cache, flights)])
+        self.assertEqual(errors, [])
+        self.assertEqual(results, [[4, 8, 15]] * 8)
+        self.assertEqual(catalog.searches, 1)
+        self.assertEqual(
+            flights.statistics(),
+            {'leaders': 1, 'followers': 7, 'timeouts': 0})
+        self.assertEqual(flights.flights, {})
+
+        # The result has been cached as well.
+        results = search(catalog, {'fulltext': u'lost'}, cache, flights)
+        self.assertEqual([brain.getRID() for brain in results], [4, 8, 15])
+        self.assertEqual(catalog.searches, 1)
+
+    def test_different(self):
+        """Different queries, or the same on a different state of the
+        catalog are not coalesced.
+        """
+        catalog = SlowCatalog([4, 8, 15], 0.2)
+        flights = SingleFlight(5)
+        queries = iter([u'lost', u'lost', u'found', u'found'])
+        lock = threading.Lock()
+
+        def target():
+            with lock:
+                query = queries.next()
+            return self.search(catalog, flights, {'fulltext': query})
+
+        results, errors = run_threads(4, target)
+        self.assertEqual(errors, [])
+        self.assertEqual(catalog.searches, 2)
+
+        catalog.counter += 1
+        self.search(catalog, flights)
+        self.assertEqual(catalog.searches, 3)
+
+    def test_timeout(self):
+        """Threads waiting for too long run the search themselves.
+        """
+        catalog = SlowCatalog([4, 8, 15], 0.3)
+        flights = SingleFlight(0.05)
+        results, errors = run_threads(
+            4, lambda: self.search(catalog, flights))
+        self.assertEqual(errors, [])
+        self.assertEqual(results, [[4, 8, 15]] * 4)
+        self.assertEqual(catalog.searches, 4)
+        self.assertEqual(flights.statistics()['timeouts'], 3)
+
+    def test_error(self):
+        """If the first search fails, the others run it themselves.
+        """
+        catalog = SlowCatalog([4, 8, 15], 0.2)
+        catalog.error = ValueError('Parse error')
+        flights = SingleFlight(5)
+        results, errors = run_threads(
+            4, lambda: self.search(catalog, flights))
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), 4)
+        self.assertEqual(catalog.searches, 4)
+        self.assertEqual(flights.flights, {})
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(LRUCacheTestCase))
+    suite.addTest(unittest.makeSuite(ResultCacheTestCase))
+    suite.addTest(unittest.makeSuite(SingleFlightTestCase))
+    return suite
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+import heapq
+import time
+import unittest
+
+from DateTime import DateTime
+from Products.ZCatalog.Lazy import LazyMap
+
+from Products.SilvaFind.cursor import Cursor, decode_cursor, resume
+from Products.SilvaFind.lazy import FilteredResults
+from Products.SilvaFind.tests.fixtures import Catalog, KeyIndex
+
+
+def page_rids(results, size):
+    return [results[index].rid
+            for index in range(min(size, len(results)))]
+
+
+class CursorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Sort keys with ties, and a result missing from the index.
+        self.keys = dict((rid, rid % 4) for rid in range(1, 20))
+        del self.keys[7]
+        self.catalog = Catalog(
+            range(19, 0, -1), {'sort': KeyIndex(self.keys, True)})
+        self.results = self.catalog.searchResults()
+
+    def test_encode(self):
+        cursor = Cursor(3, u'Silva', 42)
+        decoded = decode_cursor(cursor.encode('secret'), 'secret')
+        self.assertEqual(
+            (decoded.page, decoded.key, decoded.rid), (3, u'Silva', 42))
+        self.assertFalse(decoded.first)
+        self.assertTrue(Cursor().first)
+
+        class Key(object):
+            pass
+
+        self.assertEqual(Cursor(1, Key(), 42).encode('secret'), None)
+
+        # Dates are decoded to the microsecond, in any time zone.
+        date = DateTime('2013/05/04 10:11:12.345678 GMT+2')
+        decoded = decode_cursor(
+            Cursor(2, date, 42).encode('secret'), 'secret')
+        self.assertTrue(isinstance(decoded.key, DateTime))
+        self.assertEqual(decoded.key.micros(), date.micros())
+        self.assertEqual(decoded.key, date)
+        self.assertEqual(decode_cursor(None, 'secret'), None)
+        self.assertEqual(decode_cursor(['abc'], 'secret'), None)
+        self.assertEqual(decode_cursor('not a cursor', 'secret'), None)
+        self.assertEqual(decode_cursor(u'\xe9.abc', 'secret'), None)
+        self.assertEqual(decode_cursor('x' * 2000, 'secret'), None)
+        self.assertEqual(decode_cursor(
+                Cursor(0, 'key', 42).encode('secret'), 'secret'), None)
+        self.assertEqual(decode_cursor(
+                Cursor(1, 'key', 'rid').encode('secret'), 'secret'), None)
+
+        # Cursors are only valid with the secret and the scope they
+        # were signed with, and their page can't be changed.
+        encoded = Cursor(3, 'key', 42).encode('secret', 'title')
+        self.assertEqual(
+            decode_cursor(encoded, 'secret', 'title').page, 3)
+        self.assertEqual(decode_cursor(encoded, 'other', 'title'), None)
+        self.assertEqual(decode_cursor(encoded, 'secret', 'date'), None)
+        signature = encoded.split('.')[1]
+        forged = Cursor(1, 'key', 42).encode('secret', 'title')
+        self.assertEqual(decode_cursor(
+                '%s.%s' % (forged.split('.')[0], signature),
+                'secret', 'title'), None)
+
+    def test_resume(self):
+        results = resume(
+            self.catalog, self.results, 'sort', False, Cursor())
+        self.assertEqual(
+            page_rids(results, 6), [4, 8, 12, 16, 1, 5])
+        self.assertEqual(len(results), 18)
+        # The results are read in the order of the index.
+        self.assertEqual(self.catalog._catalog.getIndex('sort').mapped, 0)
+
+        cursor = Cursor().following(self.catalog, 'sort', 1)
+        self.assertEqual((cursor.page, cursor.key, cursor.rid), (1, 1, 1))
+        results = resume(
+            self.catalog, self.results, 'sort', False, cursor, 3)
+        self.assertEqual(page_rids(results, 3), [5, 9, 13])
+        self.assertEqual(results.actual_result_count, 18 - 5)
+
+    def test_resume_descending(self):
+        results = resume(
+            self.catalog, self.results, 'sort', True, Cursor(), 6)
+        self.assertEqual(
+            page_rids(results, 6), [3, 11, 15, 19, 2, 6])
+        cursor = Cursor(1, 3, 15)
+        results = resume(
+            self.catalog, self.results, 'sort', True, cursor)
+        self.assertEqual(page_rids(results, 4), [19, 2, 6, 10])
+
+    def test_sort(self):
+        """Results of an index without a tree, or spread on more keys
+        than there are results, are sorted the same way.
+        """
+        keys = dict((rid, rid % 7) for rid in range(-30, 30))
+        sparse = range(-30, 30, 9)
+        for rids in (range(-30, 30), sparse):
+            sorted_catalog = Catalog(rids, {'sort': KeyIndex(keys)})
+            walked_catalog = Catalog(rids, {'sort': KeyIndex(keys, True)})
+            for reverse in (False, True):
+                for cursor in [Cursor()] + [
+                    Cursor(1, keys[rid], rid) for rid in rids]:
+                    walked = resume(
+                        walked_catalog, walked_catalog.searchResults(),
+                        'sort', reverse, cursor, 4)
+                    expected = resume(
+                        sorted_catalog, sorted_catalog.searchResults(),
+                        'sort', reverse, cursor, 4)
+                    self.assertEqual(list(walked.rids), list(expected.rids))
+                    self.assertEqual(
+                        walked.actual_result_count,
+                        expected.actual_result_count)
+        # Sparse results are sorted instead of walking the index.
+        self.assertNotEqual(walked_catalog._catalog.getIndex('sort').mapped, 0)
+
+    def test_dates(self):
+        """Results sorted on dates are paged with cursors.
+        """
+        keys = dict(
+            (rid, DateTime(1368000000 + rid % 5 * 3600.5, 'GMT+2'))
+            for rid in range(1, 16))
+        catalog = Catalog(range(1, 16), {'sort': KeyIndex(keys, True)})
+        results = catalog.searchResults()
+        for reverse in (False, True):
+            cursor = Cursor()
+            seen = []
+            while True:
+                page = resume(catalog, results, 'sort', reverse, cursor, 4)
+                seen.extend(page.rids[:3])
+                if len(page) < 4:
+                    break
+                following = cursor.following(catalog, 'sort', page.rids[2])
+                cursor = decode_cursor(following.encode('secret'), 'secret')
+            self.assertEqual(
+                seen, sorted(range(1, 16), key=lambda rid: keys[rid],
+                             reverse=reverse))
+            self.assertEqual(sorted(seen), range(1, 16))
+
+    def test_pages(self):
+        """Following the cursors goes through all the results once.
+        """
+        for reverse in (False, True):
+            cursor = Cursor()
+            seen = []
+            while True:
+                results = FilteredResults(resume(
+                        self.catalog, self.results, 'sort', reverse,
+                        cursor, 5))
+                page = page_rids(results, 4)
+                seen.extend(page)
+                if not results.fetch(5):
+                    break
+                cursor = cursor.following(self.catalog, 'sort', page[-1])
+            self.assertEqual(len(seen), 18)
+            self.assertEqual(
+                seen, sorted(seen, key=lambda rid: self.keys[rid],
+                             reverse=reverse))
+            self.assertEqual(cursor.page, 4)
+
+    def test_benchmark(self):
+        """A deep page of 100,000 results only creates the brains it
+        displays, where offset paging creates all the ones before it.
+        """
+        keys = dict((rid, rid % 1000) for rid in range(100000))
+        catalog = Catalog(range(100000), {'sort': KeyIndex(keys, True)})
+        records = catalog._catalog
+        size = 20
+        start = 500 * size
+
+        begin = time.time()
+        ordered = heapq.nsmallest(
+            start + size, keys, key=lambda rid: (keys[rid], rid))
+        results = FilteredResults(
+            LazyMap(records.__getitem__, ordered, len(ordered),
+                    actual_result_count=len(keys)))
+        results.fetch(start + size)
+        offset = [brain.rid for brain in results[start:start + size]]
+        offset_duration = time.time() - begin
+        self.assertEqual(records.created, start + size)
+
+        records.created = 0
+        last = ordered[start - 1]
+        cursor = Cursor(start / size, keys[last], last)
+        begin = time.time()
+        results = FilteredResults(resume(
+                catalog, catalog.searchResults(), 'sort',
+                False, cursor, size + 1))
+        results.fetch(size + 1)
+        keyset = [brain.rid for brain in results[:size]]
+        keyset_duration = time.time() - begin
+        self.assertEqual(keyset, offset)
+        self.assertEqual(records.created, size + 1)
+        self.assertEqual(records.getIndex('sort').mapped, 0)
+        self.assertTrue(
+            keyset_duration < 30,
+            u'Page 501 took %.3fs with a cursor, %.3fs with an offset' % (
+                keyset_duration, offset_duration))
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(CursorTestCase))
+    return suite
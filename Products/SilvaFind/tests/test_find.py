@@ -4,12 +4,23 @@
 
 import unittest
 
+import transaction
 from zope.interface.verify import verifyObject
 from zope.component import getUtility
+from zope.event import notify
+from zope.lifecycleevent import ObjectModifiedEvent
+from ZPublisher.pubevents import PubBeforeCommit
 
+from Products.SilvaFind.catalog import RESULT_COLUMNS
+from Products.SilvaFind.cursor import Cursor, decode_cursor
+from Products.SilvaFind.lazy import FilteredResults
+from Products.SilvaFind.snapshot import take_snapshot
 from Products.SilvaFind.testing import FunctionalLayer
 from Products.SilvaFind import interfaces
-from Products.Silva.testing import assertTriggersEvents
+from Products.SilvaMetadata.interfaces import IMetadataService
+from Products.Silva.testing import assertTriggersEvents, TestRequest
+from silva.core.references.interfaces import IReferenceService
+from silva.core.services.interfaces import ICatalogService
 
 
 class SilvaFindTestCase(unittest.TestCase):
@@ -50,6 +61,280 @@ class SilvaFindTestCase(unittest.TestCase):
         results_schema = service.getResultsSchema()
         self.assertTrue(verifyObject(interfaces.IResultsSchema, results_schema))
 
+    def test_service_schema_cache(self):
+        """Computed schemas are cached until they are invalidated.
+        """
+        service = getUtility(interfaces.IFindService)
+        search_schema = service.getSearchSchema()
+        results_schema = service.getResultsSchema()
+        generation = service.getSchemaGeneration()
+        self.assertIs(service.getSearchSchema(), search_schema)
+        self.assertIs(service.getResultsSchema(), results_schema)
+
+        service.invalidateSchemas()
+        self.assertEqual(service.getSchemaGeneration(), generation + 1)
+        self.assertIsNot(service.getSearchSchema(), search_schema)
+        self.assertIsNot(service.getResultsSchema(), results_schema)
+        self.assertEqual(
+            service.getSearchSchema().getFieldNames(),
+            search_schema.getFieldNames())
+
+    def test_service_schema_element_policy(self):
+        """Editing the policy of a metadata element doesn't send any
+        event, but the computed schemas are rebuilt once the request
+        that edited it is committed.
+        """
+        service = getUtility(interfaces.IFindService)
+        search_schema = service.getSearchSchema()
+        self.assertFalse(search_schema.hasField('silva-extra-subject'))
+        plan = self.root.search.getQueryPlan(TestRequest())
+        generation = service.getSchemaGeneration()
+
+        metadata = getUtility(IMetadataService)
+        element = metadata.getMetadataSet('silva-extra').getElement('subject')
+        request = TestRequest()
+        request['PUBLISHED'] = element.manage_settings
+        notify(PubBeforeCommit(request))
+        self.assertEqual(service.getSchemaGeneration(), generation)
+        self.assertIs(service.getSearchSchema(), search_schema)
+
+        element.editElementPolicy(
+            index_p=True,
+            metadata_in_catalog_p=element.metadata_in_catalog_p,
+            automatic_p=element.automatic_p)
+        request = TestRequest()
+        request['PUBLISHED'] = element.editElementPolicy
+        notify(PubBeforeCommit(request))
+        self.assertEqual(service.getSchemaGeneration(), generation + 1)
+        self.assertIsNot(service.getSearchSchema(), search_schema)
+        self.assertTrue(
+            service.getSearchSchema().hasField('silva-extra-subject'))
+        self.assertIsNot(self.root.search.getQueryPlan(TestRequest()), plan)
+
+
+    def test_query_plan(self):
+        """The query plan is compiled once and reused until the find
+        is modified.
+        """
+        search = self.root.search
+        request = TestRequest(form={'fulltext': 'silva'})
+        plan = search.getQueryPlan(request)
+        self.assertEqual(plan.indexes, ['fulltext', 'path'])
+        self.assertEqual(plan.keys, set(['fulltext']))
+        self.assertEqual(
+            search.getSearchCriterias(request),
+            {'fulltext': u'silva', 'path': ''})
+        self.assertIs(search.getQueryPlan(TestRequest()), plan)
+
+        # Stored values are used if there is nothing in the request.
+        search.setCriterionValue('fulltext', u'zope')
+        self.assertIsNot(search.getQueryPlan(request), plan)
+        self.assertEqual(
+            search.getSearchCriterias(TestRequest()),
+            {'fulltext': u'zope', 'path': ''})
+        self.assertEqual(
+            search.getSearchCriterias(request),
+            {'fulltext': u'silva', 'path': ''})
+
+        # Values changed by another database connection.
+        plan = search.getQueryPlan(request)
+        search.searchValues._p_serial = '\x00' * 7 + '\x01'
+        self.assertIsNot(search.getQueryPlan(request), plan)
+
+        # Changing the settings invalidates the plan.
+        plan = search.getQueryPlan(request)
+        search.shownFields['meta_type'] = True
+        notify(ObjectModifiedEvent(search))
+        self.assertIsNot(search.getQueryPlan(request), plan)
+        self.assertEqual(
+            search.getQueryPlan(request).indexes,
+            ['meta_type', 'fulltext', 'path'])
+
+    def test_query_plan_path(self):
+        """The path criterion follows its target when it is renamed.
+        """
+        search = self.root.search
+        factory = self.root.manage_addProduct['Silva']
+        factory.manage_addFolder('folder', 'Folder')
+        reference = getUtility(IReferenceService).get_reference(
+            search, name='path', add=True)
+        reference.set_target(self.root.folder)
+        search.invalidateQueryPlan()
+        self.assertEqual(
+            search.getSearchCriterias(TestRequest())['path'],
+            '/root/folder')
+
+        transaction.savepoint()
+        self.root.manage_renameObject('folder', 'renamed')
+        self.assertEqual(
+            search.getSearchCriterias(TestRequest())['path'],
+            '/root/renamed')
+
+    def test_sort_criterias(self):
+        search = self.root.search
+        self.assertEqual(search.getSortCriterias(), {})
+        indexes = search.getSortIndexes()
+        self.assertTrue(len(indexes) > 0)
+        self.assertFalse('fulltext' in indexes)
+
+        search.sortOn = indexes[0]
+        search.sortOrder = 'descending'
+        request = TestRequest(form={'sort_on': '', 'sort_order': 'ascending'})
+        self.assertEqual(
+            search.getSortCriterias(request),
+            {'sort_on': indexes[0], 'sort_order': 'descending'})
+
+        # Visitors can change the order if it is allowed, only to a
+        # sortable index.
+        search.sortPublic = True
+        self.assertEqual(search.getSortCriterias(request), {})
+        request = TestRequest(form={'sort_on': 'fulltext'})
+        self.assertEqual(
+            search.getSortCriterias(request),
+            {'sort_on': indexes[0], 'sort_order': 'descending'})
+
+    def test_sort_limit(self):
+        search = self.root.search
+        search.sortOn = search.getSortIndexes()[0]
+        request = TestRequest(form={'fulltext': 'silva'})
+        results = search.searchResults(request, limit=1)
+        self.assertTrue(len(results) <= 1)
+        self.assertEqual(
+            results.actual_result_count,
+            len(search.searchResults(request)))
+
+    def test_cursor(self):
+        """Sorted results can be resumed from a cursor, out of the
+        sort index.
+        """
+        factory = self.root.manage_addProduct['Silva']
+        for index in range(3):
+            factory.manage_addFile('file%d' % index, 'Silva file %d' % index)
+        search = self.root.search
+        search.sortOn = 'id'
+        request = TestRequest(form={'fulltext': 'silva'})
+        first = search.searchResults(request, limit=1, cursor=Cursor())
+        self.assertEqual(len(first), 1)
+        self.assertTrue(first.actual_result_count >= 3)
+        rid = first[0].getRID()
+        cursor = Cursor().following(
+            search.service_catalog, search.sortOn, rid)
+        rest = search.searchResults(request, cursor=cursor)
+        self.assertFalse(rid in [brain.getRID() for brain in rest])
+        self.assertEqual(len(rest), first.actual_result_count - 1)
+
+    def test_cursor_dates(self):
+        """Results sorted on a date index are paged with cursors.
+        """
+        factory = self.root.manage_addProduct['Silva']
+        for index in range(5):
+            factory.manage_addFile('file%d' % index, 'Silva file %d' % index)
+        search = self.root.search
+        search.sortOn = 'silvaextramodificationtime'
+        search.sortOrder = 'descending'
+        request = TestRequest(form={'fulltext': 'silva'})
+        expected = [brain.getRID() for brain in search.searchResults(request)]
+        self.assertTrue(len(expected) >= 5)
+        cursor = Cursor()
+        seen = []
+        while True:
+            results = search.searchResults(request, limit=3, cursor=cursor)
+            rids = [brain.getRID() for brain in results]
+            seen.extend(rids[:2])
+            if len(rids) < 3:
+                break
+            following = cursor.following(
+                search.service_catalog, search.sortOn, rids[1])
+            secret = search.getCursorSecret()
+            cursor = decode_cursor(following.encode(secret), secret)
+            self.assertNotEqual(cursor, None)
+        self.assertEqual(sorted(seen), sorted(expected))
+
+    def test_snapshot(self):
+        """Snapshots of the results are read back out of the catalog,
+        until their content is removed.
+        """
+        factory = self.root.manage_addProduct['Silva']
+        for index in range(5):
+            factory.manage_addFile('file%d' % index, 'Silva file %d' % index)
+        search = self.root.search
+        catalog = search.service_catalog
+        request = TestRequest(form={'fulltext': 'silva'})
+        results = FilteredResults(search.searchResults(request))
+        expected = [brain.getRID() for brain in results]
+        self.assertTrue(len(expected) >= 5)
+        snapshot = take_snapshot(
+            results, ('/root/search', 'author'), 'query', True)
+        self.assertEqual(snapshot.known, len(expected))
+        self.assertEqual(
+            [brain.getRID() for brain in snapshot.results(catalog)],
+            expected)
+        self.assertTrue(snapshot.exists(catalog, 0, len(expected)))
+
+        position = expected.index(catalog.getrid('/root/file2'))
+        self.root.manage_delObjects(['file2'])
+        self.assertFalse(snapshot.exists(catalog, position, position + 1))
+        self.assertTrue(snapshot.exists(catalog, 0, position))
+
+    def test_cache_validators(self):
+        """Responses can be cached for anonymous visitors, if it is
+        enabled on the Find. The validator changes with the criterias
+        and the catalog.
+        """
+        search = self.root.search
+        request = TestRequest(
+            form={'fulltext': 'silva', 'search_submit': 'Search'})
+        self.assertEqual(search.getCacheValidators(request), None)
+        search.publicCaching = True
+        self.assertEqual(search.getCacheValidators(request), None)
+
+        self.layer.logout()
+        self.assertTrue(search.isCachable())
+        etag, last_modified = search.getCacheValidators(request)
+        self.assertEqual(
+            search.getCacheValidators(request), (etag, last_modified))
+        self.assertNotEqual(
+            search.getCacheValidators(request, 'sitemap.xml')[0], etag)
+        other = TestRequest(
+            form={'fulltext': 'zope', 'search_submit': 'Search'})
+        self.assertNotEqual(search.getCacheValidators(other)[0], etag)
+
+        self.layer.login('author')
+        factory = self.root.manage_addProduct['Silva']
+        factory.manage_addFolder('folder', 'Folder')
+        self.layer.logout()
+        self.assertNotEqual(search.getCacheValidators(request)[0], etag)
+
+    def test_result_columns(self):
+        """The installer adds the catalog columns used to render
+        results without waking them up.
+        """
+        catalog = getUtility(ICatalogService)
+        for name in RESULT_COLUMNS:
+            self.assertTrue(name in catalog.schema())
+        brains = catalog(path='/root/search')
+        self.assertEqual(len(brains), 1)
+        self.assertEqual(brains[0].silvafind_content_path, '/root/search')
+        self.assertEqual(brains[0].silvafind_content_type, 'Silva Find')
+
+    def test_fragments(self):
+        """Result fields rendered for a content are discarded when the
+        content is modified.
+        """
+        service = getUtility(interfaces.IFindService)
+        cache = service.getFragmentCache()
+        catalog = getUtility(ICatalogService)
+        rid = catalog.getrid('/root/search')
+        self.assertNotEqual(rid, None)
+        cache.set((rid, 'link', None, None, None), (u'search',))
+        cache.set((rid + 1, 'link', None, None, None), (u'other',))
+
+        notify(ObjectModifiedEvent(self.root.search))
+        self.assertEqual(
+            cache.get((rid, 'link', None, None, None)), None)
+        self.assertEqual(
+            cache.get((rid + 1, 'link', None, None, None)), (u'other',))
+
 
 def test_suite():
     suite = unittest.TestSuite()
@@ -22,6 +22,18 @@ def search_settings(browser):
         type='link')
 
 
+def paging_settings(browser):
+    search_settings(browser)
+    browser.inspect.add(
+        'search_batch',
+        '//div[@class="batchNav"]/a',
+        type='link')
+    browser.inspect.add(
+        'search_cursor',
+        '//p[@class="searchresult-cursor"]/a',
+        type='link')
+
+
 TEST_FIXTURE = {
     'the_great_figure': {
         'id': 'the_great_figure.pdf',
@@ -184,6 +196,31 @@ class SearchTestCase(unittest.TestCase):
                 ['You need to fill at least one field in the search form.'])
             self.assertEqual(browser.inspect.search_results, [])
 
+    def test_not_modified(self):
+        """Conditional requests of an unchanged search page get a 304
+        with an empty body, without the layout.
+        """
+        self.root.search.publicCaching = True
+        with self.layer.get_browser() as browser:
+            self.assertEqual(browser.open('/root/search'), 200)
+            etag = browser.headers['ETag']
+            browser.set_request_header('If-None-Match', etag)
+            self.assertEqual(browser.open('/root/search'), 304)
+            self.assertEqual(len(browser.contents), 0)
+
+    def test_sitemap_headers(self):
+        """The sitemap is streamed with the cache headers of the
+        search.
+        """
+        self.root.search.publicCaching = True
+        with self.layer.get_browser() as browser:
+            self.assertEqual(browser.open('/root/search/sitemap.xml'), 200)
+            self.assertEqual(
+                browser.headers['Cache-Control'],
+                'max-age=0, must-revalidate')
+            self.assertIn('ETag', browser.headers)
+            self.assertIn('Last-Modified', browser.headers)
+
     def test_no_result(self):
         """Try to make a search which match no results at all.
         """
@@ -286,6 +323,103 @@ class SearchTestCase(unittest.TestCase):
                 'http://localhost/root/the_second_coming.txt')
 
 
+class PagingTestCase(unittest.TestCase):
+    """Test the pages of the results of a SilvaFind, with offsets,
+    snapshots and cursors.
+    """
+    layer = FunctionalLayer
+
+    def setUp(self):
+        self.root = self.layer.get_application()
+        self.layer.login('manager')
+        factory = self.root.manage_addProduct['SilvaFind']
+        factory.manage_addSilvaFind('search', 'Search Test')
+        factory = self.root.manage_addProduct['Silva']
+        self.titles = []
+        for index in range(1, 26):
+            title = 'Paging file %02d' % index
+            factory.manage_addFile('file%02d' % index, title)
+            self.titles.append(title)
+
+    def search(self, browser):
+        self.assertEqual(browser.open('/root/search'), 200)
+        form = browser.get_form('search_form')
+        form.get_control('fulltext').value = 'paging'
+        self.assertEqual(form.inspect.actions['Search'].click(), 200)
+
+    def test_offset_pages(self):
+        """The second page is read out of the snapshot taken for the
+        first one, or searched again without it.
+        """
+        with self.layer.get_browser(paging_settings) as browser:
+            self.search(browser)
+            first = list(browser.inspect.search_results)
+            self.assertEqual(len(first), 20)
+            self.assertEqual(browser.inspect.search_cursor, [])
+            self.assertIn('2', browser.inspect.search_batch)
+
+            link = browser.inspect.search_batch['2']
+            self.assertIn('snapshot=', link.url)
+            self.assertEqual(link.click(), 200)
+            second = list(browser.inspect.search_results)
+            self.assertEqual(len(second), 5)
+            self.assertEqual(sorted(first + second), self.titles)
+
+            self.assertEqual(
+                browser.open('/root/search?fulltext=paging&'
+                             'search_submit=Search&bstart=20'),
+                200)
+            self.assertEqual(
+                sorted(browser.inspect.search_results), sorted(second))
+
+    def test_cursor_pages(self):
+        """Sorted results are paged with next and first page links.
+        """
+        self.root.search.sortOn = 'id'
+        self.root.search.cursorPaging = True
+        with self.layer.get_browser(paging_settings) as browser:
+            self.search(browser)
+            self.assertEqual(browser.inspect.search_results, self.titles[:20])
+            self.assertEqual(browser.inspect.search_batch, [])
+            self.assertEqual(browser.inspect.search_cursor, ['Next page'])
+
+            self.assertEqual(
+                browser.inspect.search_cursor['Next page'].click(), 200)
+            self.assertEqual(browser.inspect.search_results, self.titles[20:])
+            self.assertEqual(browser.inspect.search_cursor, ['First page'])
+
+            self.assertEqual(
+                browser.inspect.search_cursor['First page'].click(), 200)
+            self.assertEqual(browser.inspect.search_results, self.titles[:20])
+
+            # A cursor that was not signed shows the first page.
+            self.assertEqual(
+                browser.open('/root/search?fulltext=paging&'
+                             'search_submit=Search&cursor=forged.cursor'),
+                200)
+            self.assertEqual(browser.inspect.search_results, self.titles[:20])
+
+    def test_page_depth(self):
+        """Pages past the maximum depth are not displayed.
+        """
+        self.root.search.maxPageDepth = 1
+        with self.layer.get_browser(paging_settings) as browser:
+            self.assertEqual(
+                browser.open('/root/search?fulltext=paging&'
+                             'search_submit=Search&bstart=20'),
+                200)
+            self.assertEqual(browser.inspect.search_results, [])
+            self.assertEqual(
+                browser.inspect.search_feedback,
+                ['Only the first 1 pages of results can be displayed.'])
+
+            self.root.search.sortOn = 'id'
+            self.root.search.cursorPaging = True
+            self.search(browser)
+            self.assertEqual(browser.inspect.search_results, self.titles[:20])
+            self.assertEqual(browser.inspect.search_cursor, [])
+
+
 def test_suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(AuthorContentTestCase))
@@ -293,4 +427,5 @@ def test_suite():
     suite.addTest(unittest.makeSuite(ChiefEditorContentTestCase))
     suite.addTest(unittest.makeSuite(ManagerContentTestCase))
     suite.addTest(unittest.makeSuite(SearchTestCase))
+    suite.addTest(unittest.makeSuite(PagingTestCase))
     return suite
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+import unittest
+
+from zope.interface.verify import verifyObject
+from zope.publisher.browser import TestRequest
+
+from Products.SilvaFind.interfaces import IResultItem
+from Products.SilvaFind.lazy import FilteredResults
+from Products.SilvaFind.results.item import ResultItem, ResultItemFactory
+from Products.SilvaFind.results.widgets import ICONS, MetatypeResultView
+
+
+class Content(object):
+
+    def __init__(self, rid):
+        self.rid = rid
+
+    def get_title_or_id(self):
+        return u'Content %d' % self.rid
+
+    def getPhysicalPath(self):
+        return ('', 'root', 'content%d' % self.rid)
+
+
+class Brain(object):
+    """Brain stand-in that counts the objects woken up.
+    """
+    woken = 0
+
+    def __init__(self, rid):
+        self.rid = rid
+        self.meta_type = 'Silva Document'
+        self.get_title_or_id = u'Brain %d' % rid
+        self.silvafind_content_type = 'Silva Document'
+        self.silvafind_content_path = None
+        self.silvafind_thumbnail_path = None
+
+    def getRID(self):
+        return self.rid
+
+    def getObject(self):
+        Brain.woken += 1
+        return Content(self.rid)
+
+
+class ResultItemTestCase(unittest.TestCase):
+
+    def setUp(self):
+        Brain.woken = 0
+
+    def test_item(self):
+        item = ResultItem(Brain(42), TestRequest())
+        self.assertTrue(verifyObject(IResultItem, item))
+        self.assertEqual(item.getRID(), 42)
+        self.assertEqual(item.meta_type, 'Silva Document')
+        self.assertEqual(item.getScore(), None)
+        self.assertEqual(Brain.woken, 0)
+
+        self.assertIs(item.getObject(), item.getObject())
+        self.assertIs(item.getSilvaObject(), item.getObject())
+        self.assertEqual(item.getTitle(), u'Content 42')
+        self.assertEqual(item.getTitle(), u'Content 42')
+        self.assertEqual(Brain.woken, 1)
+        self.assertEqual(
+            item.computed, {'object': 1, 'silva_object': 1, 'title': 1})
+
+    def test_one_wake_per_hit(self):
+        """The object is woken up once to check the permission, and
+        then reused to render all the fields.
+        """
+        factory = ResultItemFactory(TestRequest())
+        results = FilteredResults(
+            [Brain(rid) for rid in range(100)],
+            lambda item: item.getObject().rid % 2,
+            factory=factory)
+        page = results[0:20]
+        for item in page:
+            for field in range(8):
+                item.getObject()
+                item.getTitle()
+        self.assertEqual(page[0].getRID(), 1)
+        self.assertEqual(Brain.woken, 40)
+        self.assertEqual(factory.computed, {'object': 40, 'title': 20})
+
+    def test_columns(self):
+        """Values are read from the catalog columns if they are
+        available, and from the object otherwise.
+        """
+        columns = frozenset(
+            ['get_title_or_id', 'silvafind_content_type',
+             'silvafind_content_path'])
+        item = ResultItem(Brain(42), TestRequest(), columns=columns)
+        self.assertEqual(item.getTitle(), u'Brain 42')
+        self.assertEqual(item.getContentType(), 'Silva Document')
+        self.assertEqual(Brain.woken, 0)
+        self.assertEqual(item.computed, {'title': 1, 'meta_type': 1})
+
+        # The brain was cataloged before the column was added.
+        self.assertEqual(item.getContentPath(), '/root/content42')
+        self.assertEqual(Brain.woken, 1)
+
+    def test_thumbnail(self):
+        """The URL of thumbnails is computed out of the catalog
+        column, without waking up the images.
+        """
+        request = TestRequest()
+        request.physicalPathToURL = lambda path: 'http://localhost' + path
+        columns = frozenset(['silvafind_thumbnail_path'])
+        brain = Brain(42)
+        brain.silvafind_thumbnail_path = '/root/image42/thumbnail_image'
+        item = ResultItem(brain, request, columns=columns)
+        self.assertEqual(
+            item.getThumbnailURL(),
+            'http://localhost/root/image42/thumbnail_image')
+        item = ResultItem(Brain(51), request, columns=columns)
+        self.assertEqual(item.getThumbnailURL(), None)
+        self.assertEqual(Brain.woken, 0)
+
+
+class Icons(object):
+    """Icon resolver stand-in that counts the tags generated.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def get_tag(self, content=None, identifier=None):
+        self.calls += 1
+        if content is not None:
+            return '<img src="file-%d.png" />' % content.rid
+        return '<img src="%s.png" />' % identifier
+
+
+class MetatypeResultViewTestCase(unittest.TestCase):
+
+    def setUp(self):
+        Brain.woken = 0
+        ICONS.invalidate()
+
+    def test_icons(self):
+        """Icons are rendered out of the catalog, and computed once
+        per content type, except for files.
+        """
+        request = TestRequest()
+        icons = Icons()
+        view = MetatypeResultView(None, None, request)
+        view.get_icon = icons.get_tag
+        view.base = 'http://localhost/root'
+        view.without_object = 0
+        factory = ResultItemFactory(
+            request, frozenset(['silvafind_content_type']))
+        brains = [Brain(rid) for rid in range(10)]
+        brains[3].silvafind_content_type = 'Silva File'
+        for brain in brains:
+            view.render(factory(brain))
+
+        self.assertEqual(icons.calls, 2)
+        self.assertEqual(Brain.woken, 1)
+        self.assertEqual(view.without_object, 9)
+        self.assertEqual(
+            view.render(factory(brains[3])), '<img src="file-3.png" />')
+
+    def test_ghost_icons(self):
+        """The icon of ghosts and ghost folders depends on their
+        target: it is computed for each of them.
+        """
+        request = TestRequest()
+        icons = Icons()
+        view = MetatypeResultView(None, None, request)
+        view.get_icon = icons.get_tag
+        view.base = 'http://localhost/root'
+        view.without_object = 0
+        factory = ResultItemFactory(
+            request, frozenset(['silvafind_content_type']))
+        brains = [Brain(rid) for rid in range(4)]
+        brains[0].silvafind_content_type = 'Silva Ghost'
+        brains[1].silvafind_content_type = 'Silva Ghost'
+        brains[2].silvafind_content_type = 'Silva Ghost Folder'
+        for brain in brains:
+            view.render(factory(brain))
+
+        self.assertEqual(icons.calls, 4)
+        self.assertEqual(Brain.woken, 3)
+        self.assertEqual(view.without_object, 1)
+        self.assertEqual(
+            view.render(factory(brains[2])), '<img src="file-2.png" />')
+
+    def test_cache_key(self):
+        """Icons that depend on the content are not cached with the
+        other result fields.
+        """
+        request = TestRequest()
+        view = MetatypeResultView(None, None, request)
+        factory = ResultItemFactory(
+            request, frozenset(['silvafind_content_type']))
+        brains = [Brain(rid) for rid in range(4)]
+        brains[1].silvafind_content_type = 'Silva File'
+        brains[2].silvafind_content_type = 'Silva Ghost'
+        brains[3].silvafind_content_type = 'Silva Ghost Folder'
+        self.assertEqual(
+            [view.getCacheKey(factory(brain)) for brain in brains],
+            [(), None, None, None])
+        self.assertEqual(Brain.woken, 0)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(ResultItemTestCase))
+    suite.addTest(unittest.makeSuite(MetatypeResultViewTestCase))
+    return suite
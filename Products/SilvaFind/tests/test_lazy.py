@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+import unittest
+
+from Products.ZCatalog.Lazy import LazyMap
+from zeam.utils.batch import Batch
+
+from Products.SilvaFind.lazy import Counted, FilteredResults
+from Products.SilvaFind.tests.fixtures import Brain
+
+
+def viewable(brain):
+    # Every third result is not viewable.
+    return brain.getObject() % 3 != 2
+
+
+class FilteredResultsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        Brain.woken = 0
+        self.brains = [Brain(rid) for rid in range(30000)]
+
+    def test_lazy(self):
+        results = FilteredResults(self.brains, viewable)
+        self.assertEqual(len(results), 30000)
+        self.assertFalse(results.exact)
+        self.assertEqual(Brain.woken, 0)
+
+        self.assertEqual(results[0].rid, 0)
+        self.assertEqual(results[2].rid, 3)
+        self.assertEqual(Brain.woken, 4)
+        self.assertEqual(
+            [brain.rid for brain in results[2:6]],
+            [3, 4, 6, 7])
+        self.assertEqual(Brain.woken, 8)
+        self.assertEqual(results.checked, 8)
+
+        # Length is an upper bound until everything is checked.
+        self.assertEqual(len(results), 30000 - 2)
+        self.assertEqual(results[-1].rid, 29998)
+        self.assertTrue(results.exact)
+        self.assertEqual(len(results), 20000)
+        self.assertEqual(Brain.woken, 30000)
+        self.assertRaises(IndexError, results.__getitem__, 20000)
+
+    def test_no_check(self):
+        results = FilteredResults(self.brains)
+        self.assertEqual(results[29999].rid, 29999)
+        self.assertEqual(len(results), 30000)
+        self.assertEqual(Brain.woken, 0)
+
+    def test_count(self):
+        results = FilteredResults(self.brains, viewable)
+        self.assertEqual(results.count(minimum=100), (100, False))
+        self.assertEqual(Brain.woken, 149)
+        self.assertEqual(results.count(), (20000, True))
+        self.assertEqual(results.count(minimum=100), (20000, True))
+
+        # Without check, the count is the length of the catalog result.
+        results = FilteredResults(self.brains)
+        self.assertEqual(results.count(minimum=100), (30000, True))
+
+    def test_empty(self):
+        results = FilteredResults(self.brains[2:3], viewable)
+        self.assertFalse(results)
+        self.assertEqual(len(results), 0)
+        self.assertEqual(list(results), [])
+
+    def test_batch(self):
+        """Only the results up to the displayed page are checked.
+        """
+        results = FilteredResults(self.brains, viewable)
+        page = Batch(results, start=100, count=20)
+        self.assertEqual(len(page), 20)
+        self.assertEqual(
+            [brain.rid for brain in page][:4],
+            [150, 151, 153, 154])
+        self.assertTrue(Brain.woken <= 180)
+
+    def test_counted(self):
+        """Batches of counted results only have the pages of the
+        accepted results, not of the unfiltered ones.
+        """
+        results = FilteredResults(
+            self.brains[:100], lambda brain: brain.getObject() < 10)
+        count, exact = results.count(21)
+        self.assertEqual((count, exact), (10, True))
+        page = Batch(Counted(results, count), start=0, count=10)
+        self.assertEqual(page.batch_length(), 1)
+        self.assertEqual(page.next, None)
+        self.assertEqual([brain.rid for brain in page], range(10))
+
+        # The count is a lower bound that covers the next page.
+        results = FilteredResults(self.brains, viewable)
+        count, exact = results.count(100 + 20 + 1)
+        self.assertEqual((count, exact), (121, False))
+        page = Batch(Counted(results, count), start=100, count=20)
+        self.assertEqual(page.next, 120)
+        self.assertEqual(len(page), 20)
+        self.assertEqual(len(list(page)), 20)
+
+        # Everything is filtered out.
+        results = FilteredResults(self.brains[2:30:3], viewable)
+        self.assertFalse(results.fetch(1))
+        page = Batch(Counted(results, results.count()[0]), count=10)
+        self.assertFalse(page)
+        self.assertEqual(list(page), [])
+
+    def test_more(self):
+        """Limited results are completed only if the page needs more
+        of them.
+        """
+        fetched = []
+
+        def more():
+            fetched.append(True)
+            return self.brains
+
+        limited = LazyMap(lambda brain: brain, self.brains[:30], 30,
+                          actual_result_count=30000)
+        results = FilteredResults(limited, viewable, more)
+        self.assertEqual(len(results), 30000)
+        self.assertEqual(len(results[:20]), 20)
+        self.assertEqual(fetched, [])
+
+        self.assertEqual([brain.rid for brain in results[20:22]], [30, 31])
+        self.assertEqual(fetched, [True])
+        self.assertEqual(results.count(), (20000, True))
+
+    def test_known(self):
+        """Results known to be accepted are not checked again, and
+        only the ones accessed are used.
+        """
+        used = []
+
+        def factory(brain):
+            used.append(brain.rid)
+            return brain
+
+        results = FilteredResults(self.brains, viewable, None, factory, 100)
+        self.assertEqual(results.known, 100)
+        self.assertEqual(results.checked, 100)
+        self.assertEqual(len(results), 30000)
+        self.assertEqual([brain.rid for brain in results[40:42]], [40, 41])
+        self.assertEqual(used, [40, 41])
+        self.assertEqual(Brain.woken, 0)
+
+        self.assertEqual([brain.rid for brain in results[99:102]],
+                         [99, 100, 102])
+        self.assertEqual(Brain.woken, 3)
+        self.assertEqual(results.count(), (100 + 19933, True))
+        self.assertEqual(results[-1].rid, 29998)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(FilteredResultsTestCase))
+    return suite
@@ -2,13 +2,32 @@
 # Copyright (c) 2006-2013 Infrae. All rights reserved.
 # See also LICENSE.txt
 
+import cPickle
+import types
 import unittest
 
 from zope.interface.verify import verifyObject
 
-from Products.SilvaFind.schema import Schema
+from Products.SilvaFind.schema import PARTITIONS, Schema, SearchSchema
 from Products.SilvaFind.schema import MetadataCriterionField
+from Products.SilvaFind.schema import FullTextCriterionField
 from Products.SilvaFind.interfaces import ISchema
+from Products.SilvaFind.interfaces import IMetadataCriterionField
+from Products.SilvaFind.interfaces import IFullTextCriterionField
+from Products.SilvaFind.interfaces import IPathCriterionField
+
+
+class CountingField(object):
+    """Field that counts how many times its name is asked.
+    """
+    calls = 0
+
+    def __init__(self, name):
+        self.name = name
+
+    def getName(self):
+        CountingField.calls += 1
+        return self.name
 
 
 class SchemaTestCase(unittest.TestCase):
@@ -26,6 +45,10 @@ class SchemaTestCase(unittest.TestCase):
         self.assertEqual(
             self.schema.getFields(),
             [self.field1, self.field2])
+        self.assertEqual(
+            list(self.schema),
+            [self.field1, self.field2])
+        self.assertEqual(len(self.schema), 2)
 
         self.assertEqual(
             self.schema.getFieldNames(),
@@ -45,6 +68,75 @@ class SchemaTestCase(unittest.TestCase):
             self.field1)
 
         self.assertRaises(KeyError, self.schema.getField, 'carambar')
+        self.assertEqual(self.schema.getField('carambar', None), None)
+
+    def test_immutable(self):
+        """A schema cannot be modified.
+        """
+        self.assertRaises(
+            AttributeError, setattr, self.schema, 'fields', [])
+        self.assertRaises(
+            AttributeError, delattr, self.schema, 'fields')
+        self.schema.getFields().append(self.field1)
+        self.assertEqual(
+            self.schema.getFields(),
+            [self.field1, self.field2])
+
+    def test_partitions(self):
+        """Fields can be retrieved by interface.
+        """
+        fulltext = FullTextCriterionField()
+        schema = Schema([self.field1, fulltext, self.field2])
+        self.assertEqual(
+            schema.getFieldsProvidedBy(IMetadataCriterionField),
+            (self.field1, self.field2))
+        self.assertEqual(
+            schema.getFieldsProvidedBy(IFullTextCriterionField),
+            (fulltext,))
+        self.assertEqual(
+            schema.getFieldsProvidedBy(IPathCriterionField),
+            ())
+        self.assertEqual(
+            schema.getFieldsProvidedBy(ISchema),
+            ())
+        self.assertEqual(sorted(schema._partitions), sorted(PARTITIONS))
+
+    def test_pickle(self):
+        """Schemas are pickled as a list of fields, like the previous
+        list based implementation.
+        """
+        data = cPickle.dumps(self.schema)
+        schema = cPickle.loads(data)
+        self.assertEqual(schema.getFieldNames(), self.schema.getFieldNames())
+        self.assertTrue(schema.hasField('meta-set-field-id2'))
+        self.assertEqual(
+            self.schema.__getstate__(),
+            {'fields': [self.field1, self.field2]})
+
+        # Schema stored with the previous implementation only have
+        # a list of fields in their dictionary.
+        legacy = types.InstanceType(
+            SearchSchema, {'fields': [self.field1, self.field2]})
+        schema = cPickle.loads(cPickle.dumps(legacy))
+        self.assertTrue(isinstance(schema, SearchSchema))
+        self.assertTrue(schema.hasField('meta-set-field-id1'))
+        self.assertEqual(
+            schema.getField('meta-set-field-id2').getElementName(),
+            'field-id2')
+
+    def test_lookup_scale(self):
+        """Lookups don't depend on the number of fields: they never go
+        through the fields of the schema.
+        """
+        large = Schema(
+            [CountingField('field%d' % i) for i in range(5000)])
+        CountingField.calls = 0
+        self.assertTrue(large.hasField('field4999'))
+        self.assertEqual(large.getField('field4999').name, 'field4999')
+        self.assertFalse('field5000' in large)
+        for i in range(5000):
+            self.assertEqual(large['field%d' % i].name, 'field%d' % i)
+        self.assertEqual(CountingField.calls, 0)
 
 
 class MetadataCriterionFieldTestCase(unittest.TestCase):
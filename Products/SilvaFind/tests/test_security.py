@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+import unittest
+
+from zope.component import getUtility
+from zope.event import notify
+
+from Products.SilvaFind.catalog import ALLOWED_INDEX
+from Products.SilvaFind.catalog import allowed_roles_and_users, allowed_tokens
+from Products.SilvaFind.findservice import FindServiceSettings
+from Products.SilvaFind.interfaces import IFindService
+from Products.SilvaFind.testing import FunctionalLayer
+from silva.core.interfaces.events import SecurityRoleAddedEvent
+from silva.core.services.interfaces import ICatalogService
+
+
+class User(object):
+
+    def __init__(self, userid, roles, groups=()):
+        self.userid = userid
+        self.roles = roles
+        self.groups = groups
+
+    def getId(self):
+        return self.userid
+
+    def getRoles(self):
+        return self.roles
+
+    def getGroups(self):
+        return self.groups
+
+
+class SecurityIndexTestCase(unittest.TestCase):
+    layer = FunctionalLayer
+
+    def setUp(self):
+        self.root = self.layer.get_application()
+        self.layer.login('manager')
+        factory = self.root.manage_addProduct['Silva']
+        factory.manage_addFolder('folder', 'Folder')
+        factory = self.root.folder.manage_addProduct['Silva']
+        factory.manage_addMockupVersionedContent('info', 'Information')
+
+    def test_installed(self):
+        catalog = getUtility(ICatalogService)
+        self.assertTrue(ALLOWED_INDEX in catalog.indexes())
+        self.assertFalse(getUtility(IFindService).useCatalogSecurity())
+
+    def test_allowed_roles_and_users(self):
+        self.assertTrue(
+            'Anonymous' in allowed_roles_and_users(self.root.folder.info))
+        self.root.folder.manage_setLocalRoles('dummy', ['Editor'])
+        allowed = allowed_roles_and_users(self.root.folder.info)
+        self.assertTrue('user:dummy' in allowed)
+        self.assertFalse('Owner' in allowed)
+
+        # The value is acquired from the root by the catalog.
+        self.assertEqual(
+            getattr(self.root.folder.info, ALLOWED_INDEX)(),
+            allowed)
+
+    def test_allowed_tokens(self):
+        self.assertEqual(
+            allowed_tokens(User('editor', ['Authenticated'], ['staff'])),
+            ['Anonymous', 'Authenticated', 'user:editor', 'user:staff'])
+
+    def test_missing_index(self):
+        """The security index is not used if it is missing from the
+        catalog, even if it was rebuilt before.
+        """
+        service = getUtility(IFindService)
+        catalog = getUtility(ICatalogService)
+        service.rebuildSecurityIndex()
+        catalog.delIndex(ALLOWED_INDEX)
+        self.assertTrue(service.catalog_security)
+        self.assertFalse(service.useCatalogSecurity())
+
+    def test_settings(self):
+        """The security index can't be enabled from the settings.
+        """
+        self.assertFalse(
+            'catalog_security' in FindServiceSettings.fields.keys())
+
+    def test_security_generation(self):
+        """Roles changes are seen by all processes, so they don't use
+        the result snapshots filtered with the previous roles.
+        """
+        service = getUtility(IFindService)
+        generation = service.getSecurityGeneration()
+        notify(SecurityRoleAddedEvent(
+                self.root.folder, 'dummy', ['Editor']))
+        self.assertEqual(service.getSecurityGeneration(), generation + 1)
+
+    def test_rebuild(self):
+        service = getUtility(IFindService)
+        catalog = getUtility(ICatalogService)
+        service.rebuildSecurityIndex()
+        self.assertTrue(service.useCatalogSecurity())
+        self.assertTrue(
+            len(catalog(path='/root/folder',
+                        allowedRolesAndUsers=['Anonymous'])) > 0)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(SecurityIndexTestCase))
+    return suite
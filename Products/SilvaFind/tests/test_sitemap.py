@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+import gzip
+import time
+import unittest
+from cStringIO import StringIO
+from xml.dom.minidom import parseString
+
+from DateTime import DateTime
+from Products.ZCatalog.Lazy import LazyMap
+
+from Products.SilvaFind.catalog import iter_brains
+from Products.SilvaFind.sitemap import SHARD_SIZE, compress, shard_count
+from Products.SilvaFind.sitemap import shard_brains, shard_plan
+from Products.SilvaFind.sitemap import sitemap_chunks
+
+
+class Request(object):
+
+    def physicalPathToURL(self, path):
+        return 'http://localhost' + path
+
+
+class Brain(object):
+    """Brain stand-in that counts the number of brains alive.
+    """
+    alive = 0
+    maximum = 0
+
+    def __init__(self, rid):
+        self.values = {
+            'silvafind_content_path': '/root/content%d' % rid,
+            'silva-extramodificationtime': DateTime(2013, 1, 1)}
+        self.rid = rid
+        Brain.alive += 1
+        Brain.maximum = max(Brain.maximum, Brain.alive)
+
+    def __del__(self):
+        Brain.alive -= 1
+
+    def __contains__(self, key):
+        return key in self.values
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def getPath(self):
+        return '/root/brain%d' % self.rid
+
+    def getRID(self):
+        return self.rid
+
+
+class SitemapTestCase(unittest.TestCase):
+
+    def setUp(self):
+        Brain.alive = Brain.maximum = 0
+
+    def test_sitemap(self):
+        brains = [Brain(1), Brain(2)]
+        brains[1].values = {}
+        sitemap = ''.join(sitemap_chunks(brains, Request()))
+        urls = parseString(sitemap).getElementsByTagName('url')
+        self.assertEqual(len(urls), 2)
+        self.assertEqual(
+            urls[0].getElementsByTagName('loc')[0].firstChild.data,
+            'http://localhost/root/content1')
+        self.assertEqual(
+            urls[1].getElementsByTagName('loc')[0].firstChild.data,
+            'http://localhost/root/brain2')
+        self.assertEqual(
+            urls[0].getElementsByTagName('lastmod')[0].firstChild.data,
+            DateTime(2013, 1, 1).HTML4())
+        self.assertEqual(urls[1].getElementsByTagName('lastmod'), [])
+
+    def test_iter_brains(self):
+        results = LazyMap(Brain, range(10))
+        self.assertEqual(
+            [brain.rid for brain in iter_brains(results)], range(10))
+        self.assertEqual(results._data, [])
+
+    def test_shards(self):
+        """A change of an entry only changes the signature of its
+        shard.
+        """
+        self.assertEqual(shard_count(0), 1)
+        self.assertEqual(shard_count(SHARD_SIZE), 1)
+        self.assertEqual(shard_count(SHARD_SIZE + 1), 2)
+
+        brains = [Brain(rid) for rid in range(12)]
+        plan = shard_plan(brains, 3)
+        self.assertEqual(len(plan), 3)
+        self.assertEqual(plan[0][1], DateTime(2013, 1, 1).HTML4())
+        self.assertEqual(list(plan[1][2]), [1, 4, 7, 10])
+        brains[4].values['silva-extramodificationtime'] = DateTime(2013, 2, 1)
+        changed = shard_plan(brains, 3)
+        self.assertEqual(changed[0], plan[0])
+        self.assertNotEqual(changed[1][0], plan[1][0])
+        self.assertEqual(changed[1][1], DateTime(2013, 2, 1).HTML4())
+        self.assertEqual(changed[2], plan[2])
+
+    def test_shard_brains(self):
+        """Only the brains of the shard are created, and the ones
+        removed from the catalog since the plan are skipped.
+        """
+        class Records(dict):
+            created = 0
+
+            def __getitem__(self, rid):
+                Records.created += 1
+                return dict.__getitem__(self, rid)
+
+        class Catalog(object):
+            _catalog = Records((rid, rid) for rid in range(100) if rid != 7)
+
+        brains = shard_brains(Catalog(), [1, 4, 7, 10])
+        self.assertEqual(list(brains), [1, 4, 10])
+        self.assertEqual(Records.created, 4)
+
+    def test_compress(self):
+        brains = [Brain(rid) for rid in range(10)]
+        sitemap = ''.join(sitemap_chunks(brains, Request()))
+        data = compress(sitemap_chunks(brains, Request()))
+        self.assertEqual(
+            gzip.GzipFile(fileobj=StringIO(data)).read(), sitemap)
+        self.assertEqual(data, compress(sitemap_chunks(brains, Request())))
+
+    def test_benchmark(self):
+        """The sitemap of 100,000 results is written in chunks, with
+        only a few brains in memory at once.
+        """
+        results = LazyMap(Brain, xrange(100000), 100000)
+        start = time.time()
+        count = 0
+        largest = 0
+        for chunk in sitemap_chunks(iter_brains(results), Request()):
+            count += chunk.count('<url>')
+            largest = max(largest, len(chunk))
+        duration = time.time() - start
+        self.assertEqual(count, 100000)
+        self.assertTrue(largest < 65536 * 2)
+        self.assertTrue(
+            Brain.maximum < 10,
+            u'%d brains were kept in memory' % Brain.maximum)
+        self.assertTrue(
+            duration < 30, u'Sitemap took %.2fs' % duration)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(SitemapTestCase))
+    return suite
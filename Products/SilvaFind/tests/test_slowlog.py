@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+import unittest
+
+from Products.SilvaFind.slowlog import SlowQueryLog, fingerprint, percentile
+
+
+class SlowQueryLogTestCase(unittest.TestCase):
+
+    def test_fingerprint(self):
+        options = {
+            'fulltext': u'silva',
+            'meta_type': ['Silva Document', 'Silva Folder'],
+            'path': '/root',
+            'silva-extramodificationtime': {
+                'query': [1, 2], 'range': 'min:max'},
+            'sort_on': 'silva-extramodificationtime',
+            'sort_limit': 20}
+        self.assertEqual(
+            fingerprint(options),
+            'fulltext=?, meta_type=[?], path=?, '
+            'silva-extramodificationtime={query: [?], range: min:max}, '
+            'sort_limit=?, sort_on=silva-extramodificationtime')
+        self.assertEqual(
+            fingerprint({'fulltext': u'zope', 'path': '/root/other'}),
+            fingerprint({'fulltext': u'silva', 'path': '/root'}))
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.95), 95)
+        self.assertEqual(percentile(values, 1), 100)
+        self.assertEqual(percentile([3], 0.5), 3)
+
+    def test_aggregate(self):
+        log = SlowQueryLog(size=10)
+        for index in range(12):
+            log.add({'fulltext': u'silva %d' % index}, '/root/search',
+                    index / 10.0, index)
+        log.add({'path': '/root'}, '/root/other', 5.0, 1)
+        self.assertEqual(len(log), 10)
+        statistics = log.aggregate()
+        self.assertEqual(len(statistics), 2)
+        self.assertEqual(statistics[0]['fingerprint'], 'fulltext=?')
+        self.assertEqual(statistics[0]['count'], 9)
+        self.assertEqual(statistics[0]['paths'], ['/root/search'])
+        self.assertEqual(statistics[0]['max'], 1.1)
+        self.assertEqual(statistics[0]['results'], 11)
+        self.assertEqual(statistics[1]['p50'], 5.0)
+        log.clear()
+        self.assertEqual(log.aggregate(), [])
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(SlowQueryLogTestCase))
+    return suite
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+import unittest
+from array import array
+
+from Products.ZCatalog.Lazy import LazyMap
+
+from Products.SilvaFind.cache import LRUCache
+from Products.SilvaFind.lazy import FilteredResults
+from Products.SilvaFind.snapshot import Records, query_key
+from Products.SilvaFind.snapshot import query_snapshot, take_snapshot
+from Products.SilvaFind.tests.fixtures import Catalog, KeyIndex
+
+
+def viewable(brain):
+    # Every third result is not viewable.
+    return brain.getObject() % 3 != 2
+
+
+class SnapshotTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.status = dict((rid, 'public') for rid in range(10000))
+        self.catalog = Catalog(
+            range(10000), {'publication_status': KeyIndex(self.status)})
+        self.owner = ('/root/search', 'editor')
+
+    def test_query_key(self):
+        key = query_key({'fulltext': u'silva', 'search_submit': 'Search'})
+        self.assertEqual(
+            query_key({'fulltext': u'silva', 'search_submit': 'Search',
+                       'bstart': '20', 'snapshot': 'abc'}),
+            key)
+        self.assertNotEqual(
+            query_key({'fulltext': u'zope', 'search_submit': 'Search'}),
+            key)
+
+    def test_paging(self):
+        """Next pages only create the brains they display, and keep
+        the results of the first page.
+        """
+        results = FilteredResults(self.catalog.searchResults(), viewable)
+        self.assertEqual(
+            [brain.rid for brain in results[:20]][-3:], [25, 27, 28])
+        snapshot = take_snapshot(results, self.owner, 'query')
+        self.assertEqual(snapshot.known, 20)
+        self.assertEqual(len(snapshot), 10000 - 9)
+        self.assertTrue(snapshot.complete)
+        self.assertEqual(snapshot.rids[:3], array('i', [0, 1, 3]))
+
+        # Content is added to the catalog in the meantime.
+        records = self.catalog._catalog
+        records.paths[10000] = '/root/new'
+        records.created = 0
+
+        results = FilteredResults(
+            snapshot.results(self.catalog), viewable, None, None,
+            snapshot.known)
+        self.assertEqual(
+            [brain.rid for brain in results[10:12]], [15, 16])
+        self.assertEqual(records.created, 2)
+        page = [brain.rid for brain in results[100:120]]
+        self.assertEqual(page[:3], [150, 151, 153])
+        self.assertTrue(records.created < 2 + 20 + 140)
+        self.assertEqual(results.count(), (6667, True))
+
+        snapshot = take_snapshot(results, self.owner, 'query')
+        self.assertEqual(snapshot.known, 6667)
+        self.assertEqual(len(snapshot), 6667)
+        self.assertTrue(snapshot.exists(self.catalog, 0, 20))
+        del records.paths[15]
+        self.assertFalse(snapshot.exists(self.catalog, 0, 20))
+        self.assertTrue(snapshot.exists(self.catalog, 20, 40))
+
+        # Unpublished content is still in the catalog.
+        self.status[snapshot.rids[30]] = 'closed'
+        self.assertFalse(snapshot.exists(self.catalog, 20, 40))
+        self.assertTrue(snapshot.exists(self.catalog, 40, 60))
+
+    def test_checked(self):
+        """Results checked by the catalog are all known.
+        """
+        results = FilteredResults(self.catalog.searchResults())
+        results.fetch(20)
+        snapshot = take_snapshot(results, self.owner, 'query', True)
+        self.assertEqual(snapshot.known, 10000)
+
+    def test_extend(self):
+        """A snapshot of limited results is completed when a page
+        needs more of them.
+        """
+        limited = LazyMap(
+            self.catalog._catalog.__getitem__, [5, 3, 1], 3,
+            actual_result_count=10000)
+        results = FilteredResults(limited, viewable, None, None)
+        results.fetch(3)
+        snapshot = take_snapshot(results, self.owner, 'query')
+        self.assertFalse(snapshot.complete)
+        self.assertEqual(list(snapshot.rids), [3, 1])
+
+        results = FilteredResults(
+            snapshot.results(self.catalog), viewable,
+            lambda: snapshot.extend(
+                self.catalog, self.catalog.searchResults()),
+            None, snapshot.known)
+        self.assertEqual(len(results), 10000 - 1)
+        self.assertEqual(
+            [brain.rid for brain in results[:4]], [3, 1, 0, 4])
+        snapshot = take_snapshot(results, self.owner, 'query')
+        self.assertTrue(snapshot.complete)
+        self.assertEqual(snapshot.known, 4)
+
+    def test_scores(self):
+        scored = LazyMap(
+            lambda item: self.catalog._catalog[item[1]],
+            [(8.0, 4), (4.0, 5), (2.0, 6)], 3)
+        results = FilteredResults(scored, viewable)
+        results.fetch(1)
+        snapshot = take_snapshot(results, self.owner, 'query')
+        self.assertEqual(snapshot.highest, 8.0)
+        self.assertEqual(list(snapshot.scores), [8.0, 4.0, 2.0])
+        brain = Records(self.catalog, snapshot.rids, snapshot.scores)[2]
+        self.assertEqual(brain.data_record_score_, 2.0)
+        self.assertEqual(brain.data_record_normalized_score_, 25)
+
+    def test_query_snapshot(self):
+        """Snapshots are only used by their owner, for the same
+        search.
+        """
+        cache = LRUCache(10)
+        results = FilteredResults(self.catalog.searchResults())
+        cache.set('token', take_snapshot(results, self.owner, 'query'))
+        self.assertNotEqual(
+            query_snapshot(cache, 'token', self.owner, 'query'), None)
+        self.assertEqual(
+            query_snapshot(cache, 'token', ('/root/search', None), 'query'),
+            None)
+        self.assertEqual(
+            query_snapshot(cache, 'token', self.owner, 'other'), None)
+        self.assertEqual(
+            query_snapshot(cache, ['token'], self.owner, 'query'), None)
+        self.assertEqual(
+            query_snapshot(None, 'token', self.owner, 'query'), None)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(SnapshotTestCase))
+    return suite
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+import cPickle
+import random
+import unittest
+
+from Products.SilvaFind.results.snippet import SnippetEngine, parse_terms
+from Products.SilvaFind.results.store import SnippetStore, snippet_text
+from Products.SilvaFind.results.store import word_offsets
+
+HILITE = '<strong class="search-result-snippet-hilite">%s</strong>'
+
+
+def document(size, seed=42):
+    generator = random.Random(seed)
+    vocabulary = [
+        ''.join(generator.choice('abcdefghijklmnop')
+                for letter in range(generator.randint(3, 9)))
+        for word in range(3000)]
+    words = [generator.choice(vocabulary) + ',' for word in range(size)]
+    words[size * 3 / 5] = 'Silva'
+    words[size * 3 / 5 + 10] = 'zope.'
+    return words
+
+
+class ScannedText(unicode):
+    """Text that counts the characters scanned to count its spaces,
+    and the number of times it is searched.
+    """
+    scanned = 0
+    searches = 0
+
+    def count(self, sub, start=0, end=None):
+        if end is None:
+            end = len(self)
+        self.scanned += end - start
+        return super(ScannedText, self).count(sub, start, end)
+
+    def find(self, *args):
+        self.searches += 1
+        return super(ScannedText, self).find(*args)
+
+    def rfind(self, *args):
+        self.searches += 1
+        return super(ScannedText, self).rfind(*args)
+
+
+class CountingMatcher(object):
+    """Compiled term expression, that counts how many times it is
+    run.
+    """
+
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.calls = 0
+
+    def match(self, *args):
+        self.calls += 1
+        return self.matcher.match(*args)
+
+    def finditer(self, *args):
+        self.calls += 1
+        return self.matcher.finditer(*args)
+
+
+def counting_matchers(engine):
+    engine.patterns = [
+        (prefix, CountingMatcher(matcher))
+        for prefix, matcher in engine.patterns]
+    return [matcher for prefix, matcher in engine.patterns]
+
+
+class SnippetEngineTestCase(unittest.TestCase):
+
+    def test_terms(self):
+        self.assertEqual(
+            parse_terms('Silva AND zo* NOT plone -zope2 "silva"'),
+            [u'silva', u'zo*'])
+        self.assertEqual(parse_terms(''), [])
+
+    def test_no_terms(self):
+        engine = SnippetEngine('', 3)
+        self.assertEqual(
+            engine.snippet('one two three four'.split()),
+            u'one two three &#8230;')
+        self.assertEqual(engine.snippet([]), u'')
+
+    def test_window(self):
+        """The window with the most different terms is selected, and
+        the terms are highlighted in it.
+        """
+        engine = SnippetEngine('silva zo*', 6)
+        words = 'silva a b c d e f g h Silva, i zope. j k l m n'.split()
+        self.assertEqual(
+            engine.snippet(words),
+            u'&#8230; h %s, i %s. j k &#8230;' % (
+                HILITE % 'Silva', HILITE % 'zope'))
+
+        # Only whole words are matched.
+        self.assertEqual(
+            engine.snippet('silvafind asilva zope2 silva'.split()),
+            u'silvafind asilva %s %s' % (HILITE % 'zope2', HILITE % 'silva'))
+
+    def test_escape(self):
+        engine = SnippetEngine('silva', 3)
+        self.assertEqual(
+            engine.snippet(['<b>silva</b>']),
+            u'&lt;b&gt;%s&lt;/b&gt;' % (HILITE % 'silva'))
+
+    def test_unicode(self):
+        engine = SnippetEngine(u'café', 3)
+        self.assertEqual(
+            engine.snippet(['un', 'Café', 'noir']),
+            u'un %s noir' % (HILITE % u'Café'))
+
+    def test_complexity(self):
+        """Building a snippet goes through the text of the document
+        about once: the term expressions only run where their prefix
+        is found, and the words are only counted up to the terms.
+        """
+        text = ScannedText(u' '.join(document(5000)))
+        engine = SnippetEngine('silva zope')
+        matchers = counting_matchers(engine)
+        self.assertTrue((HILITE % 'Silva') in engine.snippet(text))
+        self.assertEqual(
+            [matcher.calls for matcher in matchers],
+            [text.lower().count(term) for term in engine.terms])
+        self.assertTrue(
+            text.scanned <= 2 * len(text),
+            u'Scanned %d characters of %d' % (text.scanned, len(text)))
+        self.assertTrue(text.searches <= 2 * engine.size + 1)
+
+
+class Content(object):
+    """Cataloging attributes stand-in, that counts how many times its
+    fulltext is computed.
+    """
+
+    def __init__(self, words):
+        self.words = words
+        self.calls = 0
+
+    def fulltext(self):
+        self.calls += 1
+        return ['id', 'Title', ' '.join(self.words)]
+
+
+class SnippetStoreTestCase(unittest.TestCase):
+
+    def test_text(self):
+        self.assertEqual(
+            snippet_text(Content(['Silva ', u'café', '\tzope'])),
+            u'Silva café zope')
+        self.assertEqual(snippet_text(object()), None)
+        self.assertEqual(list(word_offsets(u'Silva café zope')), [0, 6, 11])
+        self.assertEqual(list(word_offsets(u'')), [0])
+
+    def test_fulltext_once(self):
+        """The fulltext is computed once by the store, that leaves the
+        cataloged object untouched.
+        """
+        store = SnippetStore('snippets')
+        content = Content(['Silva', 'Zope'])
+        store.index_object(1, content)
+        self.assertEqual(content.calls, 1)
+        self.assertFalse('fulltext' in content.__dict__)
+
+    def test_store(self):
+        store = SnippetStore('snippets')
+        self.assertEqual(store.index_object(1, Content(['Silva', 'Zope'])), 1)
+        self.assertEqual(store.index_object(1, Content(['Silva', 'Zope'])), 0)
+        self.assertEqual(store.index_object(2, Content([])), 1)
+        self.assertEqual(store.index_object(3, object()), 0)
+        self.assertEqual(store.numObjects(), 2)
+        self.assertEqual(store.getText(1), u'Silva Zope')
+        self.assertEqual(store.getText(2), u'')
+        self.assertEqual(store.getText(3), None)
+        self.assertEqual(list(store.getOffsets(1)), [0, 6])
+        self.assertEqual(store.getOffsets(3), None)
+
+        store.index_object(1, Content(['Infrae']))
+        self.assertEqual(store.getText(1), u'Infrae')
+        store.unindex_object(1)
+        store.unindex_object(1)
+        self.assertEqual(store.getText(1), None)
+        self.assertEqual(store.numObjects(), 1)
+        self.assertEqual(store._apply_index({'snippets': 'Silva'}), None)
+
+    def test_size(self):
+        """The texts and the offsets of their words are stored
+        compressed, in one small database record per content, and a
+        snippet is built out of the store without scanning the text
+        for its words.
+        """
+        documents = [document(5000, seed) for seed in range(10)]
+        store = SnippetStore('snippets')
+        for rid, words in enumerate(documents):
+            store.index_object(rid, Content(words))
+        raw = sum(len(' '.join(words)) for words in documents)
+        texts = sum(len(text.data) for text in store._texts.values())
+        offsets = store.storageSize() - texts
+        self.assertTrue(
+            texts < raw * 0.5,
+            u'Stored %d bytes for %d bytes of text' % (texts, raw))
+        self.assertTrue(
+            offsets < raw * 0.25,
+            u'Stored %d bytes of offsets for %d bytes of text' % (
+                offsets, raw))
+        record = len(cPickle.dumps(store._texts[0].__getstate__(), 1))
+        self.assertTrue(
+            record < raw / len(documents) * 0.75,
+            u'Database record of %d bytes' % record)
+
+        engine = SnippetEngine('silva zope')
+        for rid, words in enumerate(documents):
+            text = ScannedText(store.getText(rid))
+            self.assertEqual(
+                engine.snippet(text, store.getOffsets(rid)),
+                engine.snippet(words))
+            self.assertEqual((text.scanned, text.searches), (0, 0))
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(SnippetEngineTestCase))
+    suite.addTest(unittest.makeSuite(SnippetStoreTestCase))
+    return suite
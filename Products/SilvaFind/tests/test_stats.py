@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+import unittest
+
+from Products.SilvaFind.stats import Counters, Statistics
+
+
+class StatisticsTestCase(unittest.TestCase):
+
+    def test_counters(self):
+        counters = Counters()
+        counters.started = 0
+        # Three searches a minute ago, one two minutes ago, one now.
+        counters.search(10, now=600)
+        counters.search(20, now=660)
+        counters.search(30, now=690)
+        counters.search(0, now=719)
+        counters.search(40, now=720)
+        counters.increment('pages', 2)
+        snapshot = counters.snapshot(now=725)
+        self.assertEqual(snapshot['searches'], 5)
+        self.assertEqual(snapshot['results'], 100)
+        self.assertEqual(snapshot['average_results'], 20.0)
+        self.assertEqual(snapshot['pages'], 2)
+        self.assertEqual(snapshot['searches_per_minute'], 4 / 5.0)
+
+    def test_rate_start(self):
+        """The rate is not averaged on the minutes before the
+        counters started.
+        """
+        counters = Counters()
+        counters.started = 600
+        counters.search(10, now=610)
+        counters.search(10, now=620)
+        self.assertEqual(counters.getSearchRate(now=630), 0.0)
+        self.assertEqual(counters.getSearchRate(now=670), 2.0)
+
+    def test_statistics(self):
+        statistics = Statistics()
+        statistics.search('/root/search', 5)
+        statistics.search('/root/other', 15)
+        statistics.increment('/root/search', 'sitemaps')
+        snapshot = statistics.snapshot()
+        self.assertEqual(snapshot['total']['searches'], 2)
+        self.assertEqual(snapshot['total']['average_results'], 10.0)
+        self.assertEqual(snapshot['total']['sitemaps'], 1)
+        self.assertEqual(
+            sorted(snapshot['finds']), ['/root/other', '/root/search'])
+        self.assertEqual(snapshot['finds']['/root/other']['results'], 15)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(StatisticsTestCase))
+    return suite
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+import logging
+import time
+import unittest
+
+from Products.SilvaFind.timing import Timer, get_timer, query_timer
+from Products.SilvaFind.timing import logger, report_timer
+
+
+class Request(object):
+
+    def __init__(self):
+        self.other = {}
+
+
+class Service(object):
+    server_timing = True
+    timing_log = True
+
+
+class Content(object):
+
+    def getPhysicalPath(self):
+        return ('', 'root', 'search')
+
+
+class Records(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TimerTestCase(unittest.TestCase):
+
+    def test_timer(self):
+        timer = Timer()
+        with timer.phase('catalog'):
+            pass
+        with timer.phase('render.silva-extra:keywords'):
+            pass
+        with timer.phase('catalog'):
+            pass
+        timer.count('brains', 42)
+        timer.watch('woken', lambda: 3)
+        self.assertEqual(
+            timer.phases, ['catalog', 'render.silva-extra:keywords'])
+        self.assertEqual(timer.getCounters(), {'brains': 42, 'woken': 3})
+        header = timer.getServerTiming()
+        self.assertTrue(header.startswith('catalog;dur='))
+        self.assertTrue('render.silva-extra-keywords;dur=' in header)
+        self.assertTrue(header.endswith('brains;desc=42, woken;desc=3'))
+        self.assertTrue(timer.getSummary().endswith('brains=42 woken=3'))
+
+    def test_request(self):
+        request = Request()
+        self.assertEqual(query_timer(request), None)
+        timer = get_timer(request)
+        self.assertTrue(get_timer(request) is timer)
+        self.assertTrue(query_timer(request) is timer)
+        # Timers of dictionaries are not kept.
+        self.assertEqual(query_timer({}), None)
+        self.assertFalse(get_timer({}) is get_timer({}))
+
+    def test_report(self):
+        """The header is set each time the headers are, the timer is
+        only logged the first time.
+        """
+        timer = Timer()
+        timer.count('brains', 42)
+        records = Records()
+        level = logger.level
+        logger.addHandler(records)
+        logger.setLevel(logging.INFO)
+        try:
+            for index in range(2):
+                headers = {}
+                report_timer(timer, Service(), Content(), headers)
+                self.assertEqual(
+                    headers, {'Server-Timing': 'brains;desc=42'})
+        finally:
+            logger.removeHandler(records)
+            logger.setLevel(level)
+        self.assertEqual(len(records.records), 1)
+
+    def test_overhead(self):
+        """Timing a phase costs a few microseconds.
+        """
+        timer = Timer()
+        start = time.time()
+        for index in xrange(10000):
+            with timer.phase('render'):
+                pass
+        duration = (time.time() - start) / 10000
+        self.assertTrue(
+            duration < 0.00005, u'Timing took %.7fs' % duration)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TimerTestCase))
+    return suite
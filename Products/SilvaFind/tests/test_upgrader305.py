@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+import unittest
+
+from zope.component import getUtility
+from silva.core.services.interfaces import ICatalogService
+
+from Products.SilvaFind.catalog import ALLOWED_INDEX, RESULT_COLUMNS
+from Products.SilvaFind.testing import FunctionalLayer
+from Products.SilvaFind.upgrader.upgrade_305 import catalog_upgrader
+
+
+class CatalogUpgraderTestCase(unittest.TestCase):
+    """Test upgrader which installs the security index and the result
+    columns in the catalog of existing sites.
+    """
+    layer = FunctionalLayer
+
+    def setUp(self):
+        self.root = self.layer.get_application()
+        self.layer.login('editor')
+        factory = self.root.manage_addProduct['Silva']
+        factory.manage_addPublication('pub', 'Pub')
+        # Site installed before the index and the columns existed.
+        catalog = getUtility(ICatalogService)
+        catalog.delIndex(ALLOWED_INDEX)
+        for name in RESULT_COLUMNS:
+            if name in catalog.schema():
+                catalog.delColumn(name)
+
+    def test_upgrade_catalog(self):
+        catalog = getUtility(ICatalogService)
+        self.assertTrue(catalog_upgrader.validate(self.root))
+        catalog_upgrader.upgrade(self.root)
+        self.assertFalse(catalog_upgrader.validate(self.root))
+
+        brains = catalog(path='/root/pub')
+        self.assertEqual(len(brains), 1)
+        self.assertEqual(brains[0].silvafind_content_path, '/root/pub')
+        self.assertEqual(brains[0].silvafind_content_type, 'Silva Publication')
+        self.assertEqual(brains[0].silvafind_breadcrumb, 'Pub')
+        index = catalog.Indexes[ALLOWED_INDEX]
+        self.assertTrue(index.getEntryForObject(brains[0].getRID()))
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(CatalogUpgraderTestCase))
+    return suite
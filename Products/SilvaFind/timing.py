@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+import logging
+import re
+import time
+
+logger = logging.getLogger('Products.SilvaFind')
+
+# Key of the timer in the request.
+TIMER_KEY = 'silvafind.timer'
+# Characters not allowed in a Server-Timing metric name.
+NON_TOKEN = re.compile(r"[^\w!#$%&'*+.^`|~-]")
+
+
+class Phase(object):
+    """Context manager adding the time spent in it to a phase of a
+    timer.
+    """
+    __slots__ = ('timer', 'name', 'start')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timer.add(self.name, time.time() - self.start)
+        return False
+
+
+class Timer(object):
+    """Wall time spent in each phase of a search request, and
+    counters about it.
+    """
+
+    def __init__(self):
+        self.phases = []
+        self.durations = {}
+        self.counters = {}
+        self.gauges = {}
+        self.logged = False
+
+    def phase(self, name):
+        return Phase(self, name)
+
+    def add(self, name, duration):
+        if name not in self.durations:
+            self.phases.append(name)
+            self.durations[name] = duration
+        else:
+            self.durations[name] += duration
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def watch(self, name, gauge):
+        """Report the value returned by gauge when the timer is read.
+        """
+        self.gauges[name] = gauge
+
+    def getCounters(self):
+        counters = dict(self.counters)
+        for name, gauge in self.gauges.items():
+            counters[name] = gauge()
+        return counters
+
+    def getServerTiming(self):
+        """Return the value of a Server-Timing header.
+        """
+        metrics = []
+        for name in self.phases:
+            metrics.append('%s;dur=%.1f' % (
+                    NON_TOKEN.sub('-', name), self.durations[name] * 1000))
+        metrics.extend('%s;desc=%s' % item
+                       for item in sorted(self.getCounters().items()))
+        return ', '.join(metrics)
+
+    def getSummary(self):
+        """Return the phases and counters as key=value pairs.
+        """
+        values = ['%s=%.1fms' % (name, self.durations[name] * 1000)
+                  for name in self.phases]
+        values.extend('%s=%s' % item
+                      for item in sorted(self.getCounters().items()))
+        return ' '.join(values)
+
+
+def get_timer(request):
+    """Return the timer of the request, created if needed. Requests
+    that are not Zope requests get a timer that is not reported.
+    """
+    other = getattr(request, 'other', None)
+    if other is None:
+        return Timer()
+    timer = other.get(TIMER_KEY)
+    if timer is None:
+        timer = other[TIMER_KEY] = Timer()
+    return timer
+
+
+def query_timer(request):
+    """Return the timer of the request, or None if nothing has been
+    timed.
+    """
+    other = getattr(request, 'other', None)
+    if other is None:
+        return None
+    return other.get(TIMER_KEY)
+
+
+def report_timer(timer, service, content, headers):
+    """Add the Server-Timing header to headers, and log the timer,
+    if it is enabled on the find service. The timer is only logged
+    the first time the headers are set.
+    """
+    if service.server_timing:
+        headers['Server-Timing'] = timer.getServerTiming()
+    if service.timing_log and not timer.logged:
+        timer.logged = True
+        logger.info(
+            'find=%s %s',
+            '/'.join(content.getPhysicalPath()), timer.getSummary())
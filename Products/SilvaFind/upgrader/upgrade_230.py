@@ -23,8 +23,8 @@ class SilvaFindUpgrader(BaseUpgrader):
 
     def upgrade(self, obj):
         service = getUtility(IReferenceService)
-        fields = obj.service_find.getSearchSchema().getFields()
-        fields = filter(lambda x: IPathCriterionField.providedBy(x), fields)
+        fields = obj.service_find.getSearchSchema().getFieldsProvidedBy(
+            IPathCriterionField)
         root = obj.get_root()
         root_path = root.getPhysicalPath()
         for field in fields:
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Infrae. All rights reserved.
+# See also LICENSE.txt
+
+import logging
+
+from zope.component import queryAdapter
+
+from Products.SilvaFind.catalog import ALLOWED_INDEX, RESULT_COLUMNS
+from Products.SilvaFind.catalog import install_result_columns
+from Products.SilvaFind.catalog import install_security_index
+from silva.core.services.interfaces import ICatalogingAttributes
+from silva.core.upgrade.upgrade import BaseUpgrader
+
+VERSION_A1='3.0.5'
+
+
+logger = logging.getLogger('silva.core.upgrade')
+
+
+class CatalogUpgrader(BaseUpgrader):
+    """Install the security index and the result columns in the
+    catalog of existing sites, and fill them for the content already
+    cataloged.
+    """
+
+    def validate(self, root):
+        catalog = root.service_catalog
+        columns = catalog.schema()
+        return (ALLOWED_INDEX not in catalog.indexes() or
+                not set(RESULT_COLUMNS).issubset(columns))
+
+    def upgrade(self, root):
+        catalog = root.service_catalog
+        install_security_index(root, catalog)
+        install_result_columns(root, catalog)
+        # Only the new index is updated, along with the columns.
+        for path in list(catalog._catalog.uids.keys()):
+            content = catalog.resolve_path(path)
+            if content is None:
+                logger.warn('cataloged content at %s not found' % path)
+                continue
+            attributes = queryAdapter(content, ICatalogingAttributes)
+            if attributes is not None:
+                catalog.catalog_object(
+                    attributes, path, idxs=[ALLOWED_INDEX], update_metadata=1)
+        logger.info('security index and result columns filled '
+                    'in the catalog')
+        return root
+
+catalog_upgrader = CatalogUpgrader(VERSION_A1, "Silva Root")
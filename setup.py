@@ -36,6 +36,7 @@ setup(name='Products.SilvaFind',
               'silva.batch',
               'silva.core.conf',
               'silva.core.interfaces',
+              'silva.core.layout',
               'silva.core.messages',
               'silva.core.references',
               'silva.core.services',
@@ -48,11 +49,13 @@ setup(name='Products.SilvaFind',
               'zeam.form.silva',
               'zeam.utils.batch',
               'zope.component',
+              'zope.container',
               'zope.event',
               'zope.i18nmessageid',
               'zope.interface',
               'zope.lifecycleevent',
               'zope.publisher',
+              'zope.schema',
               'zope.traversing',
               ],
       )